@@ -0,0 +1,265 @@
+# Parse benchmarks. Runs each grammar over generated inputs of increasing size
+# through each engine and prints one JSON object per run, e.g.
+#
+#   python -m bench.bench --sizes 1K,10K,100K,1M,10M,100M --memory > out.jsonl
+#
+# A record has the grammar, engine, input size in characters, seconds, MB/s,
+# node count and, with --memory, the peak traced allocation. "exponent" is the
+# log-log slope of time against size from the previous size: about 1 for a
+# linear engine, 2 for a quadratic one. Engines that fail or can't run a
+# grammar report "error" instead; engines slower than --max-seconds are not
+# run on larger sizes.
+import argparse
+import json
+import math
+import random
+import sys
+import time
+import tracemalloc
+
+from src.grammar import Grammar
+from src.llrules import Parser
+from src.memo import MemoTable
+from src.rules import ParseContext, Opt, lit, reg, seqn, alt, star, lazy, eof
+
+
+# Repeats records from make_record(i) until the text has at least size characters
+def fill(size, make_record, sep=''):
+    parts = []
+    n = 0
+    i = 0
+    while n < size:
+        record = make_record(i)
+        parts.append(record)
+        n += len(record) + len(sep)
+        i += 1
+    return sep.join(parts)
+
+
+# Expr = Expr '+' Term | Term, Term = Term '*' Factor | Factor, one expression per line
+def arith_grammar():
+    expr = lazy()
+    term = lazy()
+    factor = alt("Factor", reg(r'[0-9]+'), seqn("Paren", lit('('), expr, lit(')')))
+    term_r = alt("Term", seqn("Mul", term, lit('*'), factor), factor)
+    term.set_rule(term_r)
+    expr_r = alt("Expr", seqn("Add", expr, lit('+'), term_r), term_r)
+    expr.set_rule(expr_r)
+    return seqn("Lines", star("Body", seqn("Line", expr_r, lit('\n'))), eof())
+
+
+def arith_input(size, rnd):
+    def line(i):
+        terms = []
+        for _ in range(rnd.randint(1, 6)):
+            t = str(rnd.randint(0, 999))
+            if rnd.random() < 0.3:
+                t = f'{t}*({rnd.randint(0, 99)}+{rnd.randint(0, 99)})'
+            terms.append(t)
+        return '+'.join(terms) + '\n'
+    return fill(size, line)
+
+
+def json_grammar():
+    def tok(pattern):
+        return reg(pattern + r'\s*')
+    value = lazy()
+    string = tok(r'"(?:[^"\\]|\\.)*"')
+    member = seqn("Member", string, tok(':'), value)
+    members = seqn("Members", member, star("MoreMembers", seqn("CommaMember", tok(','), member)))
+    obj = seqn("Object", tok(r'\{'), Opt(members), tok(r'\}'))
+    elements = seqn("Elements", value, star("MoreElements", seqn("CommaElement", tok(','), value)))
+    array = seqn("Array", tok(r'\['), Opt(elements), tok(r'\]'))
+    number = tok(r'-?[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?')
+    value_r = alt("Value", obj, array, string, number, tok('true'), tok('false'), tok('null'))
+    value.set_rule(value_r)
+    return seqn("Json", Opt(reg(r'\s+')), value_r, eof())
+
+
+def json_input(size, rnd):
+    def record(i):
+        tags = ', '.join(f'"t{rnd.randint(0, 50)}"' for _ in range(rnd.randint(0, 4)))
+        return (f'{{"id": {i}, "name": "item \\"{i}\\"", "price": {rnd.random() * 100:.2f}, '
+                f'"active": {"true" if i % 2 else "false"}, "tags": [{tags}], "owner": null}}')
+    return '[\n' + fill(size, record, ',\n') + '\n]\n'
+
+
+def csv_grammar():
+    field = alt("Field", reg(r'"(?:[^"]|"")*"'), reg(r'[^,"\n]+'))
+    row = seqn("Row", Opt(field), star("Fields", seqn("Comma", lit(','), Opt(field))), lit('\n'))
+    return seqn("Csv", star("Rows", row), eof())
+
+
+def csv_input(size, rnd):
+    def row(i):
+        return f'{i},name{i},"quoted, ""field""",{rnd.randint(0, 10 ** 6)},,{rnd.random():.4f}\n'
+    return fill(size, row)
+
+
+# An Alt chain LEVELS deep: A0 = 'x0', Ak = 'yk' | A(k-1). Items are mostly
+# from the bottom levels, so most of them go through every alternative.
+LEVELS = 40
+
+
+def nested_grammar():
+    rule = lit('x0')
+    for k in range(1, LEVELS):
+        rule = alt(f'A{k}', lit(f'y{k}'), rule)
+    return seqn("Nested", star("Items", seqn("Item", rule, lit(' '))), eof())
+
+
+def nested_input(size, rnd):
+    def item(i):
+        k = min(int(rnd.expovariate(0.3)), LEVELS - 1)
+        return 'x0 ' if k == 0 else f'y{k} '
+    return fill(size, item)
+
+
+GRAMMARS = {
+    'arith': (arith_grammar, arith_input),
+    'json': (json_grammar, json_input),
+    'csv': (csv_grammar, csv_input),
+    'nested': (nested_grammar, nested_input),
+}
+
+
+def run_apply(g, root, text):
+    return root.apply(text, 0, 0, ctx=ParseContext())
+
+
+def run_packrat(g, root, text):
+    return root.apply(text, 0, 0, ctx=ParseContext(MemoTable()))
+
+
+# Scanning time is included
+def run_lexer(g, root, text):
+    return root.apply(g.tokenize(text), 0, 0, ctx=ParseContext())
+
+
+def run_grammar(g, root, text):
+    return g.parse(root, text)
+
+
+def run_llrules(g, root, text):
+    return Parser(text).apply(root)
+
+
+def run_vm(g, root, text):
+    return g.compile(root).run(text)
+
+
+ENGINES = {
+    'apply': run_apply,
+    'packrat': run_packrat,
+    'lexer': run_lexer,
+    'grammar': run_grammar,
+    'llrules': run_llrules,
+    'vm': run_vm,
+}
+
+
+def count_nodes(root):
+    n = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        n += 1
+        stack.extend(node.children)
+    return n
+
+
+def parse_size(s):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    s = s.strip().upper()
+    if s[-1:] in units:
+        return int(float(s[:-1]) * units[s[-1]])
+    return int(s)
+
+
+def setup(make_grammar, dispatch):
+    root = make_grammar()
+    g = Grammar()
+    g.add(root)
+    root = root.remove_lazy_rules()
+    g.set_nullables()
+    g.set_left_recursives()
+    if dispatch:
+        g.set_firsts()
+        g.set_dispatch_tables()
+    return g, root
+
+
+def bench(grammar, engine, size, text, g, root, memory):
+    record = {'grammar': grammar, 'engine': engine, 'size': len(text), 'target_size': size}
+    run = ENGINES[engine]
+    try:
+        start = time.perf_counter()
+        ptree = run(g, root, text)
+        seconds = time.perf_counter() - start
+    except Exception as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+        return record
+    if ptree is None:
+        record['error'] = 'no parse tree returned'
+        return record
+    record['seconds'] = seconds
+    record['mb_per_s'] = len(text) / (1 << 20) / seconds if seconds > 0 else None
+    record['matched'] = ptree.matched
+    record['length'] = ptree.length
+    record['nodes'] = count_nodes(ptree)
+    del ptree
+    if memory:
+        tracemalloc.start()
+        try:
+            run(g, root, text)
+            record['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return record
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Parse benchmarks, one JSON record per line')
+    ap.add_argument('--grammars', default=','.join(GRAMMARS))
+    ap.add_argument('--engines', default=','.join(ENGINES))
+    ap.add_argument('--sizes', default='1K,10K,100K,1M', help='input sizes, e.g. 1K,10M,100M')
+    ap.add_argument('--memory', action='store_true', help='measure peak memory with tracemalloc (extra run)')
+    ap.add_argument('--dispatch', action='store_true', help='install FIRST set dispatch tables')
+    ap.add_argument('--max-seconds', type=float, default=60.0, help='skip larger sizes once a run takes longer')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', default=None, help='output file, default stdout')
+    args = ap.parse_args(argv)
+    sizes = sorted(parse_size(s) for s in args.sizes.split(','))
+    out = open(args.out, 'w') if args.out else sys.stdout
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    try:
+        for grammar in args.grammars.split(','):
+            make_grammar, make_input = GRAMMARS[grammar]
+            g, root = setup(make_grammar, args.dispatch)
+            engines = args.engines.split(',')
+            slow = set()
+            previous = {}
+            for size in sizes:
+                text = make_input(size, random.Random(args.seed))
+                for engine in engines:
+                    if engine in slow:
+                        record = {'grammar': grammar, 'engine': engine, 'size': len(text), 'target_size': size,
+                                  'error': f'skipped, a smaller input took over {args.max_seconds}s'}
+                    else:
+                        record = bench(grammar, engine, size, text, g, root, args.memory)
+                    seconds = record.get('seconds')
+                    if seconds is not None:
+                        prev = previous.get(engine)
+                        if prev is not None and prev[1] > 0 and seconds > 0:
+                            record['exponent'] = math.log(seconds / prev[1]) / math.log(record['size'] / prev[0])
+                        previous[engine] = (record['size'], seconds)
+                        if seconds > args.max_seconds:
+                            slow.add(engine)
+                    print(json.dumps(record), file=out, flush=True)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+from src.rules import Alt, Seq, Opt, Star, resolve
+
+
+# Rules reachable from roots through subrules, in discovery order
+def reachable(roots):
+    found = []
+    seen = set()
+    stack = [resolve(r) for r in reversed(list(roots))]
+    while stack:
+        rule = stack.pop()
+        if id(rule) in seen:
+            continue
+        seen.add(id(rule))
+        found.append(rule)
+        for child in reversed(rule.subrules):
+            child = resolve(child)
+            if id(child) not in seen:
+                stack.append(child)
+    return found
+
+
+# Sets is_nullable on Alt and Seq rules with a worklist: every rule is queued
+# at most once and every subrule edge is looked at a constant number of times.
+# Other rule classes keep the flag they were built with.
+def compute_nullables(rules):
+    parents = {}
+    pending = {}
+    work = []
+    for rule in rules:
+        if isinstance(rule, Alt) or isinstance(rule, Seq):
+            rule.is_nullable = False
+            for child in rule.subrules:
+                parents.setdefault(id(resolve(child)), []).append(rule)
+            if isinstance(rule, Seq):
+                # An empty Seq fails, as in Rule.apply, so it never becomes nullable
+                pending[id(rule)] = len(rule.subrules)
+        if rule.is_nullable:
+            work.append(rule)
+    while work:
+        rule = work.pop()
+        for parent in parents.get(id(rule), ()):
+            if parent.is_nullable:
+                continue
+            if isinstance(parent, Seq):
+                pending[id(parent)] -= 1
+                if pending[id(parent)] > 0:
+                    continue
+            parent.is_nullable = True
+            work.append(parent)
+
+
+# Subrules that can be called at the position where rule itself starts
+def left_calls(rule):
+    if isinstance(rule, Alt) or isinstance(rule, Opt) or isinstance(rule, Star):
+        return [resolve(c) for c in rule.subrules]
+    if isinstance(rule, Seq):
+        calls = []
+        for child in rule.subrules:
+            child = resolve(child)
+            calls.append(child)
+            if not child.is_nullable:
+                break
+        return calls
+    return []
+
+
+# Tarjan's algorithm with an explicit stack. edges(rule) lists successors.
+# Returns the strongly connected components in reverse topological order.
+def strongly_connected_components(rules, edges):
+    index = {}
+    low = {}
+    on_stack = set()
+    scc_stack = []
+    sccs = []
+    counter = 0
+    for root in rules:
+        if id(root) in index:
+            continue
+        work = [(root, iter(edges(root)))]
+        index[id(root)] = low[id(root)] = counter
+        counter += 1
+        scc_stack.append(root)
+        on_stack.add(id(root))
+        while work:
+            rule, successors = work[-1]
+            advanced = False
+            for succ in successors:
+                if id(succ) not in index:
+                    index[id(succ)] = low[id(succ)] = counter
+                    counter += 1
+                    scc_stack.append(succ)
+                    on_stack.add(id(succ))
+                    work.append((succ, iter(edges(succ))))
+                    advanced = True
+                    break
+                elif id(succ) in on_stack:
+                    low[id(rule)] = min(low[id(rule)], index[id(succ)])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[id(parent)] = min(low[id(parent)], low[id(rule)])
+            if low[id(rule)] == index[id(rule)]:
+                scc = []
+                while True:
+                    member = scc_stack.pop()
+                    on_stack.discard(id(member))
+                    scc.append(member)
+                    if member is rule:
+                        break
+                sccs.append(scc)
+    return sccs
+
+
+# Sets is_left_recursive and returns the left-recursive SCCs of the left-call
+# graph: a rule is left recursive when it shares an SCC with another rule or
+# calls itself at its own start position.
+def compute_left_recursives(rules):
+    sccs = strongly_connected_components(rules, left_calls)
+    recursive = []
+    for scc in sccs:
+        is_rec = len(scc) > 1 or any(c is scc[0] for c in left_calls(scc[0]))
+        for rule in scc:
+            rule.is_left_recursive = is_rec
+        if is_rec:
+            recursive.append(scc)
+    return recursive
+
+
+def first_of(rule):
+    if isinstance(rule, Alt) or isinstance(rule, Opt) or isinstance(rule, Star) or isinstance(rule, Seq):
+        children = left_calls(rule)
+    else:
+        return None
+    first = frozenset()
+    for child in children:
+        if child.first is None:
+            return None
+        first = first | child.first
+    return first
+
+
+# Sets rule.first for every rule. A rule's FIRST set depends only on its left
+# calls, so components are solved callees first and only rules inside a
+# recursive component need more than one pass. Requires is_nullable.
+def compute_firsts(rules):
+    for scc in strongly_connected_components(rules, left_calls):
+        for rule in scc:
+            rule.first = rule.first_chars() if not rule.subrules else frozenset()
+        changed = True
+        while changed:
+            changed = False
+            for rule in scc:
+                if rule.subrules and rule.first is not None:
+                    first = first_of(rule)
+                    if first != rule.first:
+                        rule.first = first
+                        changed = True
@@ -0,0 +1,143 @@
+import os
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import islice
+
+from src.memo import MemoTable
+from src.parallel import number_rules
+from src.rules import ParseContext, ParseNode, ParseError
+
+# Inputs per task handed to a pool worker
+CHUNK_SIZE = 256
+
+# Tasks queued per worker ahead of the results being read, so a slow consumer
+# doesn't make the whole batch pile up in memory
+TASKS_PER_WORKER = 2
+
+
+# Parses each buffer of buffers from position 0 with rule and yields the root
+# ParseNodes in input order, as grammar.parse would one by one. Everything that
+# doesn't depend on the input is set up once: the ParseContext and its memo
+# table (with memo set), reset between inputs, and the grammar's rule kinds.
+# With errors set it yields (node, errors) pairs instead, errors being the
+# list of ParseErrors Recover rules recorded for that input. buffers can be
+# any iterable and is read as results are consumed. The grammar's tracer only
+# sees the inputs parsed in the calling thread.
+#
+# With workers > 1 the inputs go in chunks of chunk_size to a pool of threads,
+# which only helps when the parse releases the GIL, e.g. on a free-threaded
+# build, or with processes set to a pool of processes. A process sends its
+# trees back as flat arrays with rules as numbers, which are linked back into
+# ParseNodes in one pass; nodes shared through the memo come back as copies.
+def parse_many(grammar, rule, buffers, memo: bool = False, workers: int = None, processes: bool = False,
+               chunk_size: int = CHUNK_SIZE, errors: bool = False):
+    if workers is None:
+        workers = (os.cpu_count() or 1) if processes else 1
+    if workers <= 1:
+        yield from parse_serial(grammar, rule, buffers, memo, grammar.tracer, errors)
+        return
+    chunks = iter_chunks(buffers, chunk_size)
+    if processes:
+        pool = ProcessPoolExecutor(workers, initializer=init_worker, initargs=(grammar, rule, memo, errors))
+        rules = list(number_rules(rule))
+        yield from run_pool(pool, parse_chunk_flat, chunks, workers, lambda flat: unflatten(flat, rules))
+    else:
+        pool = ThreadPoolExecutor(workers)
+        yield from run_pool(pool, lambda chunk: list(parse_serial(grammar, rule, chunk, memo, None, errors)), chunks,
+                            workers, None)
+
+
+def parse_serial(grammar, rule, buffers, memo: bool, tracer=None, errors: bool = False):
+    ctx = ParseContext(MemoTable() if memo else None, tracer)
+    parse = grammar.parse
+    for buffer in buffers:
+        ctx.reset()
+        node = parse(rule, buffer, 0, ctx)
+        yield (node, ctx.errors) if errors else node
+
+
+def iter_chunks(items, size: int):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Runs fn on each chunk in pool, keeping up to TASKS_PER_WORKER tasks per
+# worker queued, and yields the items of the results in order, after load
+def run_pool(pool, fn, chunks, workers: int, load):
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.submit(fn, chunk))
+            if len(pending) >= workers * TASKS_PER_WORKER:
+                result = pending.popleft().result()
+                yield from result if load is None else load(result)
+        while pending:
+            result = pending.popleft().result()
+            yield from result if load is None else load(result)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+# Worker state: the grammar, start rule and its rules by number, and whether
+# to memoize and to return errors
+worker_grammar = None
+worker_rule = None
+worker_numbers = None
+worker_memo = False
+worker_errors = False
+
+
+def init_worker(grammar, rule, memo: bool, errors: bool = False):
+    global worker_grammar, worker_rule, worker_numbers, worker_memo, worker_errors
+    worker_grammar = grammar
+    worker_rule = rule
+    worker_numbers = {id(r): i for i, r in enumerate(number_rules(rule))}
+    worker_memo = memo
+    worker_errors = errors
+
+
+# The trees of a chunk in preorder, one after the other, as arrays of parent
+# indices (-1 for a root), rule numbers, starts, matched flags and lengths,
+# and with worker_errors the errors of each tree with rules as numbers, else
+# None
+def parse_chunk_flat(chunk):
+    numbers = worker_numbers
+    parents = array('i')
+    rules = array('i')
+    starts = array('q')
+    matched = array('b')
+    lengths = array('q')
+    errors = [] if worker_errors else None
+    for result in parse_serial(worker_grammar, worker_rule, chunk, worker_memo, None, worker_errors):
+        tree = result
+        if errors is not None:
+            tree, found = result
+            errors.append([(e.pos, tuple(numbers[id(r)] for r in e.expected), e.start, e.end) for e in found])
+        stack = [(tree, -1)]
+        while stack:
+            node, parent = stack.pop()
+            i = len(parents)
+            parents.append(parent)
+            rules.append(numbers[id(node.rule)])
+            starts.append(node.start)
+            matched.append(node.matched)
+            lengths.append(node.length)
+            for c in reversed(node.children):
+                stack.append((c, i))
+    return parents, rules, starts, matched, lengths, errors
+
+
+def unflatten(flat, rules):
+    parents, numbers, starts, matched, lengths, errors = flat
+    nodes = ParseNode.from_arrays(parents, [rules[n] for n in numbers], starts, map(bool, matched), lengths)
+    roots = [node for node, p in zip(nodes, parents) if p < 0]
+    if errors is None:
+        return roots
+    return [(root, [ParseError(pos, frozenset(rules[n] for n in expected), start, end)
+                    for pos, expected, start, end in found])
+            for root, found in zip(roots, errors)]
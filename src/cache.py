@@ -0,0 +1,241 @@
+import hashlib
+import importlib
+import marshal
+import os
+import re
+import struct
+import sys
+
+from src.grammar import Grammar
+from src.rules import Rule, Lazy, LiteralTable, resolve
+
+MAGIC = b'PEGCACHE'
+# Bumped whenever the layout below changes
+FORMAT_VERSION = 2
+
+# Rule attributes set by the Grammar passes rather than by the rule definition
+ANALYSIS = frozenset({'is_nullable', 'is_left_recursive', 'first', 'dispatch', 'dispatch_default',
+                      'literals', 'guard', 'shape', 'debug'})
+
+# Classes other than rules whose instances may appear in rule attributes
+VALUE_CLASSES = (LiteralTable,)
+
+
+# Writes grammar, with every rule attribute the Grammar passes computed, to
+# path. The file holds MAGIC, the length of the header, the header: format
+# version, Python bytecode tag (marshal's format follows the interpreter), code
+# stamp and key, then the rules as one flat table in which rules refer to each
+# other by index. Regexes are stored as their source. The file is replaced
+# atomically.
+def save(grammar: Grammar, path: str, key: str):
+    table = RuleTable()
+    state = table.encode({'rules': grammar.rules, 'left_rec_sccs': grammar.left_rec_sccs,
+                          'scc_index': grammar.scc_index})
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        header = marshal.dumps(header_fields(key))
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        marshal.dump((table.entries(), state), f)
+    os.replace(tmp, path)
+
+
+# Reads a grammar written by save with the same key. Rules are rebuilt from
+# the table without running their constructors or any Grammar pass; only the
+# regexes are compiled again. Returns None if there is no such file, it was
+# written for another key, format version, Python version or version of the
+# rule classes, or it can't be decoded.
+def load(path: str, key: str):
+    try:
+        with open(path, 'rb') as f:
+            # marshal.load reads a file object in small pieces, loads a bytes object at once
+            head = f.read(len(MAGIC) + 4)
+            if head[:len(MAGIC)] != MAGIC:
+                return None
+            header = f.read(struct.unpack('<I', head[len(MAGIC):])[0])
+            if marshal.loads(header) != header_fields(key):
+                return None
+            entries, state = marshal.loads(f.read())
+        classes = {}
+        for cls, _ in entries:
+            if cls not in classes:
+                classes[cls] = rule_class(cls)
+        rules = [classes[cls].__new__(classes[cls]) for cls, _ in entries]
+        for rule, (_, attrs) in zip(rules, entries):
+            for name, value in attrs:
+                setattr(rule, name, decode(value, rules))
+        grammar = Grammar()
+        for name, value in decode(state, rules).items():
+            setattr(grammar, name, value)
+    except (OSError, EOFError, ValueError, TypeError, IndexError, KeyError, ImportError, AttributeError,
+            re.error, struct.error):
+        return None
+    return grammar
+
+
+# Returns the grammar cached at path for roots and passes, building and caching
+# it if needed: the rules reachable from roots are added to a new Grammar and
+# the named Grammar methods run on it in order, e.g. ('set_firsts',
+# 'set_dispatch_tables', 'set_left_recursives'). The returned grammar has its
+# own rule objects; look the start rule up in grammar.rules.
+def load_or_build(path: str, roots, passes=()):
+    key = fingerprint(*roots, passes=passes)
+    grammar = load(path, key)
+    if grammar is None:
+        grammar = Grammar()
+        grammar.add(*roots)
+        for name in passes:
+            getattr(grammar, name)()
+        save(grammar, path, key)
+    return grammar
+
+
+def header_fields(key: str):
+    return FORMAT_VERSION, sys.implementation.cache_tag, code_stamp(), key
+
+
+# Stamp of the code of this package's rule classes and VALUE_CLASSES: a hash
+# of the bytecode of their functions and the names, attributes included, that
+# those use. A cache written before the classes changed, e.g. before a Grammar
+# pass added an attribute the rules now read, then isn't loaded.
+def code_stamp():
+    global CODE_STAMP
+    if CODE_STAMP is None:
+        package = Rule.__module__.partition('.')[0]
+        classes = [Rule]
+        for cls in classes:
+            classes.extend(cls.__subclasses__())
+        classes = {class_path(c): c for c in classes + list(VALUE_CLASSES)
+                   if c.__module__.partition('.')[0] == package}
+        h = hashlib.sha256()
+        for path, cls in sorted(classes.items()):
+            h.update(path.encode())
+            for name, value in sorted(vars(cls).items()):
+                if isinstance(value, property):
+                    value = value.fget
+                code = getattr(value, '__code__', None)
+                if code is not None:
+                    h.update(repr((name, code.co_names, code.co_varnames)).encode())
+                    h.update(code.co_code)
+        CODE_STAMP = h.hexdigest()
+    return CODE_STAMP
+
+
+CODE_STAMP = None
+
+
+# Hash of the definition of the rules reachable from roots and of passes: rule
+# classes, names, literals, regex sources and how the rules refer to each
+# other, but not what the Grammar passes computed. It is the same before and
+# after Grammar.add resolves the Lazy rules, and across processes.
+def fingerprint(*roots, passes=()):
+    table = RuleTable(ANALYSIS)
+    for root in roots:
+        table.ref(root)
+    return hashlib.sha256(repr((FORMAT_VERSION, table.entries(), tuple(passes))).encode()).hexdigest()
+
+
+# Numbers rules in the order they are met and encodes their attributes with
+# only marshal-able values: rules become ('r', index), containers and other
+# values become tagged tuples. Sets are stored sorted, so the encoding of a
+# definition doesn't depend on string hashing.
+class RuleTable:
+
+    def __init__(self, skip=frozenset()):
+        self.skip = skip
+        self.index = {}
+        self.rules = []
+        self.attrs = []
+
+    def ref(self, rule):
+        rule = resolve(rule)
+        i = self.index.get(id(rule))
+        if i is None:
+            i = self.index[id(rule)] = len(self.rules)
+            self.rules.append(rule)
+            self.attrs.append(None)
+        return i
+
+    # (class path, attributes) of every rule referenced so far, including the
+    # ones their attributes refer to
+    def entries(self):
+        i = 0
+        while i < len(self.rules):
+            if self.attrs[i] is None:
+                rule = self.rules[i]
+                self.attrs[i] = tuple((name, self.encode(value)) for name, value in sorted(vars(rule).items())
+                                      if name not in self.skip)
+            i += 1
+        return tuple((class_path(r.__class__), a) for r, a in zip(self.rules, self.attrs))
+
+    def encode(self, value):
+        if value is None or isinstance(value, (bool, int, float, str, bytes)):
+            return value
+        if isinstance(value, (Rule, Lazy)):
+            return 'r', self.ref(value)
+        if isinstance(value, list):
+            return 'l', tuple(self.encode(v) for v in value)
+        if isinstance(value, tuple):
+            return 't', tuple(self.encode(v) for v in value)
+        if isinstance(value, (set, frozenset)):
+            tag = 's' if isinstance(value, set) else 'f'
+            return tag, tuple(sorted((self.encode(v) for v in value), key=repr))
+        if isinstance(value, dict):
+            return 'd', tuple((self.encode(k), self.encode(v)) for k, v in value.items())
+        if isinstance(value, re.Pattern):
+            return 'p', value.pattern, value.flags
+        if isinstance(value, VALUE_CLASSES):
+            return 'o', class_path(value.__class__), self.encode(vars(value))
+        raise TypeError(f'Cannot cache {value!r}')
+
+
+def decode(value, rules):
+    if value.__class__ is not tuple:
+        return value
+    tag, items = value[0], value[1]
+    if tag == 'r':
+        return rules[items]
+    if tag == 'p':
+        return re.compile(items, value[2])
+    if tag == 'o':
+        cls = value_class(items)
+        obj = cls.__new__(cls)
+        obj.__dict__.update(decode(value[2], rules))
+        return obj
+    if tag == 'd':
+        return {decode(k, rules): decode(v, rules) for k, v in items}
+    # Most containers hold plain values, e.g. the characters of a FIRST set
+    items = [v if v.__class__ is not tuple else decode(v, rules) for v in items]
+    if tag == 'l':
+        return items
+    if tag == 't':
+        return tuple(items)
+    if tag == 's':
+        return set(items)
+    return frozenset(items)
+
+
+def class_path(cls):
+    return f'{cls.__module__}:{cls.__qualname__}'
+
+
+def find_class(path: str):
+    module, _, name = path.partition(':')
+    cls = importlib.import_module(module)
+    for part in name.split('.'):
+        cls = getattr(cls, part)
+    return cls
+
+
+# Only rule classes and VALUE_CLASSES are instantiated from a cache file
+def rule_class(path: str):
+    cls = find_class(path)
+    if not (isinstance(cls, type) and issubclass(cls, Rule)):
+        raise ValueError(f'{path} is not a rule class')
+    return cls
+
+
+def value_class(path: str):
+    cls = find_class(path)
+    if cls not in VALUE_CLASSES:
+        raise ValueError(f'{path} is not a cacheable class')
+    return cls
@@ -0,0 +1,149 @@
+import re
+import sys
+
+try:
+    import re._parser as sre_parse
+    from re._constants import LITERAL, IN, RANGE, BRANCH, SUBPATTERN, MAX_REPEAT, MIN_REPEAT, AT, ASSERT, ASSERT_NOT, MAXREPEAT
+    from re._constants import CATEGORY, CATEGORY_SPACE, CATEGORY_DIGIT
+except ImportError:
+    import sre_parse
+    from sre_constants import LITERAL, IN, RANGE, BRANCH, SUBPATTERN, MAX_REPEAT, MIN_REPEAT, AT, ASSERT, ASSERT_NOT, MAXREPEAT
+    from sre_constants import CATEGORY, CATEGORY_SPACE, CATEGORY_DIGIT
+
+# Ranges wider than this are not expanded into explicit character sets
+MAX_RANGE = 1024
+
+# Marks end of input in FIRST sets, since no buffer character equals ''
+END = ''
+
+# Character tests equivalent to the \s and \d categories of a str pattern
+CATEGORY_TESTS = {CATEGORY_SPACE: str.isspace, CATEGORY_DIGIT: str.isdecimal}
+
+# Category -> frozenset of its characters, filled on first use
+category_sets = {}
+
+
+# Characters of a \s or \d category, or None for other categories. Unicode
+# patterns match more than ASCII patterns, so for FIRST sets this is safe
+# either way.
+def category_chars(category):
+    chars = category_sets.get(category)
+    if chars is None:
+        test = CATEGORY_TESTS.get(category)
+        if test is None:
+            return None
+        chars = category_sets[category] = frozenset(c for c in map(chr, range(sys.maxunicode + 1)) if test(c))
+    return chars
+
+
+# Set of characters a single IN / LITERAL item can match, or None if unknown
+def item_chars(op, av):
+    if op == LITERAL:
+        return {chr(av)}
+    if op == IN:
+        chars = set()
+        for iop, iav in av:
+            if iop == LITERAL:
+                chars.add(chr(iav))
+            elif iop == RANGE and iav[1] - iav[0] < MAX_RANGE:
+                chars.update(chr(c) for c in range(iav[0], iav[1] + 1))
+            elif iop == CATEGORY and category_chars(iav) is not None:
+                chars |= category_chars(iav)
+            else:
+                # NEGATE, other categories and wide ranges
+                return None
+        return chars
+    return None
+
+
+# (first chars, nullable) of a parsed pattern sequence; first chars is None when
+# they can't be determined
+def items_first(items):
+    first = set()
+    for op, av in items:
+        chars, nullable = item_first(op, av)
+        if chars is None:
+            return None, False
+        first |= chars
+        if not nullable:
+            return first, False
+    return first, True
+
+
+def item_first(op, av):
+    if op == LITERAL or op == IN:
+        return item_chars(op, av), False
+    if op == BRANCH:
+        first = set()
+        any_nullable = False
+        for items in av[1]:
+            chars, nullable = items_first(items)
+            if chars is None:
+                return None, False
+            first |= chars
+            any_nullable = any_nullable or nullable
+        return first, any_nullable
+    if op == SUBPATTERN:
+        if av[1] & re.IGNORECASE:
+            return None, False
+        return items_first(av[-1])
+    if op == MAX_REPEAT or op == MIN_REPEAT:
+        chars, nullable = items_first(av[2])
+        return chars, nullable or av[0] == 0
+    if op == AT or op == ASSERT or op == ASSERT_NOT:
+        # Zero width: only narrows what may follow
+        return set(), True
+    return None, False
+
+
+# Characters a match of pattern can start with, or None if unknown
+def pattern_first(pattern):
+    if pattern.flags & re.IGNORECASE:
+        return None
+    try:
+        items = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+    chars, nullable = items_first(items)
+    if chars is None or nullable:
+        return None
+    return frozenset(chars)
+
+
+# Length of the longest possible match of pattern, or None if unbounded or
+# unknown. Lookarounds aren't counted.
+def pattern_width(pattern):
+    try:
+        items = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+    width = items.getwidth()[1]
+    return None if width >= MAXREPEAT else width
+
+
+# Character tables of a pattern that is one character class, or a run of them:
+# c, c+ or c d*, with c and d classes item_chars can expand. Returns (first,
+# rest) with the characters of c and d (of c for c+), rest None for c alone,
+# or None for any other pattern or flags.
+def pattern_run(pattern):
+    if pattern.flags & ~re.UNICODE:
+        return None
+    try:
+        items = list(sre_parse.parse(pattern.pattern, pattern.flags))
+    except Exception:
+        return None
+    if len(items) == 1:
+        op, av = items[0]
+        if op == MAX_REPEAT and av[0] == 1 and av[1] == MAXREPEAT and len(av[2]) == 1:
+            chars = item_chars(*av[2][0])
+            return None if chars is None else (frozenset(chars), frozenset(chars))
+        chars = item_chars(op, av)
+        return None if chars is None else (frozenset(chars), None)
+    if len(items) == 2:
+        first = item_chars(*items[0])
+        op, av = items[1]
+        if first is None or op != MAX_REPEAT or av[0] != 0 or av[1] != MAXREPEAT or len(av[2]) != 1:
+            return None
+        rest = item_chars(*av[2][0])
+        return None if rest is None else (frozenset(first), frozenset(rest))
+    return None
@@ -0,0 +1,352 @@
+from bisect import bisect_right, insort
+
+from src.rules import Alt, Seq, Opt, Star, ParseNode, resolve
+
+
+class Production:
+    __slots__ = ('lhs', 'rhs')
+
+    def __init__(self, lhs, rhs):
+        self.lhs = lhs
+        self.rhs = rhs
+
+
+# Items of one Earley set. Items are (production index, dot, origin) tuples.
+class ItemSet:
+    __slots__ = ('items', 'work', 'waiting', 'done', 'leo', 'leo_used', 'finished')
+
+    def __init__(self):
+        self.items = set()
+        self.work = []
+        # id(rule) -> items with that nonterminal after the dot
+        self.waiting = {}
+        # id(rule) -> origins of the completions of rule in this set
+        self.done = {}
+        # id(rule) -> topmost item of the deterministic reduction path, or None
+        self.leo = {}
+        # (rule, origin) completions that took a Leo shortcut
+        self.leo_used = []
+        # done plus the completions skipped by Leo shortcuts, built on demand
+        self.finished = None
+
+
+# Marks the start item, so the start rule's completion can't be skipped by Leo
+START = object()
+
+
+# A general context-free parser over the same rule classes as the PEG
+# engines, with Alt as an unordered choice. Alt, Seq, Opt and Star become
+# productions (a Star S as S -> c S | eps); every other rule is a terminal
+# matched with its own apply_internal, so terminals can have any length,
+# including zero.
+#
+# Parses in cubic time worst case. Leo's optimization makes right recursion,
+# and so Star, linear: a completion whose reduction path is deterministic goes
+# straight to the topmost item. An item waiting on a nonterminal that already
+# completed empty in the same set is advanced at once, which handles nullable
+# rules.
+class EarleyParser:
+
+    def __init__(self):
+        self.prods = []
+        # id(rule) -> production indices, or None for a terminal
+        self.rule_prods = {}
+        # Keeps the rules alive, so their ids stay unique
+        self.known = []
+        # id(rule) -> index of the production START -> rule
+        self.starts = {}
+
+    def productions(self, rule):
+        key = id(rule)
+        try:
+            return self.rule_prods[key]
+        except KeyError:
+            pass
+        if isinstance(rule, Alt):
+            rhss = [(resolve(c),) for c in rule.subrules]
+        elif isinstance(rule, Seq):
+            rhss = [tuple(resolve(c) for c in rule.subrules)]
+        elif isinstance(rule, Opt):
+            rhss = [(resolve(rule.subrules[0]),), ()]
+        elif isinstance(rule, Star):
+            rhss = [(resolve(rule.subrules[0]), rule), ()]
+        else:
+            rhss = None
+        found = None
+        if rhss is not None:
+            found = tuple(range(len(self.prods), len(self.prods) + len(rhss)))
+            self.prods.extend(Production(rule, rhs) for rhs in rhss)
+        self.rule_prods[key] = found
+        self.known.append(rule)
+        return found
+
+    def start_production(self, rule):
+        q = self.starts.get(id(rule))
+        if q is None:
+            q = self.starts[id(rule)] = len(self.prods)
+            self.prods.append(Production(START, (rule,)))
+        return q
+
+    # Parses buffer from pos with rule up to end, or the longest match if end
+    # is None. Returns a ParseNode tree like Rule.apply, unmatched if there is
+    # no parse. For ambiguous input, an Alt picks its first alternative that
+    # fits and earlier Seq and Star children match as much as they can.
+    def parse(self, rule, buffer, pos: int = 0, end: int = None):
+        rule = resolve(rule)
+        chart = Chart(self, buffer)
+        found = chart.run(rule, pos, end)
+        if found is None:
+            return ParseNode(rule, pos)
+        return chart.build(rule, pos, found)
+
+    def recognize(self, rule, buffer, pos: int = 0, end: int = None):
+        return Chart(self, buffer).run(resolve(rule), pos, end) is not None
+
+
+# Per-parse state of an EarleyParser
+class Chart:
+
+    def __init__(self, parser, buffer):
+        self.parser = parser
+        self.prods = parser.prods
+        self.buffer = buffer
+        self.sets = {}
+        # (id(terminal), pos) -> match length or None
+        self.matches = {}
+        # Item -> sorted positions of the sets holding it, for building trees
+        self.item_sets = {}
+        self.end = None
+        self.last = 0
+
+    # Returns the end of the longest parse of rule from pos, or end if given
+    # and rule matches up to it, or None
+    def run(self, rule, pos, end):
+        self.end = end
+        if self.parser.productions(rule) is None:
+            length = self.match(rule, pos)
+            if length is None or (end is not None and pos + length != end):
+                return None
+            return pos + length
+        self.last = pos
+        self.add((self.parser.start_production(rule), 0, pos), pos)
+        found = None
+        j = pos
+        while j <= self.last:
+            s = self.sets.get(j)
+            if s is not None:
+                self.process(s, j)
+                d = s.done.get(id(START))
+                if d is not None and pos in d:
+                    found = j
+            j += 1
+        if end is not None and found != end:
+            return None
+        return found
+
+    def add(self, item, j):
+        if self.end is not None and j > self.end:
+            return
+        s = self.sets.get(j)
+        if s is None:
+            s = self.sets[j] = ItemSet()
+            if j > self.last:
+                self.last = j
+        if item not in s.items:
+            s.items.add(item)
+            s.work.append(item)
+            positions = self.item_sets.get(item)
+            if positions is None:
+                self.item_sets[item] = [j]
+            elif positions[-1] < j:
+                positions.append(j)
+            else:
+                insort(positions, j)
+
+    def match(self, rule, pos):
+        key = (id(rule), pos)
+        try:
+            return self.matches[key]
+        except KeyError:
+            pass
+        if rule.subrules:
+            # A rule class this parser doesn't know, matched as a PEG
+            node = rule.apply(self.buffer, 0, pos)
+        else:
+            node = ParseNode(rule, pos)
+            rule.apply_internal(self.buffer, 0, pos, node)
+        length = node.length if node.matched else None
+        self.matches[key] = length
+        return length
+
+    def process(self, s, j):
+        prods = self.prods
+        productions = self.parser.productions
+        work = s.work
+        while work:
+            item = work.pop()
+            q, dot, origin = item
+            p = prods[q]
+            if dot == len(p.rhs):
+                self.complete(p.lhs, origin, s, j)
+                continue
+            sym = p.rhs[dot]
+            sprods = productions(sym)
+            if sprods is None:
+                length = self.match(sym, j)
+                if length is not None:
+                    self.add((q, dot + 1, origin), j + length)
+                continue
+            key = id(sym)
+            waiting = s.waiting.get(key)
+            if waiting is None:
+                waiting = s.waiting[key] = [item]
+                for r in sprods:
+                    self.add((r, 0, j), j)
+            else:
+                waiting.append(item)
+            done = s.done.get(key)
+            if done is not None and j in done:
+                self.add((q, dot + 1, origin), j)
+
+    def complete(self, rule, i, s, j):
+        key = id(rule)
+        done = s.done.get(key)
+        if done is None:
+            done = s.done[key] = set()
+        if i in done:
+            return
+        done.add(i)
+        if i == j:
+            # Items still to come are advanced when they start waiting
+            for q, dot, origin in list(s.waiting.get(key, ())):
+                self.add((q, dot + 1, origin), j)
+            return
+        top = self.leo(i, rule)
+        if top is not None:
+            s.leo_used.append((rule, i))
+            self.add(top, j)
+            return
+        for q, dot, origin in self.sets[i].waiting.get(key, ()):
+            self.add((q, dot + 1, origin), j)
+
+    # Topmost completed item of the deterministic reduction path of rule
+    # completing from set i, or None. A step is deterministic when exactly one
+    # item in the set waits on the rule and the rule is its last symbol.
+    def leo(self, i, rule):
+        prods = self.prods
+        steps = []
+        seen = set()
+        result = None
+        while True:
+            s = self.sets[i]
+            key = id(rule)
+            if key in s.leo:
+                result = s.leo[key]
+                break
+            waiting = s.waiting.get(key)
+            if waiting is None or len(waiting) != 1 or (i, key) in seen:
+                s.leo[key] = None
+                break
+            q, dot, origin = waiting[0]
+            if dot + 1 != len(prods[q].rhs):
+                s.leo[key] = None
+                break
+            seen.add((i, key))
+            steps.append((s, key, (q, dot + 1, origin)))
+            i = origin
+            rule = prods[q].lhs
+        for s, key, item in reversed(steps):
+            if result is None:
+                result = item
+            s.leo[key] = result
+        return result
+
+    # id(rule) -> origins of every completion in set j, including those a Leo
+    # shortcut skipped
+    def finished(self, j):
+        s = self.sets.get(j)
+        if s is None:
+            return {}
+        if s.finished is None:
+            finished = {k: set(v) for k, v in s.done.items()}
+            for rule, i in s.leo_used:
+                while True:
+                    q, dot, origin = self.sets[i].waiting[id(rule)][0]
+                    rule = self.prods[q].lhs
+                    finished.setdefault(id(rule), set()).add(origin)
+                    if self.sets[origin].leo.get(id(rule)) is None:
+                        break
+                    i = origin
+            s.finished = finished
+        return s.finished
+
+    # Positions up to limit of the sets holding item, last first
+    def item_positions(self, item, limit):
+        positions = self.item_sets.get(item, ())
+        for n in range(bisect_right(positions, limit) - 1, -1, -1):
+            yield positions[n]
+
+    def derives(self, rule, i, j):
+        if self.parser.productions(rule) is None:
+            length = self.match(rule, i)
+            return length is not None and i + length == j
+        origins = self.finished(j).get(id(rule))
+        return origins is not None and i in origins
+
+    # Builds a ParseNode tree for rule matching buffer[i:j], known to be derivable
+    def build(self, rule, i, j):
+        root = None
+        productions = self.parser.productions
+        tasks = [(rule, i, j, None)]
+        while tasks:
+            rule, a, b, parent = tasks.pop()
+            sprods = productions(rule)
+            if sprods is None and rule.subrules:
+                node = rule.apply(self.buffer, 0, a)
+            else:
+                node = ParseNode(rule, a, True, b - a)
+            if parent is None:
+                root = node
+            else:
+                parent.add(node)
+            if sprods is None:
+                continue
+            children = []
+            if isinstance(rule, Alt):
+                for c in (self.prods[q].rhs[0] for q in sprods):
+                    if self.derives(c, a, b):
+                        children.append((c, a, b))
+                        break
+            elif isinstance(rule, Opt):
+                c = self.prods[sprods[0]].rhs[0]
+                if self.derives(c, a, b):
+                    children.append((c, a, b))
+            elif isinstance(rule, Star):
+                q = sprods[0]
+                c = self.prods[q].rhs[0]
+                pos = a
+                while pos < b:
+                    for k in self.item_positions((q, 1, pos), b):
+                        if k > pos and self.derives(rule, k, b):
+                            break
+                    else:
+                        break
+                    children.append((c, pos, k))
+                    pos = k
+            else:
+                q = sprods[0]
+                rhs = self.prods[q].rhs
+                pos = b
+                for m in range(len(rhs), 0, -1):
+                    c = rhs[m - 1]
+                    k = a
+                    if m > 1:
+                        for k in self.item_positions((q, m - 1, a), pos):
+                            if self.derives(c, k, pos):
+                                break
+                    children.append((c, k, pos))
+                    pos = k
+                children.reverse()
+            for c, a, b in reversed(children):
+                tasks.append((c, a, b, node))
+        return root
@@ -0,0 +1,231 @@
+from collections import deque, namedtuple
+
+from src.grammar import rule_kind, OTHER, ALT, SEQ, OPT, STAR
+from src.rules import ParseNode, ParseContext, COMMITTED
+
+START = 'start'
+END = 'end'
+FAIL = 'fail'
+
+# START: rule began a match at start (end is None). END: rule matched
+# buffer[start:end]. FAIL: the whole parse failed; the last event.
+Event = namedtuple('Event', ['kind', 'rule', 'start', 'end'])
+
+
+# Receives the events of parse_events, like a SAX content handler
+class Handler:
+
+    def start(self, rule, start: int):
+        pass
+
+    def end(self, rule, start: int, end: int):
+        pass
+
+    def fail(self, rule, start: int):
+        pass
+
+
+# Engine state for a rule still being matched
+class EventFrame:
+    __slots__ = ('rule', 'kind', 'subrules', 'next_subrule_num', 'start', 'length', 'matched')
+
+    def __init__(self, rule, kind, subrules, start: int):
+        self.rule = rule
+        self.kind = kind
+        self.subrules = subrules
+        self.next_subrule_num = 0
+        self.start = start
+        self.length = 0
+        self.matched = kind == STAR
+
+
+# Parses buffer from pos with rule like Rule.apply, but instead of a tree
+# yields the START and END events of the rules that match, in the order a
+# preorder walk of the matched nodes would visit them. No ParseNode is built,
+# except by rules the engine doesn't run itself: left-recursive ones and rule
+# classes other than Alt, Seq, Opt, Star and terminals.
+#
+# An event is held back while an Alt, Opt or Star could still discard it by
+# backtracking, i.e. while the attempt it belongs to may fail, and yielded as
+# soon as no enclosing attempt is open. So memory is the frame stack plus the
+# events of open attempts; a top level Star yields each record as it ends.
+# Events outside any attempt are final even if the parse fails later, in which
+# case a FAIL event for rule comes last.
+def iter_events(rule, buffer, pos: int = 0, ctx: ParseContext = None):
+    if ctx is None:
+        ctx = ParseContext()
+    kinds = {}
+    release = getattr(buffer, 'release', None)
+    # Events not yielded yet; the first has number flushed
+    pending = deque()
+    flushed = 0
+    # Event numbers where the open attempts of Alt, Opt and Star frames began
+    attempts = []
+    # Lengths of ctx.errors when those attempts began
+    error_marks = []
+    errors = ctx.errors
+    choices = ctx.choices
+    scratch = ParseNode(None, pos)
+    stack = []
+    root = rule
+    root_pos = pos
+    while True:
+        # Call rule at pos; depth is len(stack)
+        kind = kinds.get(rule.__class__)
+        if kind is None:
+            kind = kinds[rule.__class__] = rule_kind(rule.__class__)
+        if stack and stack[-1].kind != SEQ:
+            attempts.append(flushed + len(pending))
+            error_marks.append(len(errors))
+            choices.append(pos)
+        matched = False
+        length = 0
+        if rule.is_left_recursive or (kind == OTHER and rule.subrules):
+            if rule.is_left_recursive:
+                node = ctx.left_rec_parser(buffer).apply(rule, pos)
+            else:
+                node = rule.apply(buffer, len(stack), pos, ctx=ctx)
+            if node.matched:
+                pending.extend(tree_events(node))
+            matched = node.matched
+            length = node.length
+        elif kind == OTHER:
+            scratch.start = pos
+            scratch.length = 0
+            scratch.matched = False
+            rule.apply_internal(buffer, len(stack), pos, scratch, ctx)
+            if scratch.matched:
+                pending.append(Event(START, rule, pos, None))
+                pending.append(Event(END, rule, pos, pos + scratch.length))
+            matched = scratch.matched
+            length = scratch.length
+        else:
+            subrules = rule.subrules
+            if kind == ALT:
+                if rule.literals is not None and buffer.__class__ is str:
+                    i = rule.literals.match(buffer, pos)
+                    if i >= 0:
+                        subrules = (rule.subrules[i],)
+                    else:
+                        subrules = ()
+                        for child in rule.subrules:
+                            ctx.fail(child, pos)
+                elif rule.dispatch is not None:
+                    subrules = rule.dispatch.get(buffer[pos:pos + 1])
+                    if subrules is None:
+                        subrules = rule.dispatch_default
+                        ctx.fail(rule, pos)
+            elif kind == STAR:
+                if rule.guard is not None and buffer[pos:pos + 1] not in rule.guard:
+                    subrules = ()
+                    ctx.fail(rule.subrules[0], pos)
+            frame = EventFrame(rule, kind, subrules, pos)
+            pending.append(Event(START, rule, pos, None))
+            if subrules:
+                stack.append(frame)
+                rule = subrules[0]
+                continue
+            matched = frame.matched or kind == OPT
+            if matched:
+                pending.append(Event(END, rule, pos, pos))
+            else:
+                pending.pop()
+
+        # Return the result to the frames above until one has a subrule to call
+        while stack:
+            frame = stack[-1]
+            kind = frame.kind
+            committed = False
+            if kind != SEQ:
+                mark = attempts.pop()
+                nerrors = error_marks.pop()
+                committed = choices.pop() == COMMITTED
+                if not matched:
+                    # Discard the failed attempt's events and errors
+                    while flushed + len(pending) > mark:
+                        pending.pop()
+                    del errors[nerrors:]
+            k = -1
+            if kind == SEQ:
+                if matched:
+                    frame.length += length
+                    frame.matched = True
+                    k = frame.next_subrule_num + 1
+                else:
+                    frame.matched = False
+            elif kind == ALT:
+                if matched:
+                    frame.length += length
+                    frame.matched = True
+                elif not committed:
+                    k = frame.next_subrule_num + 1
+            elif kind == STAR:
+                if not matched and committed:
+                    # An iteration failed past a cut, so the Star fails
+                    frame.matched = False
+                elif matched and length > 0:
+                    frame.length += length
+                    k = 0
+                    lpos = frame.start + frame.length
+                    # Nothing can backtrack behind a top level Star
+                    if release is not None and len(stack) == 1:
+                        release(lpos)
+                    guard = frame.rule.guard
+                    if guard is not None and buffer[lpos:lpos + 1] not in guard:
+                        ctx.fail(frame.rule.subrules[0], lpos)
+                        k = -1
+            else:
+                # OPT
+                frame.length = length if matched else 0
+                frame.matched = matched or not committed
+            if 0 <= k < len(frame.subrules):
+                frame.next_subrule_num = k
+                rule = frame.subrules[k]
+                pos = frame.start + frame.length if kind != ALT else frame.start
+                break
+            stack.pop()
+            matched = frame.matched
+            length = frame.length
+            if matched:
+                pending.append(Event(END, frame.rule, frame.start, frame.start + length))
+        else:
+            if not matched:
+                pending.append(Event(FAIL, root, root_pos, None))
+        # Yield what no open attempt can take back
+        limit = attempts[0] if attempts else flushed + len(pending)
+        while flushed < limit:
+            yield pending.popleft()
+            flushed += 1
+        if not stack:
+            return
+
+
+# START and END events of the matched nodes of a tree, in preorder
+def tree_events(root):
+    stack = [(root, False)]
+    while stack:
+        node, done = stack.pop()
+        if done:
+            yield Event(END, node.rule, node.start, node.start + node.length)
+            continue
+        if not node.matched:
+            continue
+        yield Event(START, node.rule, node.start, None)
+        stack.append((node, True))
+        for c in reversed(node.children):
+            stack.append((c, False))
+
+
+# Runs iter_events and passes each event to handler. Returns whether rule
+# matched.
+def parse_events(rule, buffer, handler: Handler, pos: int = 0, ctx: ParseContext = None):
+    matched = True
+    for e in iter_events(rule, buffer, pos, ctx):
+        if e.kind == START:
+            handler.start(e.rule, e.start)
+        elif e.kind == END:
+            handler.end(e.rule, e.start, e.end)
+        else:
+            handler.fail(e.rule, e.start)
+            matched = False
+    return matched
@@ -0,0 +1,161 @@
+from array import array
+
+NONE = -1
+
+
+# Columnar form of a finished parse tree. Node i is described by the i-th entry
+# of parallel arrays, so a tree costs a few machine words per node instead of
+# one Python object. Nodes are stored in preorder with the root at index 0.
+class FlatTree:
+
+    # rules: rules to number first, in order
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self.rule_ids = {id(r): i for i, r in enumerate(self.rules)}
+        self.rule = array('i')
+        self.start = array('q')
+        self.length = array('q')
+        self.matched = array('b')
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.last_child = array('i')
+
+    @classmethod
+    def from_node(cls, root, matched_only: bool = True):
+        tree = cls()
+        tree.add_tree(root, NONE, matched_only)
+        return tree
+
+    # Appends the tree of root as the last child of parent, with starts moved
+    # by offset
+    def add_tree(self, root, parent: int = NONE, matched_only: bool = True, offset: int = 0):
+        stack = [(root, parent)]
+        while stack:
+            node, parent = stack.pop()
+            if matched_only and not node.matched:
+                continue
+            idx = self.add_node(node.rule, node.start + offset, node.length, parent, node.matched)
+            for child in reversed(node.children):
+                stack.append((child, idx))
+
+    def rule_id(self, rule):
+        rid = self.rule_ids.get(id(rule))
+        if rid is None:
+            rid = self.rule_ids[id(rule)] = len(self.rules)
+            self.rules.append(rule)
+        return rid
+
+    # Appends a node as the last child of parent and returns its index
+    def add_node(self, rule, start: int, length: int, parent: int = NONE, matched: bool = True):
+        idx = len(self.rule)
+        self.rule.append(self.rule_id(rule))
+        self.start.append(start)
+        self.length.append(length)
+        self.matched.append(matched)
+        self.parent.append(parent)
+        self.first_child.append(NONE)
+        self.next_sibling.append(NONE)
+        self.last_child.append(NONE)
+        if parent != NONE:
+            last = self.last_child[parent]
+            if last == NONE:
+                self.first_child[parent] = idx
+            else:
+                self.next_sibling[last] = idx
+            self.last_child[parent] = idx
+        return idx
+
+    def child_indices(self, idx: int):
+        child = self.first_child[idx]
+        while child != NONE:
+            yield child
+            child = self.next_sibling[child]
+
+    def node(self, idx: int):
+        return FlatNode(self, idx)
+
+    @property
+    def root(self):
+        return FlatNode(self, 0) if len(self.rule) > 0 else None
+
+    def __len__(self):
+        return len(self.rule)
+
+
+# Read-only view of one FlatTree node, navigable like a Tree
+class FlatNode:
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree: FlatTree, index: int):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def rule(self):
+        return self.tree.rules[self.tree.rule[self.index]]
+
+    @property
+    def value(self):
+        return self.rule
+
+    @property
+    def start(self):
+        return self.tree.start[self.index]
+
+    @property
+    def length(self):
+        return self.tree.length[self.index]
+
+    @property
+    def matched(self):
+        return self.tree.matched[self.index] == 1
+
+    @property
+    def parent(self):
+        parent = self.tree.parent[self.index]
+        return None if parent == NONE else FlatNode(self.tree, parent)
+
+    @property
+    def children(self):
+        return [FlatNode(self.tree, i) for i in self.tree.child_indices(self.index)]
+
+    def child_count(self):
+        return sum(1 for _ in self.tree.child_indices(self.index))
+
+    def find_child(self, fn):
+        return next((x for x in self.children if fn(x)), None)
+
+    def is_root(self):
+        return self.tree.parent[self.index] == NONE
+
+    def get_root(self):
+        return FlatNode(self.tree, 0)
+
+    @property
+    def idx(self):
+        parent = self.tree.parent[self.index]
+        return list(self.tree.child_indices(parent)).index(self.index)
+
+    def pprint_tree(self, file=None, _prefix="", _last=True):
+        stack = [(self, _prefix, _last)]
+        while stack:
+            node, prefix, last = stack.pop()
+            print(prefix, "`- " if last else "|- ", node.value, sep="", file=file)
+            prefix += "   " if last else "|  "
+            children = node.children
+            child_count = len(children)
+            for i in range(child_count - 1, -1, -1):
+                stack.append((children[i], prefix, i == child_count - 1))
+
+    def __eq__(self, other):
+        return isinstance(other, FlatNode) and other.tree is self.tree and other.index == self.index
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    def __str__(self):
+        return str(self.value)
+
+    def __repr__(self):
+        return f'FlatNode({self.value}, {self.start}, {self.length})'
@@ -0,0 +1,368 @@
+import math
+
+from src.rules import Alt, Seq, Opt, Star, ParseNode, resolve
+
+
+# A rule matching buffer[start:end]. Its packed nodes are the different ways
+# it does so; nodes are shared, so a forest of exponentially many trees
+# stays polynomial in size.
+class SymbolNode:
+    __slots__ = ('forest', 'rule', 'start', 'end', '_packed')
+
+    def __init__(self, forest, rule, start: int, end: int):
+        self.forest = forest
+        self.rule = rule
+        self.start = start
+        self.end = end
+        self._packed = None
+
+    @property
+    def packed(self):
+        if self._packed is None:
+            self._packed = self.forest.derive(self)
+        return self._packed
+
+    def is_ambiguous(self):
+        return len(self.packed) > 1
+
+    # Every forest node reachable from this one, this one first
+    def nodes(self):
+        seen = {self}
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            for p in node.packed:
+                for c in p.children:
+                    if c not in seen:
+                        seen.add(c)
+                        stack.append(c)
+
+    # Number of parse trees, math.inf if a cycle (e.g. A -> A) allows infinitely many
+    def count(self):
+        counts = {}
+        on_path = set()
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                on_path.discard(node)
+                total = 0
+                for p in node.packed:
+                    n = 1
+                    for c in p.children:
+                        n *= counts[c]
+                    total += n
+                counts[node] = total
+                continue
+            if node in counts:
+                continue
+            if node in on_path:
+                return math.inf
+            on_path.add(node)
+            stack.append((node, True))
+            for p in node.packed:
+                for c in p.children:
+                    if c in on_path:
+                        return math.inf
+                    if c not in counts:
+                        stack.append((c, False))
+        return counts[self]
+
+    # Lazily yields each parse tree as a fresh ParseNode tree, like the ones
+    # Rule.apply builds but without failed attempts. Derivations that revisit a
+    # node on their own path are skipped, so this ends even when count() is
+    # infinite.
+    def trees(self):
+        # Trees are enumerated like an odometer: choices[d] is the packed node
+        # picked at the d-th ambiguous node met in pre-order, sizes[d] the
+        # number of packed nodes there.
+        choices = []
+        sizes = []
+        while True:
+            tree = self.forest.expand(self, choices, sizes)
+            if tree is not None:
+                yield tree
+            while choices and choices[-1] + 1 >= sizes[-1]:
+                choices.pop()
+                sizes.pop()
+            if not choices:
+                return
+            choices[-1] += 1
+
+    def __str__(self):
+        return f'{self.rule}[{self.start}:{self.end}]'
+
+    def __repr__(self):
+        return f'SymbolNode({self.rule}, {self.start}, {self.end})'
+
+
+# The first m subrules of a Seq matching buffer[start:end]. Binarizing
+# sequences this way keeps the forest cubic in the input length.
+class IntermediateNode(SymbolNode):
+    __slots__ = ('m',)
+
+    def __init__(self, forest, rule, m: int, start: int, end: int):
+        SymbolNode.__init__(self, forest, rule, start, end)
+        self.m = m
+
+    def __str__(self):
+        return f'{self.rule}.{self.m}[{self.start}:{self.end}]'
+
+    def __repr__(self):
+        return f'IntermediateNode({self.rule}, {self.m}, {self.start}, {self.end})'
+
+
+# One derivation of a node: its children, in input order
+class PackedNode:
+    __slots__ = ('children',)
+
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return f'PackedNode({", ".join(str(c) for c in self.children)})'
+
+
+# All parses of an input under context-free semantics: Alt is an unordered
+# choice, Opt and Star may match or not, and a Star may stop after any number
+# of iterations (each consuming input). Terminals, and rule classes other than
+# Alt, Seq, Opt and Star, keep their single PEG match.
+#
+# Phase one computes the set of end positions of each (rule, start) as a
+# least fixed point: a call that reaches a (rule, start) still being computed,
+# i.e. left recursion, reads its current approximation, and the outer call is
+# repeated until nothing grows. Results depending on an approximation of an
+# enclosing call aren't kept as final. Phase two builds forest nodes lazily
+# from the final end sets.
+class Forest:
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        # (id(rule), start) -> frozenset of ends, final
+        self.ends_memo = {}
+        # (id(rule), start) -> ends found so far, for calls not yet final
+        self.approx = {}
+        # (id(rule), start) -> index on the active call stack
+        self.active = {}
+        # Lowest active index read by the current computation
+        self.low = 0
+        self.symbols = {}
+        self.prefixes = {}
+
+    def parse(self, rule, pos: int = 0, end: int = None):
+        rule = resolve(rule)
+        if end is None:
+            end = len(self.buffer)
+        if end not in self.ends(rule, pos):
+            return None
+        return self.symbol(rule, pos, end)
+
+    # End positions of rule at pos. Calls are run on an explicit stack of
+    # compute generators, each of which yields the (rule, pos) calls it needs
+    # and is sent back their ends, so nesting depth is limited only by memory.
+    # A frame is [rule, key, depth, low of the caller, ends so far, generator].
+    def ends(self, rule, pos: int):
+        found = self.ends_memo.get((id(rule), pos))
+        if found is not None:
+            return found
+        stack = []
+        call = (rule, pos)
+        while True:
+            if call is not None:
+                rule, pos = call
+                call = None
+                key = (id(rule), pos)
+                found = self.ends_memo.get(key)
+                if found is None:
+                    depth = self.active.get(key)
+                    if depth is not None:
+                        self.low = min(self.low, depth)
+                        found = self.approx.get(key, frozenset())
+                    elif not isinstance(rule, (Alt, Seq, Opt, Star)):
+                        # A terminal calls no other rule, so its ends are final at once
+                        found = self.ends_memo[key] = self.terminal_ends(rule, pos)
+                    else:
+                        depth = len(self.active)
+                        self.active[key] = depth
+                        result = self.approx.get(key, frozenset())
+                        stack.append([rule, key, depth, self.low, result, self.compute(rule, pos)])
+                        self.low = depth + 1
+            if not stack:
+                return found
+            frame = stack[-1]
+            try:
+                # A new frame gets None to start
+                call = frame[5].send(found)
+                continue
+            except StopIteration as stop:
+                found = stop.value | frame[4]
+            rule, key, depth, outer_low, result, _ = frame
+            low = self.low
+            if found != result and low <= depth:
+                # It read an approximation of itself, which has grown: run it again
+                frame[4] = self.approx[key] = found
+                frame[5] = self.compute(rule, key[1])
+                self.low = depth + 1
+                found = None
+                continue
+            stack.pop()
+            del self.active[key]
+            if low >= depth:
+                self.ends_memo[key] = found
+                self.approx.pop(key, None)
+            else:
+                self.approx[key] = found
+            self.low = min(outer_low, low)
+
+    # Generator of the ends of an Alt, Seq, Opt or Star at pos, see ends. Final
+    # ends are looked up here, saving the round trip through the stack.
+    def compute(self, rule, pos: int):
+        memo = self.ends_memo
+        if isinstance(rule, Alt):
+            found = set()
+            for c in rule.subrules:
+                c = resolve(c)
+                ends = memo.get((id(c), pos))
+                found |= (yield c, pos) if ends is None else ends
+            return frozenset(found)
+        if isinstance(rule, Seq):
+            positions = {pos}
+            for c in rule.subrules:
+                c = resolve(c)
+                found = set()
+                for p in positions:
+                    ends = memo.get((id(c), p))
+                    found |= (yield c, p) if ends is None else ends
+                positions = found
+                if not positions:
+                    break
+            return frozenset(positions)
+        if isinstance(rule, Opt):
+            return (yield resolve(rule.subrules[0]), pos) | {pos}
+        child = resolve(rule.subrules[0])
+        key = id(child)
+        found = {pos}
+        frontier = [pos]
+        while frontier:
+            p = frontier.pop()
+            ends = memo.get((key, p))
+            if ends is None:
+                ends = yield child, p
+            for e in ends:
+                if e > p and e not in found:
+                    found.add(e)
+                    frontier.append(e)
+        return frozenset(found)
+
+    def terminal_ends(self, rule, pos: int):
+        if rule.subrules:
+            node = rule.apply(self.buffer, 0, pos)
+        else:
+            node = ParseNode(rule, pos)
+            rule.apply_internal(self.buffer, 0, pos, node)
+        return frozenset((pos + node.length,)) if node.matched else frozenset()
+
+    def symbol(self, rule, start: int, end: int):
+        key = (id(rule), start, end)
+        node = self.symbols.get(key)
+        if node is None:
+            node = self.symbols[key] = SymbolNode(self, rule, start, end)
+        return node
+
+    def intermediate(self, rule, m: int, start: int, end: int):
+        key = (id(rule), m, start, end)
+        node = self.symbols.get(key)
+        if node is None:
+            node = self.symbols[key] = IntermediateNode(self, rule, m, start, end)
+        return node
+
+    # Positions reachable after the first m subrules of seq from start
+    def prefix_ends(self, seq, m: int, start: int):
+        key = (id(seq), m, start)
+        found = self.prefixes.get(key)
+        if found is None:
+            if m == 0:
+                found = frozenset((start,))
+            else:
+                c = resolve(seq.subrules[m - 1])
+                found = set()
+                for p in self.prefix_ends(seq, m - 1, start):
+                    found |= self.ends(c, p)
+                found = frozenset(found)
+            self.prefixes[key] = found
+        return found
+
+    # Packed nodes of a forest node
+    def derive(self, node):
+        rule = node.rule
+        i = node.start
+        j = node.end
+        if isinstance(node, IntermediateNode) or isinstance(rule, Seq):
+            m = node.m if isinstance(node, IntermediateNode) else len(rule.subrules)
+            if m == 0:
+                return [PackedNode(())] if i == j else []
+            c = resolve(rule.subrules[m - 1])
+            packed = []
+            for k in sorted(self.prefix_ends(rule, m - 1, i)):
+                if k <= j and j in self.ends(c, k):
+                    if m == 1:
+                        packed.append(PackedNode((self.symbol(c, k, j),)))
+                    else:
+                        packed.append(PackedNode((self.intermediate(rule, m - 1, i, k), self.symbol(c, k, j))))
+            return packed
+        if isinstance(rule, Alt):
+            return [PackedNode((self.symbol(c, i, j),)) for c in map(resolve, rule.subrules) if j in self.ends(c, i)]
+        if isinstance(rule, Opt):
+            c = resolve(rule.subrules[0])
+            packed = [PackedNode((self.symbol(c, i, j),))] if j in self.ends(c, i) else []
+            if i == j:
+                packed.append(PackedNode(()))
+            return packed
+        if isinstance(rule, Star):
+            if i == j:
+                return [PackedNode(())]
+            # An iteration, then the rest of the Star as a node of the same rule
+            c = resolve(rule.subrules[0])
+            return [PackedNode((self.symbol(c, i, k), self.symbol(rule, k, j)))
+                    for k in sorted(self.ends(c, i)) if i < k <= j and j in self.ends(rule, k)]
+        return [PackedNode(())]
+
+    # Builds the tree of root picked by choices, extending choices and sizes
+    # with the first packed node at ambiguous nodes past their end. Returns
+    # None if every derivation left at some node is cyclic. Intermediate nodes
+    # and the rest of a Star add their children to their parent's ParseNode.
+    def expand(self, root, choices, sizes):
+        d = 0
+        tree = None
+        on_path = set()
+        stack = [(root, None)]
+        while stack:
+            node, parent = stack.pop()
+            if parent is False:
+                on_path.discard(node)
+                continue
+            on_path.add(node)
+            packed = [p for p in node.packed if not any(c in on_path for c in p.children)]
+            if not packed:
+                return None
+            choice = 0
+            if len(packed) > 1:
+                if d == len(choices):
+                    choices.append(0)
+                    sizes.append(len(packed))
+                choice = choices[d]
+                d += 1
+            if parent is not None and (isinstance(node, IntermediateNode) or
+                                       (node.rule is parent.rule and isinstance(node.rule, Star))):
+                pn = parent
+            else:
+                pn = ParseNode(node.rule, node.start, True, node.end - node.start)
+                if parent is None:
+                    tree = pn
+                else:
+                    parent.add(pn)
+            stack.append((node, False))
+            for c in reversed(packed[choice].children):
+                stack.append((c, pn))
+        return tree
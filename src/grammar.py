@@ -1,116 +1,261 @@
-from src.rules import Alt, Seq, Opt, Star, ParseNode, AltType, Lit, Reg, Eps, Eof
-from enum import Enum
-
+from src.rules import Alt, Seq, Opt, Star, Lit, Reg, ParseNode, ParseContext, LiteralTable, MemoEntry, COMMITTED, \
+    char_terminal, resolve
+from src.vm import Program
+from src.lexer import Scanner
+from src.forest import Forest
+from src.earley import EarleyParser
+from src.parallel import parse_parallel
+from src.batch import parse_many
+from src.analysis import reachable, compute_nullables, compute_left_recursives, compute_firsts
+
+
+# Rule kinds run by Grammar.parse itself; other rules run their own apply_internal
+OTHER = 0
+ALT = 1
+SEQ = 2
+OPT = 3
+STAR = 4
+
+
+def rule_kind(cls):
+    if issubclass(cls, Alt):
+        return ALT
+    if issubclass(cls, Seq):
+        return SEQ
+    if issubclass(cls, Opt):
+        return OPT
+    if issubclass(cls, Star):
+        return STAR
+    return OTHER
+
+
+# Parser bookkeeping for a node still being extended. It lives on the engine
+# stack only, so finished ParseNodes don't carry it.
+class Frame:
+    __slots__ = ('node', 'kind', 'subrules', 'next_subrule_num', 'mark', 'errors')
+
+    def __init__(self, node, kind, subrules, mark, errors):
+        self.node = node
+        self.kind = kind
+        # Subrules to be tried in order; for a Star, the repeated rule
+        self.subrules = subrules
+        self.next_subrule_num = 0
+        # ParseContext.mark of the call with a memo, else None
+        self.mark = mark
+        # Length of ParseContext.errors when the current subrule was called
+        self.errors = errors
 
 
 class Grammar:
 
     def __init__(self):
         self.rules = {}
-        self.ptree_list = None
-        self.backtrack_choices = None
-
-    def init_parse(self):
-        self.ptree_list = []
-        self.backtrack_choices = []
-
-    def parse(self, rule, buffer):
-        self.init_parse()
-        root = ParseNode(rule, 0)
-        stack = [root]
-        self.extend(buffer, root, stack)
-
-
-    # Adds all possible extensions from node to ptree_list
-    def extend(self, buffer, root, stack):
-        while len(stack) > 0:
-            node = stack.pop()
-            if self.is_terminal(node.rule):
-                self.process_terminal_rule(buffer, node, stack)
-            else:
-                if isinstance(node.rule, Alt):
-                    self.process_alt(buffer, root, node, stack)
-                elif isinstance(node.rule, Seq):
-                    self.process_seq(buffer, root, node, stack)
-                elif isinstance(node.rule, Opt):
-                    self.process_opt(buffer, root, node, stack)
-                elif isinstance(node.rule, Star):
-                    self.process_star(buffer, root, node, stack)
+        # vm.Programs by start rule, built by compile; they bake in the
+        # is_left_recursive flags and literal tables, so passes that set those
+        # drop them
+        self.programs = {}
+        # Left-recursive strongly connected components, and the index of the
+        # component each left-recursive rule belongs to
+        self.left_rec_sccs = []
+        self.scc_index = {}
+        # Rule class -> kind, for parse
+        self.kinds = {}
+        # Scanner over the terminals, built by tokenize
+        self.lexer = None
+        # Earley parser with the productions of the rules, built by parse_earley
+        self.earley = None
+        # trace.Tracer, e.g. a profiler.Profiler, for parses without a ParseContext
+        self.tracer = None
+
+    # Parses buffer from pos with rule and returns the root ParseNode. Builds the
+    # same tree as rule.apply, but Alt, Seq, Opt and Star keep their state in a
+    # Frame on an explicit stack instead of the Python stack, so nesting depth is
+    # limited only by memory. Terminals and other rule classes run their own
+    # apply_internal, and left-recursive rules go to the llrules parser as in
+    # Rule.apply. A Star stops on a zero length iteration instead of looping.
+    def parse(self, rule, buffer, pos: int = 0, ctx: ParseContext = None):
+        if ctx is None:
+            ctx = ParseContext(tracer=self.tracer)
+        memo = ctx.memo
+        tracer = ctx.tracer
+        choices = ctx.choices
+        errors = ctx.errors
+        kinds = self.kinds
+        release = getattr(buffer, 'release', None)
+        stack = []
+        parent = None
+        while True:
+            # Call rule at pos as a child of parent; depth is len(stack)
+            node = None
+            if memo is not None:
+                node = memo.get(rule, pos)
+                if node is not None:
+                    if node.__class__ is MemoEntry:
+                        node = ctx.replay(node, buffer, pos)
+                    if parent is not None:
+                        parent.add(node)
+                    if tracer is not None:
+                        tracer.hit(rule, buffer, pos, len(stack), node)
+            if node is None:
+                if tracer is not None:
+                    tracer.enter(rule, buffer, pos, len(stack))
+                if rule.is_left_recursive:
+                    node = ctx.left_rec_parser(buffer).apply(rule, pos, parent)
+                    if tracer is not None:
+                        tracer.exit(rule, buffer, pos, len(stack), node)
+                else:
+                    node = ParseNode(rule, pos)
+                    if parent is not None:
+                        parent.add(node)
+                    mark = None if memo is None else ctx.mark()
+                    kind = kinds.get(rule.__class__)
+                    if kind is None:
+                        kind = kinds[rule.__class__] = rule_kind(rule.__class__)
+                    subrules = rule.subrules
+                    if kind == ALT:
+                        if rule.literals is not None and buffer.__class__ is str:
+                            i = rule.literals.match(buffer, pos)
+                            if i >= 0:
+                                subrules = (rule.subrules[i],)
+                            else:
+                                subrules = ()
+                                for child in rule.subrules:
+                                    ctx.fail(child, pos)
+                        elif rule.dispatch is not None:
+                            subrules = rule.dispatch.get(buffer[pos:pos + 1])
+                            if subrules is None:
+                                subrules = rule.dispatch_default
+                                ctx.fail(rule, pos)
+                    elif kind == STAR:
+                        node.matched = True
+                        if rule.guard is not None and buffer[pos:pos + 1] not in rule.guard:
+                            subrules = ()
+                            ctx.fail(rule.subrules[0], pos)
+                    if kind == OTHER:
+                        rule.apply_internal(buffer, len(stack), pos, node, ctx)
+                    elif subrules:
+                        stack.append(Frame(node, kind, subrules, mark, len(errors)))
+                        if kind != SEQ:
+                            choices.append(pos)
+                        parent = node
+                        rule = subrules[0]
+                        continue
+                    if memo is not None:
+                        memo.put(rule, pos, ctx.memo_entry(node, mark))
+                    if tracer is not None:
+                        tracer.exit(rule, buffer, pos, len(stack), node)
+
+            # Return node to the frames above it until one has a subrule to call
+            while stack:
+                frame = stack[-1]
+                cnode = node
+                node = frame.node
+                kind = frame.kind
+                committed = kind != SEQ and choices.pop() == COMMITTED
+                if kind != SEQ and not cnode.matched:
+                    # A failed attempt takes back the errors it recorded
+                    del errors[frame.errors:]
+                k = -1
+                if kind == SEQ:
+                    if cnode.matched:
+                        node.length += cnode.length
+                        node.matched = True
+                        k = frame.next_subrule_num + 1
+                    else:
+                        node.clear()
+                elif kind == ALT:
+                    if cnode.matched:
+                        node.length += cnode.length
+                        node.matched = True
+                    elif not committed:
+                        k = frame.next_subrule_num + 1
+                elif kind == STAR:
+                    if not cnode.matched and committed:
+                        # An iteration failed past a cut, so the Star fails
+                        node.matched = False
+                        node.length = 0
+                    elif cnode.matched and cnode.length > 0:
+                        node.length += cnode.length
+                        k = 0
+                        frame.errors = len(errors)
+                        lpos = node.start + node.length
+                        # Nothing can backtrack behind a top level Star
+                        if release is not None and len(stack) == 1:
+                            release(lpos)
+                        guard = node.rule.guard
+                        if guard is not None and buffer[lpos:lpos + 1] not in guard:
+                            ctx.fail(node.rule.subrules[0], lpos)
+                            k = -1
                 else:
-                    raise Exception(f'Unknown rule class: {type(node.rule)}')
-
-    def process_terminal_rule(self, buffer, node, stack):
-        node.rule.apply_internal(buffer, 0, node.start, node)
-        while node.parent is not None:
-            parent = node.parent;
-            if self.update_parent(node, parent, stack):
-                node = stack.pop
-                assert node == parent
+                    # OPT
+                    node.length = cnode.length if cnode.matched else 0
+                    node.matched = cnode.matched or not committed
+                if 0 <= k < len(frame.subrules):
+                    frame.next_subrule_num = k
+                    rule = frame.subrules[k]
+                    parent = node
+                    pos = node.start + node.length if kind != ALT else node.start
+                    if kind != SEQ:
+                        choices.append(pos)
+                    break
+                stack.pop()
+                if memo is not None:
+                    memo.put(node.rule, node.start, ctx.memo_entry(node, frame.mark))
+                if tracer is not None:
+                    tracer.exit(node.rule, buffer, node.start, len(stack), node)
             else:
-                break;
-
-    def update_parent(self, node, parent, stack):
-        assert (parent is None and len(stack) == 0) or (parent == stack[-1])
-        if isinstance(parent.rule, Alt):
-            parent.next_subrule_num += 1
-            if node.matched:
-                parent.matched = True
-                parent.length = node.length
-            return True
-
-
-    def is_terminal(self, rule):
-        return isinstance(rule, Lit) or isinstance(rule, Reg) or isinstance(rule, Eps) or isinstance(rule, Eof)
-
-
-    def process_alt(self, buffer, root, node, stack):
-
-        if node.alt_type == AltType.NONE:
-            if left_recursion_allowed():
-                lroot, lnode = self.copy_tree(root, node)
-                lstack = self.copy_stack(stack)
-                lnode.alt_type = AltType.LEFT
-                self.extend(buffer, lroot, lnode, lstack)
-            node.alt_type = AltType.REST
-            self.extend(buffer, root, node)
-
-        elif node.alt_type == AltType.LEFT:
-            subrule = node.rule.subrules[0]
-            cnode = ParseNode(subrule, node.start)
-            node.add(cnode)
-            stack.append(cnode)
-        elif node.alt_type == AltType.REST:
-            next_rule = self.next_rule(node, 1)
-            if next_rule is not None:
-                cnode = ParseNode(next_rule, node.start)
-                node.add(cnode)
-                stack.append(cnode)
-
-    def process_seq(self, buffer, root, node, stack):
-        next_rule = self.next_rule(node)
-        if next_rule is not None:
-            cnode = ParseNode(next_rule, node.start)
-            node.add(cnode)
-            stack.append(cnode)
-        else:
-
-
-    def process_opt(self, buffer, root, node, stack):
-        next_rule = self.next_rule(node)
-        if next_rule is not None:
-            cnode = ParseNode(next_rule, node.start)
-            node.add(cnode)
-            stack.append(cnode)
-
-    def process_star(self, buffer, root, node, stack):
-        next_rule = self.next_rule(node)
-        if next_rule is not None:
-            cnode = ParseNode(next_rule, node.start)
-            node.add(cnode)
-            stack.append(cnode)
-
+                return node
+
+    # Lowers rule and everything reachable from it to a vm.Program. Programs are
+    # cached per start rule until the grammar changes.
+    def compile(self, rule):
+        program = self.programs.get(rule)
+        if program is None:
+            program = self.programs[rule] = Program(rule)
+        return program
+
+    # All parses of buffer[pos:end] with rule, end defaulting to the end of the
+    # buffer, as a shared packed parse forest: returns the root forest.SymbolNode,
+    # or None if there is no parse. Alt is an unordered choice here, so
+    # ambiguous grammars get every parse; see forest.Forest.
+    def parse_all(self, rule, buffer, pos: int = 0, end: int = None):
+        return Forest(buffer).parse(rule, pos, end)
+
+    # Parses buffer[pos:end] with rule as a context-free grammar, end defaulting
+    # to the longest match, and returns one parse tree as a ParseNode, unmatched
+    # if there is none. Unlike the PEG engines this finds a parse whenever one
+    # exists, e.g. for rules an ordered choice or greedy Star would reject.
+    def parse_earley(self, rule, buffer, pos: int = 0, end: int = None):
+        if self.earley is None:
+            self.earley = EarleyParser()
+        return self.earley.parse(rule, buffer, pos, end)
+
+    # Parses buffer with a Star of independent records in a pool of worker
+    # processes, splitting it at the record boundaries sync finds; see
+    # parallel.parse_parallel.
+    def parse_parallel(self, rule, buffer: str, sync, workers: int = None):
+        return parse_parallel(rule, buffer, sync, workers)
+
+    # Parses every buffer of buffers with rule, setting up once for the whole
+    # batch, and yields the trees in order, or with errors (tree, errors) pairs;
+    # see batch.parse_many. workers > 1 spreads the batch over a thread pool,
+    # or a process pool with processes.
+    def parse_many(self, rule, buffers, memo: bool = False, workers: int = None, processes: bool = False,
+                   errors: bool = False):
+        return parse_many(self, rule, buffers, memo, workers, processes, errors=errors)
+
+    # Scans text once with all Lit and Reg terminals into a lexer.TokenBuffer,
+    # which any engine can parse instead of the text. Terminals then match whole
+    # tokens only, with longest match and Lit before Reg priority.
+    def tokenize(self, text: str):
+        if self.lexer is None:
+            self.lexer = Scanner.for_grammar(self)
+        return self.lexer.scan(text)
 
     def add(self, *args):
+        self.programs = {}
+        self.lexer = None
+        self.earley = None
         for rule in args:
             # print(f'Before lazy removal: {rule}')
             rule = rule.remove_lazy_rules()
@@ -124,51 +269,92 @@ class Grammar:
 
 
 
-    def set_nullables(self):
-        for i in range(len(self.rules)):
-            for rule in self.rules.values():
-                if not rule.is_nullable:
-                    if isinstance(rule, Alt):
-                        for child in rule.subrules:
-                            if child.is_nullable:
-                                rule.is_nullable = True
-                                break
-                    elif isinstance(rule, Seq):
-                        for child in rule.subrules:
-                            if not child.is_nullable:
-                                rule.is_nullable = False
-                                break
+    # Every rule reachable from the added ones. Unlike self.rules this keeps
+    # rules that share a name, e.g. all Reg and Opt rules.
+    def all_rules(self):
+        return reachable(self.rules.values())
 
-    def set_left_recursives(self):
-        could_start_with = set()
-        for rule in self.rules.values():
+    def set_nullables(self):
+        compute_nullables(self.all_rules())
+
+    # Computes rule.first for every rule: the characters a match can start
+    # with, with END standing for end of input, or None when unknown.
+    def set_firsts(self):
+        self.set_nullables()
+        compute_firsts(self.all_rules())
+
+    # Lets Alt try only the alternatives whose FIRST set admits the next input
+    # character, and Star stop without entering a child that can't match.
+    # Requires set_firsts.
+    def set_dispatch_tables(self):
+        for rule in self.all_rules():
             if isinstance(rule, Alt):
-                for child in rule.subrules:
-                    could_start_with.add((rule, child))
-            elif isinstance(rule, Seq) or isinstance(rule, Opt) or isinstance(rule, Star):
-                for child in rule.subrules:
-                    could_start_with.add((rule, child))
-                    if not child.is_nullable:
-                        break
-
-        closure = transitive_closure(could_start_with)
-
-        for rule in self.rules.values():
-            rule.is_left_recursive = (rule, rule) in closure
-
-
-
-
-def transitive_closure(a):
-    closure = set(a)
-    while True:
-        new_relations = set((x,w) for x,y in closure for q,w in closure if q == y)
-
-        closure_until_now = closure | new_relations
-
-        if closure_until_now == closure:
-            break
-
-        closure = closure_until_now
+                rule.dispatch = None
+                always = tuple(c for c in rule.subrules if c.first is None or c.is_nullable)
+                if len(always) == len(rule.subrules):
+                    continue
+                keys = set()
+                for c in rule.subrules:
+                    if c not in always:
+                        keys |= c.first
+                rule.dispatch = {k: tuple(c for c in rule.subrules if c in always or k in c.first) for k in keys}
+                rule.dispatch_default = always
+            elif isinstance(rule, Star):
+                child = rule.subrules[0]
+                rule.guard = child.first if child.first is not None and not child.is_nullable else None
+
+    # Gives every Alt with at least min_size alternatives, all of them Lit rules,
+    # a LiteralTable that finds the first matching literal in one pass over the
+    # input instead of trying each literal in turn.
+    def set_literal_tables(self, min_size: int = 8):
+        self.programs = {}
+        for rule in self.all_rules():
+            if isinstance(rule, Alt):
+                rule.literals = None
+                if len(rule.subrules) >= min_size and all(isinstance(c, Lit) for c in rule.subrules):
+                    rule.literals = LiteralTable([c.literal for c in rule.subrules])
+
+    # Replaces every Reg whose pattern is a single character class or a run of
+    # them, e.g. [+-], [0-9]+ or [a-z_][a-z0-9_]*, by a CharSet or CharRun that
+    # matches through character tables. The new rules keep the flags and FIRST
+    # sets computed so far, and dispatch tables are updated.
+    def set_char_classes(self):
+        replaced = {}
+        rules = self.all_rules()
+        for rule in rules:
+            if rule.__class__ is Reg:
+                new = char_terminal(rule)
+                if new is not None:
+                    new.name = rule.name
+                    new.is_nullable = rule.is_nullable
+                    new.is_left_recursive = rule.is_left_recursive
+                    new.debug = rule.debug
+                    new.first = rule.first
+                    replaced[rule] = new
+        if not replaced:
+            return
+        self.programs = {}
+        self.lexer = None
+        self.earley = None
+        for rule in rules:
+            rule.subrules = [replaced.get(c, c) for c in rule.subrules]
+            if isinstance(rule, Star):
+                rule.rule = replaced.get(resolve(rule.rule), rule.rule)
+            elif isinstance(rule, Alt) and rule.dispatch is not None:
+                rule.dispatch = {k: tuple(replaced.get(c, c) for c in v) for k, v in rule.dispatch.items()}
+                rule.dispatch_default = tuple(replaced.get(c, c) for c in rule.dispatch_default)
+        for name, rule in self.rules.items():
+            self.rules[name] = replaced.get(rule, rule)
 
-    return closure
\ No newline at end of file
+    def set_left_recursives(self):
+        self.programs = {}
+        self.left_rec_sccs = compute_left_recursives(self.all_rules())
+        self.scc_index = {}
+        for i, scc in enumerate(self.left_rec_sccs):
+            for rule in scc:
+                self.scc_index[rule] = i
+
+    # The rules that are mutually left recursive with rule, or None
+    def left_rec_scc(self, rule):
+        i = self.scc_index.get(rule)
+        return None if i is None else self.left_rec_sccs[i]
@@ -0,0 +1,128 @@
+from collections import namedtuple
+
+from src.memo import MemoTable
+from src.rules import ParseContext
+from src.trace import Tracer
+
+# buffer[start:old_end] of the old input became buffer[start:new_end] of the new one
+Edit = namedtuple('Edit', ['start', 'old_end', 'new_end'])
+
+
+# Sets node.lookahead on every node a parse builds: how far past its start the
+# node's rule and all its subrules, failed attempts included, examined the
+# input. A reused node counts with its recorded lookahead.
+class ReachTracer(Tracer):
+
+    def __init__(self):
+        # Furthest position examined so far by each active rule
+        self.reaches = []
+
+    def enter(self, rule, buffer, pos: int, depth: int):
+        self.reaches.append(pos)
+
+    def exit(self, rule, buffer, pos: int, depth: int, node):
+        reach = max(self.reaches.pop(), rule.reach(buffer, pos, node))
+        node.lookahead = reach - pos
+        self.extend(reach)
+
+    def hit(self, rule, buffer, pos: int, depth: int, node):
+        lookahead = getattr(node, 'lookahead', None)
+        self.extend(len(buffer) + 1 if lookahead is None else pos + lookahead)
+
+    def extend(self, reach: int):
+        reaches = self.reaches
+        if reaches and reaches[-1] < reach:
+            reaches[-1] = reach
+
+
+# Reparses a buffer after edits, reusing every subtree of the previous parse
+# whose result can't have changed. A PEG result at a position depends only on
+# the input from there up to its lookahead, so a node is reused in place if
+# it examined nothing at or after the edit, and shifted by the change in length
+# if it starts after the edited range. The reusable nodes are found by
+# descending only into nodes that overlap the edit, and are handed to Rule.apply
+# as memo entries, so just the damaged region is parsed again.
+#
+# Nodes keep absolute starts, which every engine and tree walk relies on, so
+# the work is not bounded by the edit alone: every node after the edit is
+# shifted, one addition each, and every reused child of a node overlapping the
+# edit, e.g. each statement of a top level Star, is one memo lookup when the
+# Star is parsed again. Rules are applied only in the damaged region.
+class IncrementalParser:
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.tree = None
+        self.buffer = None
+        # Nodes offered for reuse by the last reparse, and the memo hits it had
+        self.offered = 0
+        self.reused = 0
+        # Old nodes the last reparse looked at to find those, nodes it shifted,
+        # and memo lookups it made
+        self.visited = 0
+        self.shifted = 0
+        self.lookups = 0
+
+    def parse(self, buffer):
+        ctx = ParseContext(tracer=ReachTracer())
+        self.tree = self.rule.apply(buffer, 0, 0, ctx=ctx)
+        self.buffer = buffer
+        return self.tree
+
+    # Parses buffer, the previous buffer with buffer[start:new_end] replacing
+    # what was at [start:old_end], and returns the new tree. The previous tree
+    # is taken apart to build it.
+    def reparse(self, buffer, start: int, old_end: int, new_end: int):
+        if self.tree is None:
+            return self.parse(buffer)
+        memo = self.reusable(Edit(start, old_end, new_end))
+        ctx = ParseContext(memo=memo, tracer=ReachTracer())
+        self.offered = len(memo)
+        self.tree = self.rule.apply(buffer, 0, 0, ctx=ctx)
+        self.reused = memo.hits
+        self.lookups = memo.hits + memo.misses
+        self.buffer = buffer
+        return self.tree
+
+    # MemoTable of the largest subtrees of the old tree unaffected by edit, at
+    # their new positions
+    def reusable(self, edit: Edit):
+        memo = MemoTable()
+        delta = edit.new_end - edit.old_end
+        # The same node can appear more than once after a memo hit
+        seen = set()
+        self.visited = 0
+        self.shifted = 0
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            self.visited += 1
+            lookahead = getattr(node, 'lookahead', None)
+            if node.start >= edit.old_end and lookahead is not None:
+                if delta:
+                    self.shifted += shift(node, delta, seen)
+                memo.put(node.rule, node.start, node)
+            elif lookahead is not None and node.start + lookahead <= edit.start:
+                memo.put(node.rule, node.start, node)
+            else:
+                stack.extend(node.children)
+        return memo
+
+
+# Moves node and its subtree by delta characters and returns the number of
+# nodes moved
+def shift(node, delta: int, seen):
+    moved = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        node.start += delta
+        moved += 1
+        for c in node.children:
+            if c not in seen:
+                seen.add(c)
+                stack.append(c)
+    return moved
@@ -0,0 +1,145 @@
+from array import array
+
+from src.rules import Lit, Reg
+
+
+# Tokenizes a text once with all Lit and Reg terminals of a grammar. At each
+# position the longest match wins; on a tie Lit terminals come before Reg
+# terminals, and otherwise the earlier terminal wins. Terminals are bucketed
+# by their FIRST characters, so only the ones that can start with the next
+# character are tried.
+class Scanner:
+
+    def __init__(self, terminals):
+        self.literals = {}
+        self.patterns = {}
+        # Terminal kinds in priority order: the literal string or compiled pattern
+        self.kinds = []
+        lits = [t for t in terminals if isinstance(t, Lit) and t.literal]
+        regs = [t for t in terminals if isinstance(t, Reg)]
+        for t in lits:
+            if t.literal not in self.literals:
+                self.literals[t.literal] = len(self.kinds)
+                self.kinds.append(t.literal)
+        for t in regs:
+            if t.pattern not in self.patterns:
+                self.patterns[t.pattern] = len(self.kinds)
+                self.kinds.append(t.pattern)
+        # First character -> kinds that may match there, in priority order
+        self.buckets = {}
+        # Kinds whose first characters are unknown, tried at every position
+        self.default = []
+        firsts = {}
+        for t in regs:
+            firsts[self.patterns[t.pattern]] = t.first_chars()
+        for kind, k in enumerate(self.kinds):
+            first = {k[0]} if isinstance(k, str) else firsts[kind]
+            if first is None:
+                self.default.append(kind)
+                for bucket in self.buckets.values():
+                    bucket.append(kind)
+            else:
+                for c in first:
+                    bucket = self.buckets.get(c)
+                    if bucket is None:
+                        bucket = self.buckets[c] = list(self.default)
+                    bucket.append(kind)
+        self.default = tuple(self.default)
+        self.buckets = {c: tuple(sorted(b)) for c, b in self.buckets.items()}
+
+    @classmethod
+    def for_grammar(cls, grammar):
+        return cls([r for r in grammar.all_rules() if not r.subrules])
+
+    def scan(self, text: str):
+        tokens = TokenBuffer(text, self)
+        starts = tokens.starts
+        ends = tokens.ends
+        kinds = tokens.kinds
+        index = tokens.index
+        buckets = self.buckets
+        default = self.default
+        patterns = self.kinds
+        pos = 0
+        end = len(text)
+        while pos < end:
+            best = -1
+            best_end = pos
+            for kind in buckets.get(text[pos], default):
+                k = patterns[kind]
+                if k.__class__ is str:
+                    if text.startswith(k, pos) and pos + len(k) > best_end:
+                        best = kind
+                        best_end = pos + len(k)
+                else:
+                    m = k.match(text, pos)
+                    if m is not None and m.end() > best_end:
+                        best = kind
+                        best_end = m.end()
+            if best < 0:
+                # No terminal matches here; the parse can't get past this position
+                tokens.error_pos = pos
+                break
+            index[pos] = len(starts)
+            starts.append(pos)
+            ends.append(best_end)
+            kinds.append(best)
+            pos = best_end
+        return tokens
+
+
+# A text with its token table, usable as a parse buffer by every engine.
+# Lit and Reg terminals known to the scanner match only the token starting at
+# their position instead of scanning characters again. Slicing and other
+# terminals see the text itself.
+class TokenBuffer:
+
+    def __init__(self, text: str, scanner: Scanner):
+        self.text = text
+        self.scanner = scanner
+        self.literals = scanner.literals
+        self.patterns = scanner.patterns
+        self.starts = array('i')
+        self.ends = array('i')
+        self.kinds = array('i')
+        # Index of the token starting at each position, or -1
+        self.index = array('i', [-1]) * (len(text) + 1)
+        # Position where scanning stopped on unknown input, or None
+        self.error_pos = None
+
+    def token_at(self, pos: int):
+        return self.index[pos] if 0 <= pos < len(self.index) else -1
+
+    # (terminal kind, start, end) of every token
+    def tokens(self):
+        kinds = self.scanner.kinds
+        for i in range(len(self.starts)):
+            yield kinds[self.kinds[i]], self.starts[i], self.ends[i]
+
+    def __getitem__(self, key):
+        return self.text[key]
+
+    def __len__(self):
+        return len(self.text)
+
+    def startswith(self, prefix: str, pos: int):
+        kind = self.literals.get(prefix)
+        if kind is None:
+            return self.text.startswith(prefix, pos)
+        if pos >= len(self.index):
+            return False
+        i = self.index[pos]
+        return i >= 0 and self.kinds[i] == kind
+
+    # End index of the token for pattern at pos, or None
+    def match(self, pattern, pos: int):
+        kind = self.patterns.get(pattern)
+        if kind is None:
+            m = pattern.match(self.text, pos)
+            return None if m is None else m.end()
+        if pos >= len(self.index):
+            return None
+        i = self.index[pos]
+        if i >= 0 and self.kinds[i] == kind:
+            return self.ends[i]
+        return None
@@ -1,12 +1,12 @@
-from src.rules import ParseNode, Alt
+from src.rules import ParseNode, Alt, Seq, Opt, Star, resolve
 
 
 def to_key(rule, pos):
-    return tuple({id(rule), pos})
+    return id(rule), pos
 
 class MemoEntry:
-    def __init__(self, lr, pos):
-        self.lr = lr
+    def __init__(self, ans, pos):
+        self.ans = ans
         self.pos = pos
 
 class Head:
@@ -24,20 +24,33 @@ class LR:
         self.next = next
 
 
-
-
-
+# Packrat parser with support for direct and indirect left recursion, after
+# Warth, Douglass and Millstein, "Packrat Parsers Can Support Left Recursion".
+# Every (rule, pos) is evaluated once, except for the seed-growing loop of a
+# left-recursive head, which re-evaluates only the rules involved in it.
 class Parser:
 
     def __init__(self, buffer):
         self.pos = 0
         self.heads = {}
         self.memo = {}
-        self.lrstack = []
+        self.lrstack = None
         self.buffer = buffer
+        self.evaluators = {Alt: self.eval_alt, Seq: self.eval_seq, Opt: self.eval_opt, Star: self.eval_star}
 
+    # Mirrors Rule.apply: returns the ParseNode for rule at pos, attached to parent_pn if given
+    def apply(self, rule, pos: int = 0, parent_pn: ParseNode = None):
+        node = self.apply_rule(rule, pos)
+        fix_parents(node)
+        if parent_pn is not None:
+            parent_pn.add(node)
+        return node
 
     def apply_rule(self, rule, pos):
+        rule = resolve(rule)
+        if not rule.subrules:
+            # Terminals are cheap to rematch and never take part in recursion
+            return self.eval_body(rule, pos)
         m = self.recall(rule, pos)
         if m is None:
             lr = LR(ParseNode(rule, pos), rule, None, self.lrstack)     #LR(FAIL,R,NIL,LRStack)
@@ -56,32 +69,42 @@ class Parser:
         else:
             self.pos = m.pos
             if isinstance(m.ans, LR):
-                self.setup_lr(R, m.ans)
+                self.setup_lr(rule, m.ans)
                 return m.ans.seed
             else:
                 return m.ans
 
-
-
-
-
     def recall(self, rule, pos):
-        pass
+        m = self.memo.get(to_key(rule, pos))
+        h = self.heads.get(pos)
+        if h is None:
+            return m
+        if m is None and rule is not h.rule and rule not in h.invSet:
+            return MemoEntry(ParseNode(rule, pos), pos)
+        if rule in h.evalSet:
+            h.evalSet.remove(rule)
+            ans = self.eval_body(rule, pos)
+            if m is None:
+                m = self.memo[to_key(rule, pos)] = MemoEntry(ans, pos)
+            m.ans = ans
+            m.pos = self.pos
+        return m
 
     def setup_lr(self, rule, lr):
         if lr.head is None:
-            lr.head = Head(rule, {}, {})
+            lr.head = Head(rule, set(), set())
         s = self.lrstack
-        while s.head != lr.head:
+        while s is not None and s.head is not lr.head:
             s.head = lr.head
             lr.head.invSet.add(s.rule)
             s = s.next
 
     def lr_answer(self, rule, pos, m):
         h = m.ans.head
-        if h.rule != rule:
+        if h.rule is not rule:
             return m.ans.seed
         else:
+            m.ans = m.ans.seed
             if not m.ans.matched:
                 return m.ans
             else:
@@ -92,32 +115,87 @@ class Parser:
         while True:
             self.pos = pos
             h.evalSet = h.invSet.copy()
-            ans = r_eval(rule, pos)
-            if not ans.matched or self.pos <= ans.pos + ans.length:
+            ans = self.eval_body(rule, pos)
+            if not ans.matched or self.pos <= m.pos:
                 break
             m.ans = ans
-            m.pos = pos
+            m.pos = self.pos
         del self.heads[pos]
         self.pos = m.pos
         return m.ans
 
     def eval_body(self, rule, pos):
-        if isinstance(rule, Alt):
-            for c in rule.children:
-                p = pos
-                pn = self.apply_rule(c, pos)
-                if pn.matched:
-                    return pn
-            return ParseNode(rule, pos)
-
+        node = ParseNode(rule, pos)
+        evaluator = self.evaluators.get(type(rule))
+        if evaluator is None:
+            evaluator = self.find_evaluator(rule)
+        if evaluator is None:
+            # Terminals match themselves
+            rule.apply_internal(self.buffer, 0, pos, node)
         else:
-            return self.apply_rule(rule, pos)
-
-
-
-
-
-
-
-
-
+            evaluator(rule, pos, node)
+        self.pos = pos + node.length
+        return node
+
+    def find_evaluator(self, rule):
+        for cls in type(rule).__mro__:
+            evaluator = self.evaluators.get(cls)
+            if evaluator is not None:
+                self.evaluators[type(rule)] = evaluator
+                return evaluator
+        return None
+
+    def eval_alt(self, rule, pos, node):
+        for child in rule.subrules:
+            cnode = self.apply_rule(child, pos)
+            if cnode.matched:
+                node.add(cnode)
+                node.length = cnode.length
+                node.matched = True
+                return
+
+    def eval_seq(self, rule, pos, node):
+        # An empty Seq fails, as in Rule.apply
+        if not rule.subrules:
+            return
+        lpos = pos
+        cnodes = []
+        for child in rule.subrules:
+            cnode = self.apply_rule(child, lpos)
+            if not cnode.matched:
+                return
+            cnodes.append(cnode)
+            lpos += cnode.length
+        node.add(*cnodes)
+        node.length = lpos - pos
+        node.matched = True
+
+    def eval_opt(self, rule, pos, node):
+        cnode = self.apply_rule(rule.subrules[0], pos)
+        if cnode.matched:
+            node.add(cnode)
+            node.length = cnode.length
+        node.matched = True
+
+    def eval_star(self, rule, pos, node):
+        lpos = pos
+        while True:
+            cnode = self.apply_rule(rule.rule, lpos)
+            if not cnode.matched or cnode.length == 0:
+                break
+            node.add(cnode)
+            lpos += cnode.length
+        node.length = lpos - pos
+        node.matched = True
+
+
+# Memoized nodes can be adopted by several candidate parents while seeds grow,
+# so point every node of the final tree back at the parent that kept it.
+def fix_parents(root):
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        for i, child in enumerate(node.children):
+            child.parent = node
+            child.parent_index = i
+            stack.append(child)
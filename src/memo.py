@@ -0,0 +1,59 @@
+# Packrat memo of rule results for one parse, keyed on (rule id, pos). A
+# result is a ParseNode, or a rules.MemoEntry for one with side effects.
+# Results are grouped in rows by position; with max_size set, the oldest rows
+# are evicted first, so memory stays bounded and positions far behind the
+# current one may be re-parsed.
+class MemoTable:
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.rows = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rule, pos):
+        row = self.rows.get(pos)
+        if row is not None:
+            node = row.get(id(rule))
+            if node is not None:
+                self.hits += 1
+                return node
+        self.misses += 1
+        return None
+
+    def put(self, rule, pos, node):
+        row = self.rows.get(pos)
+        if row is None:
+            row = self.rows[pos] = {}
+        if id(rule) not in row:
+            self.size += 1
+        row[id(rule)] = node
+        if self.max_size is not None and self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        rows = self.rows
+        while self.size > self.max_size and len(rows) > 1:
+            oldest = next(iter(rows))
+            self.size -= len(rows.pop(oldest))
+
+    # Drops the rows of positions before pos, after a cut made them unreachable.
+    # Rows are visited oldest first and the walk stops at the first row at or
+    # after pos, so a few rows added late for earlier positions may stay.
+    def discard_before(self, pos):
+        rows = self.rows
+        while rows:
+            oldest = next(iter(rows))
+            if oldest >= pos:
+                break
+            self.size -= len(rows.pop(oldest))
+
+    def clear(self):
+        self.rows = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,214 @@
+import os
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from src.rules import ParseNode, Star, Lit, Reg, Rule, resolve
+from src.flattree import FlatTree, NONE
+
+# Chunks per worker, so a slow chunk doesn't leave the other workers idle
+CHUNKS_PER_WORKER = 4
+
+# Inputs shorter than this are parsed in the calling process
+MIN_PARALLEL_SIZE = 1 << 16
+
+
+# Parses buffer with a Star of independent records using a pool of processes
+# and returns one Star node, as star.apply(buffer, 0, 0) would. The buffer is
+# split into chunks at record boundaries found with sync: a Rule matching a
+# record delimiter (chunks end right after a match) or a regex matching where a
+# record starts. Each chunk is parsed by a worker and sent back as flat arrays,
+# and the records are added under one Star node at their global offsets.
+#
+# Building ParseNode objects is the part that stays serial, and costs about a
+# third as much as parsing. With flat set, the result is instead a FlatTree of
+# the matched nodes, which the chunks are appended to array by array; this is
+# the mode that scales with the number of workers.
+#
+# Records must not look across a boundary: a record parsed in its chunk must
+# parse the same way in the whole buffer. If a chunk stops short of its end, so
+# does the Star, and later chunks are dropped.
+def parse_parallel(star, buffer: str, sync, workers: int = None, chunks: int = None, flat: bool = False):
+    star = resolve(star)
+    if not isinstance(star, Star):
+        raise TypeError(f'parse_parallel needs a Star rule, got {star}')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunks is None:
+        chunks = workers * CHUNKS_PER_WORKER
+    bounds = split_points(buffer, sync, chunks)
+    tasks = [(buffer[a:b], a, flat) for a, b in zip(bounds, bounds[1:])]
+    if workers <= 1 or len(buffer) < MIN_PARALLEL_SIZE or len(tasks) <= 1:
+        init_worker(star)
+        results = list(map(parse_chunk, tasks))
+    else:
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(star,)) as pool:
+            results = list(pool.map(parse_chunk, tasks))
+    if flat:
+        return stitch_flat(star, bounds, results)
+    return stitch(star, bounds, results)
+
+
+# Chunk boundaries: 0, positions found by sync near equal intervals, len(buffer)
+def split_points(buffer: str, sync, chunks: int):
+    end = len(buffer)
+    points = [0]
+    step = max(1, end // max(1, chunks))
+    for k in range(1, chunks):
+        point = find_boundary(buffer, sync, max(k * step, points[-1] + 1))
+        if point is None or point >= end:
+            break
+        if point > points[-1]:
+            points.append(point)
+    points.append(end)
+    return points
+
+
+# First record boundary at or after pos, or None
+def find_boundary(buffer: str, sync, pos: int):
+    if isinstance(sync, Lit):
+        i = buffer.find(sync.literal, pos)
+        return None if i < 0 else i + sync.length
+    if isinstance(sync, Reg):
+        m = sync.pattern.search(buffer, pos)
+        return None if m is None else m.end()
+    if isinstance(sync, Rule):
+        for p in range(pos, len(buffer)):
+            node = sync.apply(buffer, 0, p)
+            if node.matched and node.length > 0:
+                return p + node.length
+        return None
+    if isinstance(sync, str):
+        sync = re.compile(sync)
+    m = sync.search(buffer, pos)
+    return None if m is None else m.start()
+
+
+# Worker state: the Star being parsed and its rules by index. Rules are
+# numbered in traversal order, which is the same in every process.
+worker_star = None
+worker_rules = None
+
+
+def init_worker(star):
+    global worker_star, worker_rules
+    worker_star = star
+    worker_rules = number_rules(star)
+
+
+def number_rules(rule):
+    numbers = {}
+
+    def add(r):
+        numbers[r] = len(numbers)
+    rule.traverse(set(), add)
+    return numbers
+
+
+# Parses the chunk at offset. In flat mode returns (length parsed, FlatTree of
+# the chunk at its global offset). Otherwise returns (length parsed, number of
+# records, index of the last record, flat records): the Star's children in
+# preorder with their subtrees, as rule numbers, starts within the chunk,
+# lengths, matched flags and child counts.
+def parse_chunk(task):
+    text, offset, flat = task
+    node = worker_star.apply(text, 0, 0)
+    if flat:
+        tree = FlatTree(worker_rules)
+        tree.add_tree(node, offset=offset)
+        return node.length, tree
+    rules = worker_rules
+    rule = array('i')
+    start = array('q')
+    length = array('q')
+    matched = array('b')
+    counts = array('i')
+    last = 0
+    stack = list(reversed(node.children))
+    while stack:
+        n = stack.pop()
+        if n.parent is node:
+            last = len(rule)
+        rule.append(rules[n.rule])
+        start.append(n.start)
+        length.append(n.length)
+        matched.append(n.matched)
+        counts.append(len(n.children))
+        stack.extend(reversed(n.children))
+    return node.length, len(node.children), last, (rule, start, length, matched, counts)
+
+
+# Builds the Star node from the chunk results. This is the serial part of a
+# parallel parse, so nodes are linked directly instead of through Tree.add.
+def stitch(star, bounds, results):
+    rules = list(number_rules(star))
+    root = ParseNode(star, 0, True, 0)
+    root.children = []
+    last = len(results) - 1
+    for k, (consumed, records, last_record, flat) in enumerate(results):
+        offset = bounds[k]
+        rule, start, length, matched, counts = flat
+        complete = consumed == bounds[k + 1] - offset
+        n = len(rule)
+        if complete and k < last and records and not matched[last_record]:
+            # The attempt that failed at the end of a chunk isn't one in the whole buffer
+            n = last_record
+            records -= 1
+        # Nodes still expecting children, and how many, innermost last
+        parents = [root]
+        remaining = [records]
+        parent = root
+        siblings = root.children
+        left = records
+        for i in range(n):
+            while not left:
+                parents.pop()
+                remaining.pop()
+                parent = parents[-1]
+                siblings = parent.children
+                left = remaining[-1]
+            left -= 1
+            node = ParseNode(rules[rule[i]], start[i] + offset, matched[i] == 1, length[i])
+            node.parent = parent
+            node.parent_index = len(siblings)
+            siblings.append(node)
+            if counts[i]:
+                remaining[-1] = left
+                parents.append(node)
+                remaining.append(counts[i])
+                parent = node
+                siblings = node.children = []
+                left = counts[i]
+        root.length += consumed
+        if not complete:
+            break
+    return root
+
+
+# Appends the chunk FlatTrees after a new root. A chunk's nodes keep their order,
+# so their indices just move by the nodes before them; index 0, the chunk's
+# Star, becomes the new root.
+def stitch_flat(star, bounds, results):
+    tree = FlatTree(number_rules(star))
+    tree.add_node(star, 0, 0)
+    last = NONE
+    for k, (consumed, part) in enumerate(results):
+        d = len(tree) - 1
+        tree.rule.extend(part.rule[1:])
+        tree.start.extend(part.start[1:])
+        tree.length.extend(part.length[1:])
+        tree.matched.extend(part.matched[1:])
+        for name in ('parent', 'first_child', 'next_sibling', 'last_child'):
+            indices = getattr(part, name)
+            getattr(tree, name).extend(array('i', [i + d if i > 0 else i for i in indices[1:]]))
+        first = part.first_child[0]
+        if first != NONE:
+            if last == NONE:
+                tree.first_child[0] = first + d
+            else:
+                tree.next_sibling[last] = first + d
+            last = tree.last_child[0] = part.last_child[0] + d
+        tree.length[0] += consumed
+        if consumed != bounds[k + 1] - bounds[k]:
+            break
+    return tree
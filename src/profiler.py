@@ -0,0 +1,137 @@
+import sys
+from time import perf_counter_ns
+
+from src.rules import Alt, describe
+from src.trace import Tracer
+
+
+# Totals for one rule. Times are in nanoseconds.
+class RuleStats:
+    __slots__ = ('rule', 'calls', 'successes', 'failures', 'inclusive', 'exclusive', 'consumed',
+                 'reevaluations', 'memo_hits', 'backtracks', 'wasted', 'active')
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        # Time in the rule including its subrules, counted once for recursive calls
+        self.inclusive = 0
+        # Time in the rule itself
+        self.exclusive = 0
+        # Characters matched by successful calls
+        self.consumed = 0
+        # Calls at a position the rule was already evaluated at
+        self.reevaluations = 0
+        self.memo_hits = 0
+        # For an Alt: alternatives that failed, and the time they took
+        self.backtracks = 0
+        self.wasted = 0
+        # Calls in progress, for inclusive time of recursive rules
+        self.active = 0
+
+
+# Tracer that collects RuleStats for every rule entered while it is installed
+# on a ParseContext, or on a Grammar as Grammar.tracer, over any number of
+# parses. Besides the per rule totals it keeps exclusive time per call stack,
+# which collapsed writes in the format flamegraph.pl and speedscope read.
+class Profiler(Tracer):
+
+    def __init__(self, clock=perf_counter_ns):
+        self.clock = clock
+        # id(rule) -> RuleStats
+        self.stats = {}
+        # Active calls, innermost last: [stats, start time, time in subrules, call stack id]
+        self.frames = []
+        # (id(rule), pos) of every evaluation in the current parse
+        self.evaluated = set()
+        # (caller's call stack id, id(rule)) -> call stack id; call stack id -> (caller's id, label)
+        self.stack_ids = {}
+        self.stacks = [None]
+        # call stack id -> exclusive time
+        self.stack_time = [0]
+
+    def rule_stats(self, rule):
+        stats = self.stats.get(id(rule))
+        if stats is None:
+            stats = self.stats[id(rule)] = RuleStats(rule)
+        return stats
+
+    def enter(self, rule, buffer, pos: int, depth: int):
+        stats = self.rule_stats(rule)
+        stats.calls += 1
+        stats.active += 1
+        if not self.frames:
+            # A top level call starts a parse, whose positions are new
+            self.evaluated.clear()
+        key = (id(rule), pos)
+        if key in self.evaluated:
+            stats.reevaluations += 1
+        else:
+            self.evaluated.add(key)
+        caller = self.frames[-1][3] if self.frames else 0
+        stack = self.stack_ids.get((caller, id(rule)))
+        if stack is None:
+            stack = self.stack_ids[(caller, id(rule))] = len(self.stacks)
+            self.stacks.append((caller, describe(rule)))
+            self.stack_time.append(0)
+        self.frames.append([stats, self.clock(), 0, stack])
+
+    def exit(self, rule, buffer, pos: int, depth: int, node):
+        now = self.clock()
+        stats, start, inner, stack = self.frames.pop()
+        elapsed = now - start
+        stats.active -= 1
+        if stats.active == 0:
+            stats.inclusive += elapsed
+        stats.exclusive += elapsed - inner
+        self.stack_time[stack] += elapsed - inner
+        if node.matched:
+            stats.successes += 1
+            stats.consumed += node.length
+        else:
+            stats.failures += 1
+        if self.frames:
+            caller = self.frames[-1]
+            caller[2] += elapsed
+            if not node.matched and isinstance(caller[0].rule, Alt):
+                caller[0].backtracks += 1
+                caller[0].wasted += elapsed
+
+    def hit(self, rule, buffer, pos: int, depth: int, node):
+        self.rule_stats(rule).memo_hits += 1
+
+    # RuleStats sorted by key, a RuleStats attribute, largest first
+    def sorted_stats(self, key: str = 'exclusive'):
+        return sorted(self.stats.values(), key=lambda s: getattr(s, key), reverse=True)
+
+    # Writes a table of the rules, largest key first, times in milliseconds
+    def table(self, file=None, key: str = 'exclusive', limit: int = None):
+        if file is None:
+            file = sys.stdout
+        rows = [('rule', 'calls', 'ok', 'fail', 'incl ms', 'excl ms', 'consumed', 'reeval', 'memo', 'backtracks',
+                 'wasted ms')]
+        for s in self.sorted_stats(key)[:limit]:
+            rows.append((describe(s.rule), str(s.calls), str(s.successes), str(s.failures), f'{s.inclusive / 1e6:.3f}',
+                         f'{s.exclusive / 1e6:.3f}', str(s.consumed), str(s.reevaluations), str(s.memo_hits),
+                         str(s.backtracks), f'{s.wasted / 1e6:.3f}'))
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        for row in rows:
+            cells = [row[0].ljust(widths[0])] + [cell.rjust(w) for cell, w in zip(row[1:], widths[1:])]
+            print('  '.join(cells).rstrip(), file=file)
+
+    # Writes one line per call stack, root first, with its exclusive time in
+    # microseconds: "Root;Child;Leaf 1234". A ';' in a rule label is written
+    # as ':' since it separates the frames.
+    def collapsed(self, file=None):
+        if file is None:
+            file = sys.stdout
+        for stack in range(1, len(self.stacks)):
+            micros = self.stack_time[stack] // 1000
+            if micros <= 0:
+                continue
+            names = []
+            while stack:
+                stack, label = self.stacks[stack]
+                names.append(label.replace(';', ':'))
+            print(';'.join(reversed(names)), micros, file=file)
@@ -1,7 +1,10 @@
-from .tree import Tree
+from .tree import IndexedTree
+from .trace import PrintTracer
+from .charclass import pattern_first, pattern_width, pattern_run, END
 import re
 from abc import ABC, abstractmethod
-from enum import Enum
+from collections import namedtuple
+from weakref import WeakSet
 
 class InvalidRegexDefinitionError(Exception):
     def __init__(self, msg):
@@ -27,32 +30,192 @@ class Lazy:
     # def __str__(self):
     #     return self.rule.__str__()
 
-class AltType(Enum):
-    NONE = 0
-    LEFT = 1
-    REST = 2
 
-class ParseNode(Tree):
+# The rule a chain of Lazy placeholders stands for
+def resolve(rule):
+    while isinstance(rule, Lazy):
+        rule = rule.rule
+    return rule
+
+
+class ParseNode(IndexedTree):
+    # lookahead: how many characters from start the parse examined, set only
+    # by incremental.ReachTracer
+    __slots__ = ('start', 'length', 'matched', 'lookahead')
 
     def __init__(self, rule, start: int, matched: bool = False, length: int = 0):
-        Tree.__init__(self, rule)
-        self.rule = rule
+        IndexedTree.__init__(self, rule)
         self.start = start
         self.length = length
         self.matched = matched
-        self.alt_type = AltType.NONE
-        # Save state of last child attempted
-        self.next_subrule_num = 0
-        self.last_subrule_matched = False
-        self.last_subrule_length = 0
 
+    # The rule is the node's tree value; no separate slot is kept for it
+    @property
+    def rule(self):
+        return self.value
 
     def clear(self):
-        Tree.clear(self)
+        IndexedTree.clear(self)
         self.length = 0
         self.matched = False
 
 
+# Marks a choice point on ParseContext.choices that a Cut committed
+COMMITTED = -1
+
+# ParseContext.cut_depth while no Cut ran
+NO_CUT = float('inf')
+
+
+# A memoized result that did more than build node: with cut set, a Cut in it
+# committed the choice point the rule was called in, and errors holds the
+# ParseErrors Recover rules in it recorded. A memo hit replays these through
+# ParseContext.replay; other results are memoized as the bare node.
+MemoEntry = namedtuple('MemoEntry', ['node', 'cut', 'errors'])
+
+
+# The furthest failure of a parse: at pos, the rules in expected were tried and
+# failed. For an error a Recover rule skipped, start and end give the skipped
+# input; they are None for the failure of a whole parse.
+class ParseError(namedtuple('ParseError', ['pos', 'expected', 'start', 'end'])):
+
+    def __str__(self):
+        names = sorted({describe(r) for r in self.expected})
+        found = f'expected {" or ".join(names)}' if names else 'no match'
+        if self.start is None:
+            return f'{found} at {self.pos}'
+        return f'{found} at {self.pos}, skipped {self.start}:{self.end}'
+
+
+def describe(rule):
+    if isinstance(rule, Lit):
+        return repr(rule.literal)
+    if isinstance(rule, Reg):
+        return f'/{rule.reg}/'
+    return str(rule)
+
+
+# Rules whose debug flag is set
+DEBUG_RULES = WeakSet()
+
+
+# Per-parse state threaded through Rule.apply. Set memo to a MemoTable to turn
+# on packrat memoization of every rule result, and tracer to a trace.Tracer to
+# receive rule entry/exit events. Rule.DEBUG installs a PrintTracer, and a rule
+# with debug set one that prints only such rules.
+class ParseContext:
+
+    def __init__(self, memo=None, tracer=None):
+        if tracer is None:
+            if Rule.DEBUG:
+                tracer = PrintTracer()
+            elif DEBUG_RULES:
+                tracer = PrintTracer(flagged_only=True)
+        self.memo = memo
+        self.tracer = tracer
+        self.parser = None
+        # Open choice points, innermost last: the position an Alt alternative,
+        # Opt child or Star iteration rewinds to if it fails, or COMMITTED
+        self.choices = []
+        # Fewest open choice points a Cut saw since the innermost memoized
+        # call began, see mark
+        self.cut_depth = NO_CUT
+        # Furthest position where a terminal failed, and the terminals that
+        # failed there; see fail
+        self.furthest = -1
+        self.expected = set()
+        # ParseErrors of the input Recover rules skipped, in input order. An
+        # attempt that fails takes the errors it recorded back with it.
+        self.errors = []
+
+    # Readies the context for a new parse, keeping its memo table and tracer.
+    # errors becomes a new list, so the last parse's errors stay as they were.
+    def reset(self):
+        if self.memo is not None:
+            self.memo.clear()
+        self.parser = None
+        self.choices = []
+        self.cut_depth = NO_CUT
+        self.furthest = -1
+        self.expected = set()
+        self.errors = []
+
+    # Records that rule failed at pos. Called by terminals, and by an Alt or
+    # Star whose dispatch table or guard ruled out trying its children, which
+    # then stands for their terminals. Only failures reach here, at the cost of
+    # a comparison, so tracking is always on.
+    def fail(self, rule, pos: int):
+        if pos > self.furthest:
+            self.furthest = pos
+            self.expected = {rule}
+        elif pos == self.furthest:
+            self.expected.add(rule)
+
+    # The furthest failure so far as a ParseError, or None if nothing failed
+    def failure(self):
+        if self.furthest < 0:
+            return None
+        return ParseError(self.furthest, frozenset(self.expected), None, None)
+
+    # Commits the innermost choice point, for a Cut at pos
+    def cut(self, buffer, pos: int):
+        choices = self.choices
+        if choices:
+            choices[-1] = COMMITTED
+        if len(choices) < self.cut_depth:
+            self.cut_depth = len(choices)
+        self.commit(buffer, pos)
+
+    # Starts watching a rule call whose result will be memoized, see memo_entry
+    def mark(self):
+        depth = self.cut_depth
+        self.cut_depth = NO_CUT
+        return depth, len(self.choices), len(self.errors)
+
+    # What to memoize for node, the result of the call mark was taken at: a
+    # MemoEntry if a Cut in it ran with no choice point of its own open, so
+    # committed the one the call was made in, or it recorded errors, else node
+    def memo_entry(self, node, mark):
+        depth, level, nerrors = mark
+        cut = self.cut_depth <= level
+        if depth < self.cut_depth:
+            self.cut_depth = depth
+        if cut or len(self.errors) > nerrors:
+            return MemoEntry(node, cut, tuple(self.errors[nerrors:]))
+        return node
+
+    # The node of a memoized entry, after doing again what its call did to
+    # the parse state. A replayed cut commits memory from the call's start.
+    def replay(self, entry, buffer, pos: int):
+        if entry.cut:
+            self.cut(buffer, pos)
+        self.errors.extend(entry.errors)
+        return entry.node
+
+    # Drops what no open choice point can backtrack to after a Cut at pos:
+    # memo rows and, for a streamed buffer, the input before the oldest
+    # uncommitted choice point, or before pos if there is none. Choice points
+    # further in start no earlier, so the oldest one is the first found.
+    def commit(self, buffer, pos: int):
+        for p in self.choices:
+            if p != COMMITTED:
+                pos = p
+                break
+        if self.memo is not None:
+            self.memo.discard_before(pos)
+        release = getattr(buffer, 'release', None)
+        if release is not None:
+            release(pos)
+
+    # Rules flagged left recursive by Grammar.set_left_recursives are handed to
+    # the llrules packrat parser, shared by all such calls on the same buffer.
+    def left_rec_parser(self, buffer):
+        if self.parser is None or self.parser.buffer is not buffer:
+            from .llrules import Parser
+            self.parser = Parser(buffer)
+        return self.parser
+
+
 class Rule(ABC):
     DEBUG = False
 
@@ -63,64 +226,59 @@ class Rule(ABC):
         self.is_left_recursive = False
         self.is_alt = False
         self.debug = False
+        # Characters a match can start with (END for end of input), None if unknown
+        self.first = None
         if len(args) > 0:
             self.subrules.extend(args)
 
-    def apply(self, buffer, depth: int, pos: int, parent_pn: ParseNode = None, choice_stack = None, ptree_list = None, mode = None):
-        self.debugp(' ' * depth + f'{depth}: Start: apply {self} at {pos} : ...[{buffer[pos:pos + 40]}]...')
-        if choice_stack is None:
-            choice_stack = []
-        if ptree_list is None:
-            ptree_list = []
-        if mode is None:
-            mode = ['BUILD']
-        my_node = ParseNode(self, pos)
-        if parent_pn is not None:
-            parent_pn.add(my_node)
-        no_left_recursion = False
-        if self.is_alt:
-            no_left_recursion = self.left_rec_count(my_node) > len(buffer) - pos
-        self.apply_internal(buffer, depth, pos, my_node, no_left_recursion)
-
-        self.debugp(
-            ' ' * depth + f'{depth}: End match:{return_node.matched} length:{return_node.length}: apply {self} to {pos} : ...[{buffer[pos:pos + 40]}]...')
-        return return_node
-
-    def left_rec_apply(self, buffer, depth, pos, parent_pn):
-        self.memo[pos] = ParseNode(self, pos)
-        while True:
+    def apply(self, buffer, depth: int, pos: int, parent_pn: ParseNode = None, ctx: ParseContext = None):
+        if ctx is None:
+            ctx = ParseContext()
+        tracer = ctx.tracer
+        memo = ctx.memo
+        if memo is not None:
+            my_node = memo.get(self, pos)
+            if my_node is not None:
+                if my_node.__class__ is MemoEntry:
+                    my_node = ctx.replay(my_node, buffer, pos)
+                if parent_pn is not None:
+                    parent_pn.add(my_node)
+                if tracer is not None:
+                    tracer.hit(self, buffer, pos, depth, my_node)
+                return my_node
+        if tracer is not None:
+            tracer.enter(self, buffer, pos, depth)
+        if self.is_left_recursive:
+            my_node = ctx.left_rec_parser(buffer).apply(self, pos, parent_pn)
+        else:
             my_node = ParseNode(self, pos)
             if parent_pn is not None:
                 parent_pn.add(my_node)
-            self.apply_internal(buffer, depth, pos, my_node)
-            if parent_pn is not None:
-                parent_pn.remove(my_node)
-            saved = self.memo[pos]
-            if not my_node.matched:
-                break
-            elif saved.matched and my_node.length <= saved.length:
-                break
+            if memo is None:
+                self.apply_internal(buffer, depth, pos, my_node, ctx)
             else:
-                self.memo[pos] = my_node
-        return_node = self.memo[pos]
-        if parent_pn is not None:
-            parent_pn.add(return_node)
-        return return_node
-
-    def left_rec_call(self, parent_pn):
-        if parent_pn is None or parent_pn.child_count() > 0:
-            return False
-        ancestor = parent_pn
-        while ancestor is not None:
-            if ancestor.rule == self and ancestor.child_count() == 1:
-                return True
-            if ancestor.parent is not None and ancestor.parent.children[0] != ancestor:
-                return False
-            ancestor = ancestor.parent
-        return False
+                mark = ctx.mark()
+                self.apply_internal(buffer, depth, pos, my_node, ctx)
+                memo.put(self, pos, ctx.memo_entry(my_node, mark))
+        if tracer is not None:
+            tracer.exit(self, buffer, pos, depth, my_node)
+        return my_node
+
+    # Setting debug prints the rule's calls in parses without a tracer of their own
+    @property
+    def debug(self):
+        return self.__dict__['debug']
+
+    @debug.setter
+    def debug(self, value: bool):
+        self.__dict__['debug'] = value
+        if value:
+            DEBUG_RULES.add(self)
+        else:
+            DEBUG_RULES.discard(self)
 
     @abstractmethod
-    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, no_left_recursion):
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
         pass
 
     def remove_lazy_rules(self):
@@ -145,47 +303,108 @@ class Rule(ABC):
                     pred.subrules.insert(idx, k.rule)
         return return_rule
 
-    def init_memos(self):
-        def clear_memo(rule, *args):
-            rule.memo = {}
-        self.traverse(set(), clear_memo)
-
-
+    # Calls func(rule, *args) once for every rule reachable from this one, in depth first pre-order
     def traverse(self, visited, func, *args):
-        if self in visited:
-            return
-        else:
-            func(self, *args)
-            visited.add(self)
-            for rule in self.subrules:
-                if isinstance(rule, Lazy):
-                    rule.rule.traverse(visited, func, args)
-                else:
-                    rule.traverse(visited, func, *args)
-
-    def debugp(self, param):
-        if Rule.DEBUG or self.debug:
-            print(param)
+        stack = [self]
+        while stack:
+            rule = stack.pop()
+            if isinstance(rule, Lazy):
+                rule = rule.rule
+            if rule in visited:
+                continue
+            func(rule, *args)
+            visited.add(rule)
+            stack.extend(reversed(rule.subrules))
+
+    # FIRST set of a terminal rule, see Grammar.set_firsts
+    def first_chars(self):
+        return None
+
+    # End (exclusive) of the input apply_internal may have examined for node,
+    # not counting what its subrules examined. By default one character past
+    # the match, covering Alt dispatch and Star guard peeks.
+    def reach(self, buffer, pos: int, node: ParseNode):
+        if self.is_left_recursive:
+            # The llrules parser doesn't report on the rules it applies
+            return len(buffer) + 1
+        return pos + node.length + 1
 
     def __str__(self):
         return self.name
 
 
+# Ordered choice over literals in one pass: looks up the input slice for each
+# literal length and returns the index of the first literal that matches, or -1
+class LiteralTable:
+
+    def __init__(self, literals):
+        # Length -> {literal: index of its first occurrence}
+        buckets = {}
+        for i, literal in enumerate(literals):
+            buckets.setdefault(len(literal), {}).setdefault(literal, i)
+        self.buckets = tuple(buckets.items())
+        self.longest = max(buckets, default=0)
+
+    def match(self, buffer, pos: int):
+        best = -1
+        for length, bucket in self.buckets:
+            i = bucket.get(buffer[pos:pos + length])
+            if i is not None and (best < 0 or i < best):
+                best = i
+        return best
+
+
 class Alt(Rule):
     def __init__(self, name, *args):
         Rule.__init__(self, name, *args)
         self.is_alt = True
-
-    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, no_left_recursion):
-        for i, child in enumerate(self.subrules):
-            if no_left_recursion and i == 1:
-                continue  # don't choose leftmost alternative
-            cnode = child.apply(buffer, depth + 1, pos, node)
+        # Alternatives worth trying for the next input character, set by Grammar.set_dispatch_tables
+        self.dispatch = None
+        self.dispatch_default = None
+        # LiteralTable for an Alt of Lit rules, set by Grammar.set_literal_tables
+        self.literals = None
+
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
+        if ctx is None:
+            ctx = ParseContext()
+        if self.literals is not None and buffer.__class__ is str:
+            # Only the alternative that matches is applied, so failed ones leave no nodes
+            i = self.literals.match(buffer, pos)
+            if i >= 0:
+                cnode = self.subrules[i].apply(buffer, depth + 1, pos, node, ctx=ctx)
+                node.length += cnode.length
+                node.matched = True
+            else:
+                for child in self.subrules:
+                    ctx.fail(child, pos)
+            return
+        candidates = self.subrules
+        if self.dispatch is not None:
+            candidates = self.dispatch.get(buffer[pos:pos + 1])
+            if candidates is None:
+                candidates = self.dispatch_default
+                ctx.fail(self, pos)
+        choices = ctx.choices
+        errors = ctx.errors
+        nerrors = len(errors)
+        for child in candidates:
+            choices.append(pos)
+            cnode = child.apply(buffer, depth + 1, pos, node, ctx=ctx)
+            committed = choices.pop() == COMMITTED
             if cnode.matched:
                 node.length += cnode.length
                 node.matched = True
                 # node.add(cnode)
                 break
+            if len(errors) > nerrors:
+                del errors[nerrors:]
+            if committed:
+                break
+
+    def reach(self, buffer, pos: int, node: ParseNode):
+        if self.literals is not None:
+            return max(pos + self.literals.longest, Rule.reach(self, buffer, pos, node))
+        return Rule.reach(self, buffer, pos, node)
 
     # def __str__(self):
     #     return f'{self.name}[' + '|'.join([c.name for c in self.subrules]) + ']'
@@ -195,10 +414,14 @@ class Seq(Rule):
     def __init__(self, name, *args):
         Rule.__init__(self, name, *args)
 
-    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, no_left_recursion = False):
+    # Asked only of an empty Seq, which fails everywhere
+    def first_chars(self):
+        return frozenset()
+
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
         lpos = pos
         for child in self.subrules:
-            cnode = child.apply(buffer, depth + 1, lpos, node)
+            cnode = child.apply(buffer, depth + 1, lpos, node, ctx=ctx)
             if cnode.matched:
                 lpos += cnode.length
                 node.length += cnode.length
@@ -217,16 +440,23 @@ class Opt(Rule):
         Rule.__init__(self, "Opt", arg)
         self.is_nullable = True
 
-    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode), no_left_recursion = False):
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
+        if ctx is None:
+            ctx = ParseContext()
         rule = self.subrules[0]
-        cnode = rule.apply(buffer, depth + 1, pos, node)
+        choices = ctx.choices
+        nerrors = len(ctx.errors)
+        choices.append(pos)
+        cnode = rule.apply(buffer, depth + 1, pos, node, ctx=ctx)
+        committed = choices.pop() == COMMITTED
         if cnode.matched:
             node.length = cnode.length
             node.matched = True
             # node.add(cnode)
         else:
+            del ctx.errors[nerrors:]
             node.length = 0
-            node.matched = True
+            node.matched = not committed
 
     # def __str__(self):
     #     return self.subrules[0].name + '?'
@@ -238,46 +468,176 @@ class Lit(Rule):
         self.literal = arg
         self.length = len(self.literal)
 
-    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, no_left_recursion = False):
-        end = pos + self.length
-        if len(buffer) >= end and self.literal == buffer[pos:end]:
-            # print(f'Lit:{self.literal}  buf:{buffer[pos:end]}')
+    def first_chars(self):
+        return frozenset({self.literal[0]}) if self.literal else None
+
+    def reach(self, buffer, pos: int, node: ParseNode):
+        return pos + self.length
+
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
+        if buffer.startswith(self.literal, pos):
             node.length = self.length
             node.matched = True
+        elif ctx is not None:
+            ctx.fail(self, pos)
 
 
 class Reg(Rule):
     def __init__(self, arg):
         Rule.__init__(self, "Reg")
         self.reg = arg
-
-    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, no_left_recursion = False):
-        m = re.search(self.reg, buffer[pos:])
-        if m is None or m.start() > 0:
-            return
-        elif m.start() == 0:
-            node.length = m.end() - m.start()
-            node.matched = True
-            if node.length == 0:
-                raise InvalidRegexDefinitionError(f'Regex {self.reg} matches null string')
+        try:
+            self.pattern = re.compile(arg)
+        except re.error as e:
+            raise InvalidRegexDefinitionError(f'Regex {arg} does not compile: {e}')
+        if self.pattern.match('') is not None:
+            raise InvalidRegexDefinitionError(f'Regex {arg} matches null string')
+        # (FIRST set, longest match) of the pattern, computed by reach
+        self.shape = None
+
+    def first_chars(self):
+        return pattern_first(self.pattern)
+
+    # A match looked one character past its end to stop. A failure looked at
+    # one character if that can't start a match, else at most the longest
+    # match, or anything up to the end of input if that is unbounded.
+    def reach(self, buffer, pos: int, node: ParseNode):
+        if node.matched:
+            return pos + node.length + 1
+        if self.shape is None:
+            self.shape = (self.first_chars(), pattern_width(self.pattern))
+        first, width = self.shape
+        if first is not None and buffer[pos:pos + 1] not in first:
+            return pos + 1
+        if width is None:
+            return len(buffer) + 1
+        return pos + width + 1
+
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
+        if buffer.__class__ is str:
+            m = self.pattern.match(buffer, pos)
+            if m is None:
+                if ctx is not None:
+                    ctx.fail(self, pos)
+                return
+            end = m.end()
+        else:
+            end = buffer.match(self.pattern, pos)
+            if end is None:
+                if ctx is not None:
+                    ctx.fail(self, pos)
+                return
+        node.length = end - pos
+        node.matched = True
+        if node.length == 0:
+            # Only reachable through context-dependent patterns, e.g. lookarounds or \b
+            raise InvalidRegexDefinitionError(f'Regex {self.reg} matches null string at {pos}')
 
     # def __str__(self):
     #     return 're[' + self.reg + ']'
 
 
+# Reg for a pattern that is one character class, e.g. [+-] or \s, matched by
+# looking the character up in a table instead of running the regex engine.
+# Other buffers than str go through the pattern, like a Reg.
+class CharSet(Reg):
+    def __init__(self, arg, chars=None):
+        Reg.__init__(self, arg)
+        if chars is None:
+            chars = char_tables(self.pattern, False)[0]
+        self.chars = chars
+
+    def first_chars(self):
+        return self.chars
+
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
+        if buffer.__class__ is not str:
+            Reg.apply_internal(self, buffer, depth, pos, node, ctx)
+        elif buffer[pos:pos + 1] in self.chars:
+            node.length = 1
+            node.matched = True
+        elif ctx is not None:
+            ctx.fail(self, pos)
+
+
+# Reg for a run of character classes, e.g. [0-9]+ or [a-z_][a-z0-9_]*, with a
+# table of the characters a match starts with. The table decides failures,
+# the common case while alternatives are tried in turn; a match is measured
+# by the pattern, which scans a run faster than a Python loop over a table.
+class CharRun(Reg):
+    def __init__(self, arg, head=None):
+        Reg.__init__(self, arg)
+        if head is None:
+            head = char_tables(self.pattern, True)[0]
+        self.head = head
+
+    def first_chars(self):
+        return self.head
+
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
+        if buffer.__class__ is not str:
+            Reg.apply_internal(self, buffer, depth, pos, node, ctx)
+        elif buffer[pos:pos + 1] in self.head:
+            node.length = self.pattern.match(buffer, pos).end() - pos
+            node.matched = True
+        elif ctx is not None:
+            ctx.fail(self, pos)
+
+
+def char_tables(pattern, run: bool):
+    tables = pattern_run(pattern)
+    if tables is None or (tables[1] is not None) != run:
+        kind = 'character run' if run else 'character class'
+        raise InvalidRegexDefinitionError(f'Regex {pattern.pattern} is not a {kind}')
+    return tables
+
+
+# CharSet or CharRun for rule, a Reg, or None if its pattern is neither
+def char_terminal(rule):
+    tables = pattern_run(rule.pattern)
+    if tables is None:
+        return None
+    head, tail = tables
+    return CharSet(rule.reg, head) if tail is None else CharRun(rule.reg, head)
+
+
 class Star(Rule):
     def __init__(self, name, arg):
         Rule.__init__(self, name, arg)
         self.is_nullable = True
         self.rule = arg
+        # FIRST set of a non-nullable repeated rule, set by Grammar.set_dispatch_tables
+        self.guard = None
 
-    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, no_left_recursion = False):
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
+        if ctx is None:
+            ctx = ParseContext()
         lpos = pos
+        guard = self.guard
+        # Nothing can backtrack behind a top level Star, so a streamed input can drop what it consumed
+        release = getattr(buffer, 'release', None) if depth == 0 else None
+        choices = ctx.choices
+        errors = ctx.errors
         while True:
-            cnode = self.rule.apply(buffer, depth + 1, lpos, node)
+            if guard is not None and buffer[lpos:lpos + 1] not in guard:
+                ctx.fail(self.subrules[0], lpos)
+                break
+            nerrors = len(errors)
+            choices.append(lpos)
+            cnode = self.rule.apply(buffer, depth + 1, lpos, node, ctx=ctx)
+            committed = choices.pop() == COMMITTED
             if cnode.matched:
                 lpos += cnode.length
                 node.length += cnode.length
+                if release is not None:
+                    release(lpos)
+                continue
+            if len(errors) > nerrors:
+                del errors[nerrors:]
+            if committed:
+                # An iteration failed past a cut, so the Star fails
+                node.length = 0
+                return
             else:
                 break
         node.matched = True
@@ -291,20 +651,112 @@ class Eps(Rule):
         Rule.__init__(self, name)
         self.is_nullable = True
 
-    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, no_left_recursion = False):
+    def first_chars(self):
+        return frozenset()
+
+    def reach(self, buffer, pos: int, node: ParseNode):
+        return pos
+
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
         node.matched = True
 
     # def __str__(self):
     #     return '<EPS>'
 
 
+# Matches the empty string and commits the innermost enclosing choice point:
+# if the rest of that Alt alternative, Opt child or Star iteration then fails,
+# the Alt fails without trying further alternatives, the Opt fails instead of
+# matching empty, and the Star fails instead of stopping. As nothing before the
+# oldest uncommitted choice point can be read again, see ParseContext.commit.
+# Engines without choice points of their own (llrules, vm, forest, earley)
+# treat it as Eps.
+class Cut(Rule):
+    def __init__(self, name):
+        Rule.__init__(self, name)
+        self.is_nullable = True
+
+    def first_chars(self):
+        return frozenset()
+
+    def reach(self, buffer, pos: int, node: ParseNode):
+        return pos
+
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
+        node.matched = True
+        if ctx is not None:
+            ctx.cut(buffer, pos)
+
+
+# Error recovery: skips from pos to just past the next match of sync, or to the
+# end of input if there is none, and records a ParseError for the skipped
+# input in ctx.errors. Tried as the last alternative of a record, see recover,
+# it turns a malformed record into a node of this rule and lets the parse go on
+# with the next one. It fails only at the end of input. The error gives where
+# rule, the record, failed furthest when applied at pos on its own, so it is
+# the same however the parse got here and whatever was memoized. An enclosing
+# attempt that fails takes the error back, see ParseContext.errors.
+class Recover(Rule):
+    def __init__(self, name, sync, rule=None):
+        if rule is None:
+            Rule.__init__(self, name, sync)
+        else:
+            Rule.__init__(self, name, sync, rule)
+
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
+        if not buffer[pos:pos + 1]:
+            return
+        end = self.skip(buffer, depth, pos)
+        node.length = end - pos
+        node.matched = True
+        if ctx is not None:
+            failure = None
+            if len(self.subrules) > 1:
+                scratch = ParseContext()
+                # Keeps a Cut in the record from releasing input before pos
+                scratch.choices.append(pos)
+                self.subrules[1].apply(buffer, depth + 1, pos, ctx=scratch)
+                failure = scratch.failure()
+            if failure is None:
+                ctx.errors.append(ParseError(pos, frozenset(), pos, end))
+            else:
+                ctx.errors.append(ParseError(failure.pos, failure.expected, pos, end))
+
+    # End of the first non-empty match of sync at or after pos, or of the input
+    def skip(self, buffer, depth: int, pos: int):
+        sync = self.subrules[0]
+        if buffer.__class__ is str:
+            if isinstance(sync, Lit) and sync.length > 0:
+                i = buffer.find(sync.literal, pos)
+                return len(buffer) if i < 0 else i + sync.length
+            if isinstance(sync, Reg):
+                m = sync.pattern.search(buffer, pos)
+                return len(buffer) if m is None else m.end()
+        # Failed sync attempts aren't failures of the parse
+        scratch = ParseContext()
+        scratch.choices.append(pos)
+        p = pos
+        while buffer[p:p + 1]:
+            cnode = sync.apply(buffer, depth + 1, p, ctx=scratch)
+            if cnode.matched and p + cnode.length > pos:
+                return p + cnode.length
+            p += 1
+        return p
+
+
 class Eof(Rule):
     def __init__(self, name):
         Rule.__init__(self, name)
 
-    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, no_left_recursion = False):
-        if pos == len(buffer):
+    def first_chars(self):
+        return frozenset({END})
+
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx: ParseContext = None):
+        # Also works on an SBuffer without reading it to the end
+        if not buffer[pos:pos + 1]:
             node.matched = True
+        elif ctx is not None:
+            ctx.fail(self, pos)
 
     # def __str__(self):
     #     return '<EOF>'
@@ -318,6 +770,15 @@ def eps():
     return Eps('EPS')
 
 
+def cut():
+    return Cut('CUT')
+
+
+# Tries rule, and if it fails skips past the next sync, see Recover
+def recover(name, rule, sync):
+    return Alt(name, rule, Recover('ERROR', sync, rule))
+
+
 def lazy():
     return Lazy()
 
@@ -1,8 +1,86 @@
-
+# Character-indexed input read from a text stream through a sliding window, so
+# inputs larger than memory can be parsed. It supports the operations the
+# terminal rules need: slicing, startswith and anchored regex matches. Text
+# before a position passed to release() is dropped and can't be read again.
+#
+# A regex match is attempted with at least chunk_size characters loaded past
+# its start, and retried on a larger window when it reaches the window end, so
+# only patterns that must look further than chunk_size ahead to fail can differ
+# from matching the whole text.
 class SBuffer:
 
-    def __init__(self, text: str):
-        self.string = str
+    def __init__(self, stream, chunk_size: int = 1 << 20):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.window = ''
+        # Index of window[0] in the whole text
+        self.offset = 0
+        self.eof = False
+
+    @classmethod
+    def open(cls, path, encoding: str = 'utf-8', chunk_size: int = 1 << 20):
+        return cls(open(path, encoding=encoding, newline=''), chunk_size)
+
+    def close(self):
+        self.stream.close()
+
+    # Loads text until the window reaches index end, or the whole stream if end is None
+    def fill(self, end: int = None):
+        while not self.eof and (end is None or self.offset + len(self.window) < end):
+            size = self.chunk_size if end is None else max(self.chunk_size, end - self.offset - len(self.window))
+            chunk = self.stream.read(size)
+            if chunk:
+                self.window += chunk
+            else:
+                self.eof = True
+
+    def check(self, pos: int):
+        if pos < self.offset:
+            raise IndexError(f'Position {pos} was released, buffer starts at {self.offset}')
+
+    def release(self, pos: int):
+        # Dropping the prefix copies the window, so only do it a chunk at a time
+        if pos - self.offset >= self.chunk_size:
+            self.fill(pos)
+            self.window = self.window[pos - self.offset:]
+            self.offset = pos
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start = 0 if key.start is None else key.start
+            if key.stop is None:
+                self.fill()
+                stop = self.offset + len(self.window)
+            else:
+                stop = key.stop
+            self.check(start)
+            self.fill(stop)
+            return self.window[start - self.offset:stop - self.offset:key.step]
+        self.check(key)
+        self.fill(key + 1)
+        if key >= self.offset + len(self.window):
+            raise IndexError('SBuffer index out of range')
+        return self.window[key - self.offset]
 
+    # Reads the rest of the stream to know the length
+    def __len__(self):
+        self.fill()
+        return self.offset + len(self.window)
 
+    def startswith(self, prefix: str, pos: int):
+        self.check(pos)
+        self.fill(pos + len(prefix))
+        return self.window.startswith(prefix, pos - self.offset)
 
+    # End index of an anchored match of pattern at pos, or None
+    def match(self, pattern, pos: int):
+        self.check(pos)
+        lookahead = self.chunk_size
+        while True:
+            self.fill(pos + lookahead)
+            m = pattern.match(self.window, pos - self.offset)
+            if m is None:
+                return None
+            if self.eof or m.end() < len(self.window):
+                return self.offset + m.end()
+            lookahead *= 2
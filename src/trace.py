@@ -0,0 +1,69 @@
+from collections import namedtuple
+
+ENTER = 'enter'
+EXIT = 'exit'
+HIT = 'hit'
+
+TraceEvent = namedtuple('TraceEvent', ['kind', 'rule', 'pos', 'depth', 'matched', 'length'])
+
+
+# Receives rule entry/exit notifications from Rule.apply. Install one on a
+# ParseContext; with no tracer installed Rule.apply does no tracing work at all.
+class Tracer:
+
+    def enter(self, rule, buffer, pos: int, depth: int):
+        pass
+
+    def exit(self, rule, buffer, pos: int, depth: int, node):
+        pass
+
+    # A memoized result was reused instead of entering the rule
+    def hit(self, rule, buffer, pos: int, depth: int, node):
+        pass
+
+
+# Emits a TraceEvent per notification to sink, a callable. Without a sink the
+# events are collected in self.events.
+class EventTracer(Tracer):
+
+    def __init__(self, sink=None):
+        self.events = []
+        self.sink = self.events.append if sink is None else sink
+
+    def enter(self, rule, buffer, pos: int, depth: int):
+        self.sink(TraceEvent(ENTER, rule, pos, depth, None, None))
+
+    def exit(self, rule, buffer, pos: int, depth: int, node):
+        self.sink(TraceEvent(EXIT, rule, pos, depth, node.matched, node.length))
+
+    def hit(self, rule, buffer, pos: int, depth: int, node):
+        self.sink(TraceEvent(HIT, rule, pos, depth, node.matched, node.length))
+
+
+# Up to 40 characters of input at pos. A streamed buffer may have released them.
+def excerpt(buffer, pos: int):
+    try:
+        return buffer[pos:pos + 40]
+    except IndexError:
+        return '<released>'
+
+
+# Human readable trace, as printed by Rule.DEBUG. With flagged_only, only rules
+# whose debug attribute is set are printed.
+class PrintTracer(Tracer):
+
+    def __init__(self, file=None, flagged_only: bool = False):
+        self.file = file
+        self.flagged_only = flagged_only
+
+    def enter(self, rule, buffer, pos: int, depth: int):
+        if not self.flagged_only or rule.debug:
+            print(' ' * depth + f'{depth}: Start: apply {rule} at {pos} : ...[{excerpt(buffer, pos)}]...', file=self.file)
+
+    def exit(self, rule, buffer, pos: int, depth: int, node):
+        if not self.flagged_only or rule.debug:
+            print(' ' * depth + f'{depth}: End match:{node.matched} length:{node.length}: apply {rule} to {pos} : ...[{excerpt(buffer, pos)}]...', file=self.file)
+
+    def hit(self, rule, buffer, pos: int, depth: int, node):
+        if not self.flagged_only or rule.debug:
+            print(' ' * depth + f'{depth}: Memo match:{node.matched} length:{node.length}: apply {rule} at {pos}', file=self.file)
@@ -1,15 +1,20 @@
 
+# Leaves share this until their first child is added
+NO_CHILDREN = ()
+
+
 class Tree:
+    __slots__ = ('children', 'parent', 'value')
 
     def __init__(self, value=None):
-        self.children = []
+        self.children = NO_CHILDREN
         self.parent = None
         self.value = value
 
     def add(self, *args):
-        # print(args)
+        if self.children is NO_CHILDREN:
+            self.children = []
         for arg in args:
-            # print(arg)
             self.children.append(arg)
             arg.parent = self
 
@@ -18,6 +23,8 @@ class Tree:
         arg.parent = None
 
     def insert(self, node, index):
+        if self.children is NO_CHILDREN:
+            self.children = []
         self.children.insert(index, node)
         node.parent = self
 
@@ -43,25 +50,113 @@ class Tree:
         return len(self.children)
 
     def clear(self):
-        self.children = []
+        self.children = NO_CHILDREN
 
     def __str__(self):
-        return self.value
+        return str(self.value)
 
     def __repr__(self):
         return f'Tree({self.value})'
 
     def pprint_tree(self, file=None, _prefix="", _last=True):
-        print(_prefix, "`- " if _last else "|- ", self.value, sep="", file=file)
-        _prefix += "   " if _last else "|  "
-        child_count = len(self.children)
-        for i, child in enumerate(self.children):
-            _last = i == (child_count - 1)
-            child.pprint_tree(file, _prefix, _last)
+        stack = [(self, _prefix, _last)]
+        while stack:
+            node, prefix, last = stack.pop()
+            print(prefix, "`- " if last else "|- ", node.value, sep="", file=file)
+            prefix += "   " if last else "|  "
+            children = node.children
+            child_count = len(children)
+            for i in range(child_count - 1, -1, -1):
+                stack.append((children[i], prefix, i == child_count - 1))
 
     @property
     def idx(self):
         return self.parent.children.index(self)
 
 
+# Tree that keeps each node's position among its parent's children, so idx,
+# replace_child and removing the last child take constant time, and removing
+# or inserting elsewhere only renumbers the siblings after that point. Wide
+# nodes, e.g. a Star with a million children, stay linear to build and edit.
+# A node added to several parents, like a memoized ParseNode, has the index
+# of the last one; the others find it by a scan.
+class IndexedTree(Tree):
+    __slots__ = ('parent_index',)
+
+    def __init__(self, value=None):
+        Tree.__init__(self, value)
+        self.parent_index = -1
+
+    def add(self, *args):
+        if self.children is NO_CHILDREN:
+            self.children = []
+        children = self.children
+        for arg in args:
+            arg.parent_index = len(children)
+            children.append(arg)
+            arg.parent = self
+
+    def remove(self, arg):
+        i = self.index_of(arg)
+        children = self.children
+        if i == len(children) - 1:
+            children.pop()
+        else:
+            del children[i]
+            self.renumber(i)
+        arg.parent = None
+        arg.parent_index = -1
 
+    def remove_last(self):
+        node = self.children.pop()
+        node.parent = None
+        node.parent_index = -1
+        return node
+
+    def insert(self, node, index):
+        if self.children is NO_CHILDREN:
+            self.children = []
+        self.children.insert(index, node)
+        node.parent = self
+        self.renumber(index)
+
+    def replace_child(self, node, other):
+        i = self.index_of(node)
+        self.children[i] = other
+        other.parent = self
+        other.parent_index = i
+        node.parent = None
+        node.parent_index = -1
+
+    def index_of(self, node):
+        i = node.parent_index
+        children = self.children
+        if 0 <= i < len(children) and children[i] is node:
+            return i
+        return children.index(node)
+
+    def renumber(self, start: int):
+        children = self.children
+        for i in range(max(0, start), len(children)):
+            children[i].parent_index = i
+
+    @property
+    def idx(self):
+        return self.parent_index
+
+    # Builds a forest in one pass from parallel arrays: node i is
+    # cls(*(column[i] for column in columns)) and becomes the last child of
+    # node parents[i], which must come before it, or a root if that is -1.
+    # Returns the nodes; node 0 is the root of a preorder array.
+    @classmethod
+    def from_arrays(cls, parents, *columns):
+        nodes = [cls(*args) for args in zip(*columns)] if columns else [cls() for _ in parents]
+        for node, p in zip(nodes, parents):
+            if p >= 0:
+                parent = nodes[p]
+                if parent.children is NO_CHILDREN:
+                    parent.children = []
+                node.parent = parent
+                node.parent_index = len(parent.children)
+                parent.children.append(node)
+        return nodes
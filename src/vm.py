@@ -0,0 +1,242 @@
+from array import array
+
+from src.rules import Alt, Seq, Opt, Star, Lit, Reg, Eps, Eof, ParseNode, InvalidRegexDefinitionError, resolve
+
+LIT = 0
+REG = 1
+SEQ = 2
+ALT = 3
+OPT = 4
+STAR = 5
+EPS = 6
+EOF = 7
+# Any other terminal rule, matched through its own apply_internal
+TERM = 8
+
+OPCODES = {Lit: LIT, Reg: REG, Seq: SEQ, Alt: ALT, Opt: OPT, Star: STAR, Eps: EPS, Eof: EOF}
+
+
+class GrammarCompileError(Exception):
+    def __init__(self, msg):
+        Exception.__init__(self, msg)
+
+
+def opcode(rule):
+    for cls in type(rule).__mro__:
+        code = OPCODES.get(cls)
+        if code is not None:
+            return code
+    if rule.subrules:
+        raise GrammarCompileError(f'No opcode for rule class {type(rule).__name__}')
+    return TERM
+
+
+# A rule set lowered to flat instruction arrays. Instruction i belongs to
+# rules[i]: op[i] is its opcode, arg[i] indexes consts (literal, compiled
+# pattern, terminal rule or an Alt's LiteralTable) and subs[lo[i]:hi[i]] are
+# its subrule instructions.
+# A Program is immutable once compiled and can run any number of parses.
+class Program:
+
+    def __init__(self, rule):
+        self.rules = []
+        self.op = array('b')
+        self.arg = array('i')
+        self.lo = array('i')
+        self.hi = array('i')
+        self.subs = array('i')
+        self.consts = []
+        self.start = self.compile(rule)
+
+    def compile(self, rule):
+        index = {}
+        order = [resolve(rule)]
+        index[id(order[0])] = 0
+        i = 0
+        while i < len(order):
+            r = order[i]
+            for sub in r.subrules:
+                sub = resolve(sub)
+                if id(sub) not in index:
+                    index[id(sub)] = len(order)
+                    order.append(sub)
+            i += 1
+        for r in order:
+            if r.is_left_recursive:
+                raise GrammarCompileError(f'Rule {r} is left recursive, use llrules.Parser')
+            code = opcode(r)
+            self.rules.append(r)
+            self.op.append(code)
+            if code == LIT:
+                self.arg.append(len(self.consts))
+                self.consts.append(r.literal)
+            elif code == REG:
+                self.arg.append(len(self.consts))
+                self.consts.append(r.pattern)
+            elif code == TERM or (code == ALT and r.literals is not None):
+                self.arg.append(len(self.consts))
+                self.consts.append(r.literals if code == ALT else r)
+            else:
+                self.arg.append(-1)
+            self.lo.append(len(self.subs))
+            subrules = [r.rule] if code == STAR else r.subrules
+            for sub in subrules:
+                self.subs.append(index[id(resolve(sub))])
+            self.hi.append(len(self.subs))
+        return 0
+
+    def __len__(self):
+        return len(self.op)
+
+    # Runs the program at pos. Returns the root ParseNode; failed attempts are
+    # not kept in the tree. With build_tree False, only the root node is built.
+    def run(self, buffer, pos: int = 0, build_tree: bool = True):
+        op = self.op
+        arg = self.arg
+        lo = self.lo
+        hi = self.hi
+        subs = self.subs
+        consts = self.consts
+        rules = self.rules
+        is_str = buffer.__class__ is str
+        scratch = ParseNode(None, 0)
+        # Frames are [instruction, start, next subrule, current pos, node]
+        stack = []
+        r = self.start
+        p = pos
+        calling = True
+        matched = False
+        length = 0
+        cnode = None
+        while True:
+            if calling:
+                o = op[r]
+                if o == LIT:
+                    lit = consts[arg[r]]
+                    matched = buffer.startswith(lit, p)
+                    length = len(lit) if matched else 0
+                elif o == REG:
+                    if is_str:
+                        m = consts[arg[r]].match(buffer, p)
+                        matched = m is not None
+                        length = m.end() - p if matched else 0
+                    else:
+                        e = buffer.match(consts[arg[r]], p)
+                        matched = e is not None
+                        length = e - p if matched else 0
+                    if matched and length == 0:
+                        raise InvalidRegexDefinitionError(f'Regex {rules[r].reg} matches null string at {p}')
+                elif o == EPS:
+                    matched = True
+                    length = 0
+                elif o == EOF:
+                    matched = not buffer[p:p + 1]
+                    length = 0
+                elif o == TERM:
+                    scratch.matched = False
+                    scratch.length = 0
+                    consts[arg[r]].apply_internal(buffer, len(stack), p, scratch)
+                    matched = scratch.matched
+                    length = scratch.length
+                else:
+                    k = lo[r]
+                    if o == ALT and arg[r] >= 0 and is_str:
+                        # Start at the literal that matches; if none does, start past the end
+                        i = consts[arg[r]].match(buffer, p)
+                        k = k + i if i >= 0 else hi[r]
+                    node = ParseNode(rules[r], p) if build_tree or not stack else None
+                    if k == hi[r]:
+                        # An empty Seq or Alt fails, as in Rule.apply
+                        matched = False
+                        length = 0
+                        cnode = node
+                        if node is not None:
+                            node.matched = matched
+                        calling = False
+                        continue
+                    stack.append([r, p, k, p, node])
+                    r = subs[k]
+                    continue
+                if build_tree and matched:
+                    cnode = ParseNode(rules[r], p, True, length)
+                else:
+                    cnode = None
+                    if not stack:
+                        cnode = ParseNode(rules[r], p, matched, length)
+                calling = False
+                continue
+
+            # Returning (matched, length, cnode) to the frame on top of the stack
+            if not stack:
+                return cnode
+            frame = stack[-1]
+            fr = frame[0]
+            o = op[fr]
+            done = False
+            if o == SEQ:
+                if matched:
+                    frame[3] += length
+                    if cnode is not None:
+                        frame[4].add(cnode)
+                    k = frame[2] + 1
+                    if k == hi[fr]:
+                        done = True
+                        length = frame[3] - frame[1]
+                    else:
+                        frame[2] = k
+                        r = subs[k]
+                        p = frame[3]
+                        calling = True
+                        continue
+                else:
+                    done = True
+                    if frame[4] is not None:
+                        frame[4].clear()
+            elif o == ALT:
+                if matched:
+                    done = True
+                    if cnode is not None:
+                        frame[4].add(cnode)
+                else:
+                    k = frame[2] + 1
+                    if k == hi[fr]:
+                        done = True
+                    else:
+                        frame[2] = k
+                        r = subs[k]
+                        p = frame[1]
+                        calling = True
+                        continue
+            elif o == STAR:
+                if matched and length > 0:
+                    frame[3] += length
+                    if cnode is not None:
+                        frame[4].add(cnode)
+                    r = subs[frame[2]]
+                    p = frame[3]
+                    calling = True
+                    continue
+                done = True
+                matched = True
+                length = frame[3] - frame[1]
+            else:
+                # OPT
+                done = True
+                if matched:
+                    if cnode is not None:
+                        frame[4].add(cnode)
+                else:
+                    matched = True
+                    length = 0
+            if done:
+                stack.pop()
+                cnode = frame[4]
+                if cnode is not None:
+                    cnode.matched = matched
+                    cnode.length = length if matched else 0
+                    if not build_tree and stack:
+                        cnode = None
+
+
+def compile_rule(rule):
+    return Program(rule)
@@ -0,0 +1,73 @@
+import time
+import unittest
+
+from src.analysis import reachable, compute_nullables, compute_left_recursives, strongly_connected_components, left_calls
+from src.grammar import Grammar
+from src.rules import lit, eps, star, seqn, alt, lazy, Opt
+
+
+class TestAnalysisMethods(unittest.TestCase):
+
+    def test_reachable(self):
+        rec = lazy()
+        a = lit('a')
+        r = alt("R", seqn("Ra", rec, a), a)
+        rec.set_rule(r)
+        self.assertEqual(['R', 'Ra', 'a'], [str(x) for x in reachable([r])])
+
+    def test_nullables(self):
+        e = eps()
+        s = seqn("S", Opt(lit('a')), star("Bs", lit('b')))
+        t = seqn("T", s, lit('c'))
+        u = alt("U", t, s)
+        empty = seqn("Empty")
+        rules = reachable([u, empty])
+        compute_nullables(rules)
+        self.assertTrue(s.is_nullable)
+        self.assertFalse(t.is_nullable)
+        self.assertTrue(u.is_nullable)
+        self.assertFalse(empty.is_nullable)
+        self.assertTrue(e.is_nullable)
+
+    # A -> B x | y, B -> C z | A w, C -> C c | d, D -> e A (not left recursive)
+    def test_sccs(self):
+        arec = lazy()
+        crec = lazy()
+        c = alt("C", seqn("Cc", crec, lit('c')), lit('d'))
+        crec.set_rule(c)
+        b = alt("B", seqn("Cz", c, lit('z')), seqn("Aw", arec, lit('w')))
+        a = alt("A", seqn("Bx", b, lit('x')), lit('y'))
+        arec.set_rule(a)
+        d = seqn("D", lit('e'), a)
+        g = Grammar()
+        g.add(d)
+        g.set_nullables()
+        g.set_left_recursives()
+        self.assertEqual(2, len(g.left_rec_sccs))
+        self.assertEqual({'A', 'Bx', 'B', 'Aw'}, {str(r) for r in g.left_rec_scc(a)})
+        self.assertIs(g.left_rec_scc(a), g.left_rec_scc(b))
+        self.assertEqual({'C', 'Cc'}, {str(r) for r in g.left_rec_scc(c)})
+        self.assertIsNone(g.left_rec_scc(d))
+        self.assertFalse(d.is_left_recursive)
+        self.assertTrue(c.is_left_recursive)
+
+    def test_self_loop(self):
+        rec = lazy()
+        r = Opt(rec)
+        rec.set_rule(r)
+        rules = reachable([r])
+        self.assertEqual([[r]], compute_left_recursives(rules))
+        self.assertEqual([[r]], strongly_connected_components(rules, left_calls))
+
+    # A chain of a few thousand rules, each left recursive through the next
+    def test_large_grammar(self):
+        n = 3000
+        recs = [lazy() for _ in range(n)]
+        rules = [alt(f"R{i}", seqn(f"S{i}", recs[i], lit('x')), lit('y')) for i in range(n)]
+        for i in range(n):
+            recs[i].set_rule(rules[(i + 1) % n])
+        start = time.time()
+        found = compute_left_recursives(reachable(rules))
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(1, len(found))
+        self.assertEqual(2 * n, len(found[0]))
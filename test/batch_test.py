@@ -0,0 +1,64 @@
+import itertools
+import unittest
+
+from src.batch import parse_many
+from src.grammar import Grammar
+from src.rules import lit, reg, seqn, star, eof, recover, ParseContext
+
+from helpers import shape, line_grammar
+
+
+class TestBatchMethods(unittest.TestCase):
+
+    def lines(self, n):
+        return [f'get {i}+{i}+1 ok' if i % 5 else f'bad {i}+' for i in range(n)]
+
+    def test_serial(self):
+        g, line = line_grammar()
+        lines = self.lines(50)
+        trees = list(g.parse_many(line, iter(lines)))
+        self.assertEqual([shape(g.parse(line, s)) for s in lines], [shape(t) for t in trees])
+        self.assertEqual([i % 5 != 0 for i in range(50)], [t.matched for t in trees])
+        memo_trees = g.parse_many(line, lines, memo=True)
+        self.assertEqual([shape(t) for t in trees], [shape(t) for t in memo_trees])
+
+    def test_lazy(self):
+        g, line = line_grammar()
+        lines = itertools.count()
+        trees = g.parse_many(line, (f'{i}+1' for i in lines), workers=2)
+        first = list(itertools.islice(trees, 3))
+        self.assertEqual([3, 3, 3], [t.length for t in first])
+        trees.close()
+
+    def test_pools(self):
+        g, line = line_grammar()
+        lines = self.lines(300)
+        expected = [shape(g.parse(line, s)) for s in lines]
+        for processes in [False, True]:
+            trees = list(parse_many(g, line, lines, workers=2, processes=processes, chunk_size=64))
+            self.assertEqual(expected, [shape(t) for t in trees])
+            # Rules come back as the caller's objects
+            self.assertIs(line, trees[1].rule)
+            self.assertIs(trees[1], trees[1].children[0].parent)
+
+    # Each input starts from a fresh parse state and gets its own errors
+    def test_errors(self):
+        num = reg('[0-9]+')
+        pair = recover("Field", seqn("Pair", num, lit(':'), num, lit(';')), lit(';'))
+        doc = seqn("Doc", lit('#'), star("Pairs", pair), eof())
+        g = Grammar()
+        g.add(doc)
+        lines = ['#1:x;2:3;', '7:8;', '#4:5;', '#6:;']
+        expected = [[(3, 1, 5)], [], [], [(3, 1, 4)]]
+        for workers, processes in [(1, False), (2, False), (2, True)]:
+            results = list(parse_many(g, doc, lines * 300, memo=True, workers=workers, processes=processes,
+                                      errors=True))
+            self.assertEqual([True, False, True, True] * 300, [t.matched for t, _ in results])
+            self.assertEqual(expected * 300, [[(e.pos, e.start, e.end) for e in found] for _, found in results])
+            self.assertEqual([num], list(results[0][1][0].expected))
+        ctx = ParseContext()
+        g.parse(doc, '#1:x', 0, ctx)
+        ctx.reset()
+        g.parse(doc, '#', 0, ctx)
+        self.assertEqual(1, ctx.failure().pos)
+        self.assertEqual([], ctx.errors)
@@ -0,0 +1,103 @@
+import marshal
+import os
+import struct
+import tempfile
+import unittest
+
+from src import cache
+from src.cache import save, load, load_or_build, fingerprint, MAGIC
+from src.grammar import Grammar
+from src.rules import lit, seqn, star, eof, Alt, Reg
+
+from helpers import shape, expression_grammar
+
+
+PASSES = ('set_firsts', 'set_dispatch_tables', 'set_literal_tables', 'set_left_recursives')
+
+
+class TestCacheMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'grammar.cache')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_round_trip(self):
+        prog = expression_grammar()
+        g = Grammar()
+        g.add(prog)
+        for name in PASSES:
+            getattr(g, name)()
+        save(g, self.path, 'k')
+        loaded = load(self.path, 'k')
+        self.assertEqual(sorted(g.rules), sorted(loaded.rules))
+        for old, new in zip(g.all_rules(), loaded.all_rules()):
+            self.assertIsNot(old, new)
+            self.assertIs(old.__class__, new.__class__)
+            self.assertEqual((old.name, old.is_nullable, old.is_left_recursive, old.first),
+                             (new.name, new.is_nullable, new.is_left_recursive, new.first))
+        expr = loaded.rules['Expr']
+        self.assertIs(expr, loaded.rules['Binary'].subrules[0])
+        self.assertEqual([loaded.rules['Binary'], loaded.rules['Expr']],
+                         sorted(loaded.left_rec_scc(expr), key=str))
+        self.assertIsNotNone(loaded.rules['Op'].literals)
+        self.assertIsNotNone(loaded.rules['Stmts'].guard)
+        for text in ['1;2+3*4;!', '1+;', '']:
+            self.assertEqual(shape(prog.apply(text, 0, 0)), shape(loaded.rules['Prog'].apply(text, 0, 0)))
+
+    def test_stale(self):
+        g = Grammar()
+        g.add(expression_grammar())
+        self.assertIsNone(load(self.path, 'k'))
+        save(g, self.path, 'k')
+        self.assertIsNone(load(self.path, 'other'))
+        with open(self.path, 'r+b') as f:
+            f.write(b'X' * len(MAGIC))
+        self.assertIsNone(load(self.path, 'k'))
+
+    # Undecodable tables, e.g. from another version of this code, are misses
+    def test_corrupt(self):
+        g = Grammar()
+        g.add(expression_grammar())
+        save(g, self.path, 'k')
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        header = data[:len(MAGIC) + 4 + struct.unpack('<I', data[len(MAGIC):len(MAGIC) + 4])[0]]
+        for entries in [(('src.rules:Seq', (('subrules', ('l', (('r', 99),))),)),),
+                        (('src.rules:Seq', (('pattern', ('p', '(', 0)),)),),
+                        (('src.rules:Seq', (('literals', ('o', 'os:stat', ('d', ()))),)),),
+                        (('os:stat', ()),)]:
+            with open(self.path, 'wb') as f:
+                f.write(header + marshal.dumps((entries, ('d', ()))))
+            self.assertIsNone(load(self.path, 'k'))
+        save(g, self.path, 'k')
+        saved = cache.CODE_STAMP
+        try:
+            cache.CODE_STAMP = 'changed rule classes'
+            self.assertIsNone(load(self.path, 'k'))
+        finally:
+            cache.CODE_STAMP = saved
+        self.assertIsNotNone(load(self.path, 'k'))
+
+    def test_fingerprint(self):
+        key = fingerprint(expression_grammar())
+        self.assertEqual(key, fingerprint(expression_grammar()))
+        g = Grammar()
+        prog = expression_grammar()
+        g.add(prog)
+        g.set_firsts()
+        self.assertEqual(key, fingerprint(prog))
+        self.assertNotEqual(key, fingerprint(expression_grammar(), passes=PASSES))
+        self.assertNotEqual(key, fingerprint(seqn("Prog", star("Stmts", lit('1;')), eof())))
+
+    def test_load_or_build(self):
+        g = load_or_build(self.path, [expression_grammar()], PASSES)
+        self.assertTrue(g.rules['Expr'].is_left_recursive)
+        mtime = os.stat(self.path).st_mtime_ns
+        loaded = load_or_build(self.path, [expression_grammar()], PASSES)
+        self.assertEqual(mtime, os.stat(self.path).st_mtime_ns)
+        self.assertTrue(loaded.parse(loaded.rules['Prog'], '1;2-3;').matched)
+        self.assertIsInstance(loaded.rules['Op'], Alt)
+        self.assertIsInstance(loaded.rules['Stmt'].subrules[0].subrules[1], Reg)
@@ -0,0 +1,120 @@
+import unittest
+
+from src.grammar import Grammar
+from src.rules import lit, reg, seqn, alt, star, lazy, eps, eof, Opt
+
+
+def show(node):
+    if not node.children:
+        return str(node.rule)
+    return '(' + ' '.join(show(c) for c in node.children) + ')'
+
+
+def matched_tree(node):
+    children = [c for c in node.children if c.matched]
+    if not children:
+        return str(node.rule)
+    return '(' + ' '.join(matched_tree(c) for c in children) + ')'
+
+
+class TestEarleyMethods(unittest.TestCase):
+
+    # Inputs an ordered choice or a greedy Star rejects
+    def test_not_peg(self):
+        a_ab = seqn("S", alt("A", lit('a'), lit('ab')), lit('c'))
+        g = Grammar()
+        g.add(a_ab)
+        self.assertFalse(a_ab.apply('abc', 0, 0).matched)
+        tree = g.parse_earley(a_ab, 'abc')
+        self.assertTrue(tree.matched)
+        self.assertEqual(3, tree.length)
+        self.assertEqual('((ab) c)', show(tree))
+        greedy = seqn("T", star("As", lit('a')), lit('a'))
+        g.add(greedy)
+        self.assertFalse(greedy.apply('aaa', 0, 0).matched)
+        tree = g.parse_earley(greedy, 'aaa')
+        self.assertEqual('((a a) a)', show(tree))
+
+    def test_ambiguous(self):
+        rec = lazy()
+        e = alt("E", seqn("Add", rec, lit('+'), rec), lit('n'))
+        rec.set_rule(e)
+        g = Grammar()
+        g.add(e)
+        tree = g.parse_earley(e, 'n+n+n')
+        self.assertTrue(tree.matched)
+        self.assertEqual(5, tree.length)
+        self.assertIn(show(tree), {'(((n) + (((n) + (n)))))', '(((((n) + (n))) + (n)))'})
+        self.assertFalse(g.parse_earley(e, 'n+', 0, 2).matched)
+
+    def test_left_recursion(self):
+        rec = lazy()
+        e = alt("L", seqn("La", rec, lit('a')), lit('b'))
+        rec.set_rule(e)
+        g = Grammar()
+        g.add(e)
+        tree = g.parse_earley(e, 'baaa')
+        self.assertEqual('(((((((b) a)) a)) a))', show(tree))
+        tree = g.parse_earley(e, 'b' + 'a' * 5000)
+        self.assertEqual(5001, tree.length)
+
+    # A -> B 'x' | 'y', B -> A 'w' | 'z'
+    def test_indirect_left_recursion(self):
+        arec = lazy()
+        b = alt("B", seqn("Aw", arec, lit('w')), lit('z'))
+        a = alt("A", seqn("Bx", b, lit('x')), lit('y'))
+        arec.set_rule(a)
+        g = Grammar()
+        g.add(a)
+        for text in ['y', 'zx', 'ywx', 'zxwx', 'ywxwx']:
+            tree = g.parse_earley(a, text, 0, len(text))
+            self.assertTrue(tree.matched)
+            self.assertEqual(len(text), tree.length)
+        self.assertFalse(g.parse_earley(a, 'ywxw', 0, 4).matched)
+        self.assertEqual(3, g.parse_earley(a, 'ywxw').length)
+
+    # Right recursion and Star stay linear thanks to Leo's optimization
+    def test_long_input(self):
+        rec = lazy()
+        r = alt("R", seqn("aR", lit('a'), rec), eps())
+        rec.set_rule(r)
+        items = star("Items", seqn("Item", reg('[0-9]+'), lit(',')))
+        g = Grammar()
+        g.add(r, items)
+        self.assertEqual(20000, g.parse_earley(r, 'a' * 20000).length)
+        tree = g.parse_earley(items, '12,' * 10000)
+        self.assertEqual(30000, tree.length)
+        self.assertEqual(10000, tree.child_count())
+
+    def test_nullable(self):
+        s = seqn("S", lit('a'), Opt(lit('x')), star("Bs", lit('b')), eps(), lit('c'), eof())
+        g = Grammar()
+        g.add(s)
+        for text in ['ac', 'axc', 'abbc', 'axbc']:
+            tree = g.parse_earley(s, text)
+            self.assertTrue(tree.matched)
+            self.assertEqual(len(text), tree.length)
+        self.assertFalse(g.parse_earley(s, 'axxc').matched)
+        self.assertFalse(g.parse_earley(s, 'ac', 0, 1).matched)
+
+    def test_end(self):
+        s = star("S", lit('ab'))
+        g = Grammar()
+        g.add(s)
+        self.assertEqual(4, g.parse_earley(s, 'ababa').length)
+        self.assertEqual(2, g.parse_earley(s, 'ababa', 0, 2).length)
+        self.assertFalse(g.parse_earley(s, 'ababa', 0, 3).matched)
+        self.assertEqual(2, g.parse_earley(s, 'xxab', 2).length)
+
+    # Unambiguous inputs get the tree Rule.apply builds, less failed attempts
+    def test_same_tree(self):
+        num = reg('[0-9]+')
+        item = alt("Item", seqn("Pair", num, lit(':'), num), seqn("Single", num))
+        items = seqn("Items", item, star("More", seqn("Comma", lit(','), item)), Opt(lit(';')))
+        g = Grammar()
+        g.add(items)
+        for text in ['1:2,3,45:6;', '7', '8,9']:
+            expected = items.apply(text, 0, 0)
+            tree = g.parse_earley(items, text)
+            self.assertEqual(expected.length, tree.length)
+            self.assertEqual(matched_tree(expected), matched_tree(tree))
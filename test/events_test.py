@@ -0,0 +1,88 @@
+import io
+import itertools
+import unittest
+
+from src.events import iter_events, parse_events, tree_events, Handler, START, END, FAIL
+from src.grammar import Grammar
+from src.rules import lit, seqn, alt, star, lazy
+from src.sbuffer import SBuffer
+
+from helpers import items_grammar
+
+
+class Collector(Handler):
+
+    def __init__(self):
+        self.calls = []
+
+    def start(self, rule, start: int):
+        self.calls.append(('start', str(rule), start))
+
+    def end(self, rule, start: int, end: int):
+        self.calls.append(('end', str(rule), start, end))
+
+    def fail(self, rule, start: int):
+        self.calls.append(('fail', str(rule), start))
+
+
+class TestEventsMethods(unittest.TestCase):
+
+    # The events of a successful parse walk the matched nodes of Rule.apply's tree
+    def test_same_as_tree(self):
+        items = items_grammar()
+        g = Grammar()
+        g.add(items)
+        for setup in [None, g.set_dispatch_tables]:
+            if setup is not None:
+                g.set_firsts()
+                setup()
+            for text in ['1', '1:2,x,3', '1:2,x;', '7,8:9,10']:
+                expected = list(tree_events(items.apply(text, 0, 0)))
+                self.assertEqual(expected, list(iter_events(items, text)))
+
+    def test_fail(self):
+        items = items_grammar()
+        events = list(iter_events(items, '1:2,'))
+        self.assertEqual(FAIL, events[-1].kind)
+        self.assertIs(items, events[-1].rule)
+        self.assertEqual(1, sum(1 for e in events if e.kind == FAIL))
+        # The failed ',' attempt of the Star was taken back
+        self.assertFalse(any(e.kind == START and str(e.rule) == 'Comma' for e in events))
+
+    def test_handler(self):
+        r = seqn("S", alt("AB", lit('a'), lit('b')), lit('c'))
+        handler = Collector()
+        self.assertTrue(parse_events(r, 'bc', handler))
+        self.assertEqual([('start', 'S', 0), ('start', 'AB', 0), ('start', 'b', 0), ('end', 'b', 0, 1),
+                          ('end', 'AB', 0, 1), ('start', 'c', 1), ('end', 'c', 1, 2), ('end', 'S', 0, 2)],
+                         handler.calls)
+        handler = Collector()
+        self.assertFalse(parse_events(r, 'bd', handler))
+        self.assertEqual(('fail', 'S', 0), handler.calls[-1])
+
+    def test_left_recursion(self):
+        rec = lazy()
+        r = alt("R", seqn("Ra", rec, lit('a')), lit('b'))
+        rec.set_rule(r)
+        top = seqn("Top", r, lit(';'))
+        g = Grammar()
+        g.add(top)
+        g.set_nullables()
+        g.set_left_recursives()
+        events = list(iter_events(top, 'baaa;'))
+        self.assertEqual(END, events[-1].kind)
+        self.assertEqual((0, 5), (events[-1].start, events[-1].end))
+        self.assertEqual(4, sum(1 for e in events if e.kind == END and str(e.rule) == 'R'))
+
+    # A top level Star yields each record once it ends, before reading further
+    def test_streaming(self):
+        text = 'ab;' * 10000
+        buf = SBuffer(io.StringIO(text), chunk_size=16)
+        rows = star("Rows", seqn("Row", alt("AB", lit('ab'), lit('ba')), lit(';')))
+        events = iter_events(rows, buf)
+        first = list(itertools.islice(events, 20))
+        self.assertEqual(START, first[0].kind)
+        self.assertTrue(len(buf.window) + buf.offset < 100)
+        count = sum(1 for e in events if e.kind == END and str(e.rule) == 'Row')
+        self.assertEqual(10000, count + sum(1 for e in first if e.kind == END and str(e.rule) == 'Row'))
+        self.assertTrue(len(buf.window) < 64)
@@ -0,0 +1,46 @@
+import io
+import unittest
+
+from src.flattree import FlatTree
+from src.rules import lit, seqn, alt, star, ParseNode
+
+
+class TestFlatTreeMethods(unittest.TestCase):
+
+    def test_from_node(self):
+        r = seqn("S", star("As", lit('a')), alt("BC", lit('b'), lit('c')))
+        pn = r.apply("aac", 0, 0)
+        tree = FlatTree.from_node(pn)
+        root = tree.root
+        self.assertEqual(r, root.rule)
+        self.assertEqual(3, root.length)
+        self.assertTrue(root.is_root())
+        self.assertEqual(2, root.child_count())
+        stars, bc = root.children
+        self.assertEqual(2, stars.child_count())
+        self.assertEqual(1, stars.children[1].start)
+        self.assertEqual(root, bc.parent)
+        self.assertEqual(1, bc.idx)
+        # Failed attempts are dropped: only the matching alternative is kept
+        self.assertEqual(['c'], [str(c) for c in bc.children])
+        self.assertEqual(6, len(tree))
+
+    def test_keep_unmatched(self):
+        r = alt("BC", lit('b'), lit('c'))
+        tree = FlatTree.from_node(r.apply("c", 0, 0), matched_only=False)
+        self.assertEqual(3, len(tree))
+        self.assertEqual([False, True], [c.matched for c in tree.root.children])
+        self.assertTrue(tree.root.matched)
+
+    def test_pprint(self):
+        r = seqn("S", lit('a'), lit('b'))
+        out = io.StringIO()
+        FlatTree.from_node(r.apply("ab", 0, 0)).root.pprint_tree(out)
+        expected = io.StringIO()
+        r.apply("ab", 0, 0).pprint_tree(expected)
+        self.assertEqual(expected.getvalue(), out.getvalue())
+
+    def test_slots(self):
+        pn = ParseNode(lit('a'), 0)
+        with self.assertRaises(AttributeError):
+            pn.alt_type = None
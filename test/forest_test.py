@@ -0,0 +1,104 @@
+import math
+import unittest
+
+from src.grammar import Grammar
+from src.forest import IntermediateNode
+from src.rules import lit, reg, seqn, alt, star, lazy, Opt
+
+
+def show(node):
+    if not node.children:
+        return str(node.rule)
+    return '(' + ' '.join(show(c) for c in node.children) + ')'
+
+
+class TestForestMethods(unittest.TestCase):
+
+    # E -> E '+' E | 'n' has Catalan(k - 1) parses of k terms
+    def test_ambiguous(self):
+        rec = lazy()
+        e = alt("E", seqn("Add", rec, lit('+'), rec), lit('n'))
+        rec.set_rule(e)
+        g = Grammar()
+        g.add(e)
+        catalan = [1, 1, 2, 5, 14, 42, 132]
+        for k in range(1, 8):
+            root = g.parse_all(e, '+'.join(['n'] * k))
+            self.assertEqual(catalan[k - 1], root.count())
+            self.assertEqual(catalan[k - 1], len(list(root.trees())))
+        root = g.parse_all(e, 'n+n+n')
+        self.assertEqual({'(((n) + (((n) + (n)))))', '(((((n) + (n))) + (n)))'}, {show(t) for t in root.trees()})
+        self.assertFalse(root.is_ambiguous())
+        self.assertTrue(any(n.is_ambiguous() for n in root.nodes()))
+        # Shared: 40 terms have about 10^21 parses but a small forest
+        root = g.parse_all(e, '+'.join(['n'] * 40))
+        self.assertTrue(root.count() > 10 ** 20)
+        self.assertTrue(sum(1 for _ in root.nodes()) < 10000)
+        self.assertTrue(any(isinstance(n, IntermediateNode) for n in root.nodes()))
+        self.assertIsNone(g.parse_all(e, 'n+'))
+
+    def test_unambiguous(self):
+        num = reg('[0-9]+')
+        item = alt("Item", seqn("Pair", num, lit(':'), num), num)
+        items = seqn("Items", item, star("More", seqn("Comma", lit(','), item)), Opt(lit(';')))
+        g = Grammar()
+        g.add(items)
+        text = '1:2,3,45:6;'
+        root = g.parse_all(items, text)
+        self.assertEqual(1, root.count())
+        tree = next(root.trees())
+        self.assertEqual(len(text), tree.length)
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            self.assertTrue(node.matched)
+            self.assertEqual(node.length, sum(c.length for c in node.children) if node.children else node.length)
+            stack.extend(node.children)
+        self.assertEqual(3, len(tree.children))
+        self.assertEqual(2, tree.children[1].child_count())
+        # Parses of a prefix
+        self.assertEqual(1, g.parse_all(items, text, 0, 3).count())
+
+    def test_star(self):
+        s = star("S", alt("X", lit('a'), lit('aa')))
+        g = Grammar()
+        g.add(s)
+        root = g.parse_all(s, 'aaaa')
+        self.assertEqual(5, root.count())
+        self.assertIn('((a) (aa) (a))', [show(t) for t in root.trees()])
+        root = g.parse_all(s, 'a' * 2000)
+        self.assertEqual(2000, len(next(root.trees()).children))
+
+    # R -> 'a' R | 'a' nested far deeper than the recursion limit
+    def test_deep(self):
+        rec = lazy()
+        r = alt("R", seqn("aR", lit('a'), rec), lit('a'))
+        rec.set_rule(r)
+        g = Grammar()
+        g.add(r)
+        root = g.parse_all(r, 'a' * 5000)
+        self.assertEqual(1, root.count())
+        self.assertEqual(5000, next(root.trees()).length)
+
+    # A -> A | 'a' has infinitely many derivations; trees() skips cyclic ones
+    def test_cycle(self):
+        rec = lazy()
+        a = alt("A", rec, lit('a'))
+        rec.set_rule(a)
+        g = Grammar()
+        g.add(a)
+        root = g.parse_all(a, 'a')
+        self.assertEqual(math.inf, root.count())
+        self.assertEqual(['(a)'], [show(t) for t in root.trees()])
+
+    # A -> B 'x' | 'y', B -> A 'w' | 'z'
+    def test_indirect_left_recursion(self):
+        arec = lazy()
+        b = alt("B", seqn("Aw", arec, lit('w')), lit('z'))
+        a = alt("A", seqn("Bx", b, lit('x')), lit('y'))
+        arec.set_rule(a)
+        g = Grammar()
+        g.add(a)
+        for text in ['y', 'zx', 'ywx', 'zxwx', 'ywxwx']:
+            self.assertEqual(1, g.parse_all(a, text).count())
+        self.assertIsNone(g.parse_all(a, 'ywxw'))
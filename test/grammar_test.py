@@ -1,7 +1,8 @@
 import unittest
 
 from src.grammar import Grammar
-from src.rules import lit, eps, eof, plus, star, reg, seqn, alt, InvalidRegexDefinitionError, lazy, Rule
+from src.charclass import END
+from src.rules import lit, eps, eof, plus, star, reg, seqn, alt, InvalidRegexDefinitionError, lazy, Rule, Opt
 
 
 class TestGrammarMethods(unittest.TestCase):
@@ -27,3 +28,159 @@ class TestGrammarMethods(unittest.TestCase):
         g.set_left_recursives()
         for r in g.rules.values():
             print(r, r.is_left_recursive)
+
+    def test_firsts(self):
+        g = Grammar()
+        num = reg('[0-9]+')
+        ident = reg('[a-c_][a-z]*')
+        sign = alt("Sign", lit('+'), lit('-'), eps())
+        r = seqn("Num", sign, num)
+        top = alt("Top", r, ident, seqn("End", eof()))
+        g.add(top)
+        g.set_firsts()
+        self.assertEqual(frozenset('0123456789'), num.first)
+        self.assertEqual(frozenset('abc_'), ident.first)
+        self.assertTrue(sign.is_nullable)
+        self.assertEqual(frozenset('+-0123456789'), r.first)
+        self.assertEqual(frozenset('+-0123456789abc_') | {END}, top.first)
+        self.assertIsNone(reg('\\w+').first_chars())
+        self.assertIsNone(reg('(?i)a').first_chars())
+        self.assertEqual(frozenset('ab'), reg('(?:a|b)?[ab]').first_chars())
+        self.assertEqual(frozenset('x'), reg('\\bx').first_chars())
+
+    def test_dispatch(self):
+        words = ["if", "in", "else", "while", "x", "for"]
+        kw = alt("Kw", *[lit(w) for w in words], reg('[a-z]+'))
+        stmt = seqn("Stmt", kw, alt("Term", lit(';'), eof()))
+        top = star("Top", stmt)
+        g = Grammar()
+        g.add(top)
+        g.set_firsts()
+        g.set_dispatch_tables()
+        self.assertEqual(['in', 'Reg'], [str(c) for c in kw.dispatch['i'][1:]])
+        self.assertEqual(frozenset('abcdefghijklmnopqrstuvwxyz'), top.guard)
+        text = "if;x;while;fox;zz;in"
+        pn = top.apply(text, 0, 0)
+        self.assertEqual(len(text), pn.length)
+        self.assertEqual(['if', 'x', 'while', 'Reg', 'Reg', 'in'], [str(s.children[0].children[-1]) for s in pn.children])
+        self.assertEqual(1, pn.children[0].children[0].child_count())
+        pn = top.apply("if;9", 0, 0)
+        self.assertEqual(3, pn.length)
+
+    # An empty Seq always fails, so it is neither nullable nor dispatched to
+    def test_dispatch_empty_seq(self):
+        empty = seqn("Empty")
+        after = seqn("After", empty, lit('a'))
+        top = alt("Top", empty, after, lit('b'), seqn("Bc", Opt(empty), lit('c')))
+        items = star("Items", alt("Item", empty, top))
+        g = Grammar()
+        g.add(items)
+        g.set_firsts()
+        g.set_dispatch_tables()
+        self.assertFalse(empty.is_nullable)
+        self.assertEqual(frozenset(), after.first)
+        self.assertEqual({'b', 'c'}, set(top.dispatch))
+        self.assertEqual((), top.dispatch_default)
+        self.assertEqual(frozenset('bc'), items.guard)
+        for text, length in [("bcb", 3), ("a", 0), ("cba", 2)]:
+            self.assertEqual(length, items.apply(text, 0, 0).length)
+            self.assertEqual(length, g.parse(items, text).length)
+
+    def test_literal_tables(self):
+        words = [f'kw{i:03}' for i in range(300)] + ['a', 'ab', 'b', 'kw001']
+        kw = alt("Kw", *[lit(w) for w in words])
+        top = seqn("Top", star("Words", seqn("Word", kw, lit(' '))), eof())
+        g = Grammar()
+        g.add(top)
+        g.set_literal_tables()
+        self.assertIsNotNone(kw.literals)
+        text = 'kw299 kw000 kw012 a b kw001 '
+        for pn in [top.apply(text, 0, 0), g.parse(top, text), g.compile(top).run(text)]:
+            self.assertTrue(pn.matched)
+            self.assertEqual(len(text), pn.length)
+            words_pn = [w for w in pn.children[0].children if w.matched]
+            self.assertEqual(['kw299', 'kw000', 'kw012', 'a', 'b', 'kw001'], [str(w.children[0].children[0]) for w in words_pn])
+            self.assertIs(kw.subrules[1], words_pn[5].children[0].children[0].rule)
+        # Ordered choice: 'a' comes before 'ab', so 'ab ' doesn't parse
+        self.assertFalse(top.apply('ab ', 0, 0).matched)
+        self.assertFalse(g.parse(top, 'ab ').matched)
+        self.assertFalse(g.compile(top).run('ab ').matched)
+        self.assertFalse(top.apply('kw300 ', 0, 0).matched)
+        self.assertFalse(top.apply('kw00 ', 0, 0).matched)
+
+    def check_same_tree(self, expected, actual):
+        stack = [(expected, actual)]
+        while stack:
+            e, a = stack.pop()
+            self.assertEqual((e.rule, e.start, e.length, e.matched), (a.rule, a.start, a.length, a.matched))
+            self.assertEqual(len(e.children), len(a.children))
+            stack.extend(zip(e.children, a.children))
+
+    def test_parse(self):
+        g = Grammar()
+        num = reg('[0-9]+')
+        item = alt("Item", seqn("Pair", num, lit(':'), num), num, lit('x'))
+        items = seqn("Items", item, star("More", seqn("Comma", lit(','), item)), eof())
+        g.add(items)
+        for text in ['1', '1:2,x,3', '1:2,', 'x,y', '']:
+            expected = items.apply(text, 0, 0)
+            self.check_same_tree(expected, g.parse(items, text))
+
+    # R = '(' R ')' | 'x', nested far deeper than the recursion limit
+    def test_parse_deep(self):
+        rec = lazy()
+        r = alt("R", seqn("Paren", lit('('), rec, lit(')')), lit('x'))
+        rec.set_rule(r)
+        g = Grammar()
+        g.add(r)
+        n = 50000
+        ptree = g.parse(r, '(' * n + 'x' + ')' * n)
+        self.assertTrue(ptree.matched)
+        self.assertEqual(2 * n + 1, ptree.length)
+        ptree = g.parse(r, '(' * n + 'x' + ')' * (n - 1))
+        self.assertFalse(ptree.matched)
+
+    def test_parse_left_recursion(self):
+        rec = lazy()
+        r = alt("R", seqn("Ra", rec, lit('a')), lit('b'))
+        rec.set_rule(r)
+        top = seqn("Top", r, lit(';'))
+        g = Grammar()
+        g.add(top)
+        g.set_nullables()
+        g.set_left_recursives()
+        ptree = g.parse(top, 'baaa;')
+        self.assertTrue(ptree.matched)
+        self.assertEqual(5, ptree.length)
+
+    def test_char_classes(self):
+        ident = reg('[a-zA-Z_][a-zA-Z0-9_]*')
+        num = reg('[0-9]+')
+        ws = reg(r'\s+')
+        word = reg(r'\w+')
+        value = alt("Value", num, ident, reg('[+-]'), seqn("Quoted", lit('"'), word, lit('"')))
+        top = seqn("Top", Opt(ws), star("Values", seqn("Item", value, Opt(ws))), eof())
+        g = Grammar()
+        g.add(top)
+        g.set_firsts()
+        g.set_dispatch_tables()
+        texts = ['a1 22 _x\t+ -\n"w_1"', 'x', '12ab', ' 3 ', '"é" 4', '1 $', '']
+        expected = [repr_tree(top.apply(t, 0, 0)) for t in texts]
+        g.set_char_classes()
+        self.assertEqual(['CharRun', 'CharRun', 'CharSet'], [c.__class__.__name__ for c in value.subrules[:3]])
+        self.assertIs(value.subrules[1], value.dispatch['x'][0])
+        self.assertEqual('CharRun', top.subrules[0].subrules[0].__class__.__name__)
+        self.assertIs(word, value.subrules[3].subrules[1])
+        for t, e in zip(texts, expected):
+            self.assertEqual(e, repr_tree(top.apply(t, 0, 0)))
+            self.assertEqual(e, repr_tree(g.parse(top, t)))
+
+
+def repr_tree(pn):
+    found = []
+    stack = [pn]
+    while stack:
+        node = stack.pop()
+        found.append((str(node.rule), node.start, node.length, node.matched))
+        stack.extend(reversed(node.children))
+    return found
@@ -0,0 +1,96 @@
+from src.grammar import Grammar
+from src.rules import lit, reg, seqn, alt, star, lazy, eof, Opt
+
+
+# Nodes of a tree in preorder
+def nodes(tree):
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.children))
+
+
+# A tree as a list of (rule name, start, length, matched, child count) in
+# preorder, for comparing trees built by different engines
+def shape(tree):
+    return [(str(n.rule), n.start, n.length, n.matched, len(n.children)) for n in nodes(tree)]
+
+
+# Statements separated by ';': if x then y, x=1 or x=y, and x==1. Returns the
+# grammar and its start rule.
+def statement_grammar():
+    ws = reg(r'\s+')
+    ident = reg(r'[a-z]+')
+    num = reg(r'[0-9]+')
+    stmt = alt("Stmt",
+               seqn("If", lit('if'), ws, ident, ws, lit('then'), ws, ident),
+               seqn("Assign", ident, lit('='), alt("Value", num, ident)),
+               seqn("Cmp", ident, lit('=='), num))
+    root = seqn("Prog", stmt, star("More", seqn("Next", lit(';'), stmt)), eof())
+    g = Grammar()
+    g.add(root)
+    return g, root
+
+
+# Statements ending in ';', x=value or a bare value, where a value is a
+# number, a call f() or f(x), or a name, with whitespace as statements of its
+# own
+def program_grammar():
+    ident = reg(r'[a-z]+')
+    num = reg(r'[0-9]+')
+    value = alt("Value", num, seqn("Call", ident, lit('('), Opt(ident), lit(')')), ident)
+    stmt = alt("Stmt",
+               seqn("Assign", ident, lit('='), value, lit(';')),
+               seqn("Expr", value, lit(';')),
+               seqn("Skip", reg(r'\s+')))
+    return seqn("Prog", star("Stmts", stmt), eof())
+
+
+# Lines of comma separated numbers and names
+def rows_grammar():
+    field = alt("Field", reg(r'[0-9]+'), reg(r'[a-z]+'))
+    row = seqn("Row", field, star("Fields", seqn("Next", lit(','), field)), lit('\n'))
+    return star("Rows", row)
+
+
+# Comma separated items, each a number, a pair n:m or x, with an optional ';'
+# at the end
+def items_grammar():
+    num = reg('[0-9]+')
+    item = alt("Item", seqn("Pair", num, lit(':'), num), num, lit('x'))
+    return seqn("Items", item, star("More", seqn("Comma", lit(','), item)), Opt(lit(';')), eof())
+
+
+# Statements ending in ';' of left-recursive binary expressions over numbers,
+# with an optional '!' at the end
+def expression_grammar():
+    rec = lazy()
+    num = reg('[0-9]+')
+    op = alt("Op", *[lit(c) for c in '+-*/%^&|'])
+    expr = alt("Expr", seqn("Binary", rec, op, num), num)
+    rec.set_rule(expr)
+    stmt = seqn("Stmt", expr, lit(';'))
+    return seqn("Prog", star("Stmts", stmt), Opt(lit('!')), eof())
+
+
+# Space separated fields, each a left-recursive sum of numbers or a name.
+# Returns the analyzed grammar and its start rule.
+def line_grammar():
+    rec = lazy()
+    num = reg('[0-9]+')
+    sum_ = alt("Sum", seqn("Add", rec, lit('+'), num), num)
+    rec.set_rule(sum_)
+    field = alt("Field", sum_, reg('[a-z]+'))
+    line = seqn("Line", field, star("Fields", seqn("Next", lit(' '), field)), eof())
+    g = Grammar()
+    g.add(line)
+    g.set_left_recursives()
+    return g, line
+
+
+# Comma separated numbers and ranges n-m
+def list_grammar():
+    num = reg('[0-9]+')
+    value = alt("Value", seqn("Range", num, lit('-'), num), num)
+    return seqn("List", value, star("More", seqn("Next", lit(','), value)), eof())
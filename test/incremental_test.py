@@ -0,0 +1,96 @@
+import random
+import unittest
+
+from src.incremental import IncrementalParser
+from src.rules import lit, seqn, alt, star, eof
+
+from helpers import nodes, shape, program_grammar
+
+
+class TestIncrementalMethods(unittest.TestCase):
+
+    def check(self, parser, old, text, start: int, old_end: int, new_end: int):
+        tree = parser.reparse(text, start, old_end, new_end)
+        self.assertEqual(shape(parser.rule.apply(text, 0, 0)), shape(tree), (old, text))
+        return tree
+
+    def test_edits(self):
+        root = program_grammar()
+        text = 'a=1; b=f(x); c=d; 42; e=g();'
+        parser = IncrementalParser(root)
+        self.assertTrue(parser.parse(text).matched)
+        edits = [(5, 6, 'bb'),      # grow an identifier
+                 (0, 0, 'z=9;'),   # insert at the start
+                 (len(text), len(text), ' h=1;'),
+                 (9, 10, ''),      # delete a character
+                 (2, 3, '7'),
+                 (10, 11, 'f'),    # make the parse fail
+                 (10, 11, ';')]
+        for start, old_end, new in edits:
+            old = text
+            text = text[:start] + new + text[old_end:]
+            self.check(parser, old, text, start, old_end, start + len(new))
+
+    # An identifier ending where the edit starts looked at the edited character
+    def test_lookahead(self):
+        root = program_grammar()
+        parser = IncrementalParser(root)
+        parser.parse('ab=1;')
+        tree = self.check(parser, 'ab=1;', 'abc=1;', 2, 2, 3)
+        self.assertTrue(tree.matched)
+        # Alt('a', 'ab'): the failed or shorter literal depends on the next character
+        r = seqn("S", alt("A", lit('ab'), lit('a')), star("Bs", lit('b')), eof())
+        parser = IncrementalParser(r)
+        parser.parse('abb')
+        self.check(parser, 'abb', 'aXbb', 1, 1, 2)
+
+    def test_random_edits(self):
+        root = program_grammar()
+        rnd = random.Random(7)
+        pieces = ['a=1;', 'b=f(x);', 'cd;', ' ', '12;', 'e=g();', '(', ';', 'x']
+        text = ''.join(rnd.choice(pieces) for _ in range(40))
+        parser = IncrementalParser(root)
+        parser.parse(text)
+        for _ in range(200):
+            start = rnd.randrange(len(text) + 1)
+            old_end = min(len(text), start + rnd.randrange(4))
+            new = ''.join(rnd.choice(pieces) for _ in range(rnd.randrange(3)))
+            old = text
+            text = text[:start] + new + text[old_end:]
+            self.check(parser, old, text, start, old_end, start + len(new))
+
+    # Only the statement around the edit is parsed again
+    def test_reuse(self):
+        root = program_grammar()
+        text = 'a=1; b=f(x); ' * 1000
+        parser = IncrementalParser(root)
+        old_nodes = {id(n) for n in nodes(parser.parse(text))}
+        pos = len(text) // 2
+        text = text[:pos] + 'q=2; ' + text[pos:]
+        tree = self.check(parser, None, text, pos, pos, pos + 5)
+        fresh = [n for n in nodes(tree) if id(n) not in old_nodes]
+        self.assertTrue(len(fresh) < 50)
+        self.assertTrue(parser.reused >= 2)
+
+    # The work of a reparse: old nodes looked at and memo lookups grow with the
+    # statements of the top level Star, not the whole tree, and only nodes
+    # after the edit are shifted
+    def test_reuse_work(self):
+        root = program_grammar()
+        text = 'a=1; b=f(x); ' * 1000
+        statements = 4000
+        parser = IncrementalParser(root)
+        total = len(list(nodes(parser.parse(text))))
+        pos = text.index('1', len(text) // 2)
+        text = text[:pos] + '2' + text[pos + 1:]
+        self.check(parser, None, text, pos, pos + 1, pos + 1)
+        self.assertEqual(0, parser.shifted)
+        self.assertLess(parser.visited, statements + 20)
+        self.assertLess(parser.lookups, statements + 20)
+        self.assertLess(parser.visited + parser.lookups, total // 3)
+        # Inside the last call, f(x) becomes f(xy)
+        pos = len(text) - 3
+        text = text[:pos] + 'y' + text[pos:]
+        self.check(parser, None, text, pos, pos, pos + 1)
+        self.assertLess(parser.shifted, 20)
+        self.assertLess(parser.lookups, statements + 20)
@@ -0,0 +1,55 @@
+import unittest
+
+from src.lexer import Scanner
+from src.rules import lit, reg
+
+from helpers import statement_grammar
+
+
+class TestLexerMethods(unittest.TestCase):
+
+    def test_scan(self):
+        g, root = statement_grammar()
+        tokens = g.tokenize('if x then y;iffy=3;a==12')
+        self.assertIsNone(tokens.error_pos)
+        kinds = [(k if isinstance(k, str) else k.pattern, s, e) for k, s, e in tokens.tokens()]
+        self.assertEqual(('if', 0, 2), kinds[0])
+        self.assertEqual((r'\s+', 2, 3), kinds[1])
+        self.assertEqual(('then', 5, 9), kinds[4])
+        # Longest match: iffy is an identifier, == is one token
+        self.assertEqual(('[a-z]+', 12, 16), kinds[8])
+        self.assertEqual(('==', 20, 22), kinds[-2])
+        self.assertEqual(('[0-9]+', 22, 24), kinds[-1])
+
+    def test_priority(self):
+        scanner = Scanner([reg(r'[a-z]+'), lit('if')])
+        tokens = scanner.scan('if')
+        self.assertEqual([('if', 0, 2)], list(tokens.tokens()))
+
+    def test_error(self):
+        g, root = statement_grammar()
+        tokens = g.tokenize('a=1;b=$')
+        self.assertEqual(6, tokens.error_pos)
+        self.assertFalse(root.apply(tokens, 0, 0).matched)
+
+    def test_parse(self):
+        g, root = statement_grammar()
+        for text in ['if x then y;iffy=3;a==12', 'a=b', 'iffy = 3', 'if x then']:
+            expected = root.apply(text, 0, 0)
+            tokens = g.tokenize(text)
+            ptree = root.apply(tokens, 0, 0)
+            self.assertEqual(expected.matched, ptree.matched)
+            self.assertEqual(expected.length, ptree.length)
+            ptree = g.parse(root, tokens)
+            self.assertEqual(expected.matched, ptree.matched)
+            ptree = g.compile(root).run(tokens)
+            self.assertEqual(expected.matched, ptree.matched)
+
+    # Terminals only match whole tokens
+    def test_token_boundaries(self):
+        g, root = statement_grammar()
+        self.assertTrue(root.apply('ify=3', 0, 0).matched)
+        tokens = g.tokenize('ify=3')
+        self.assertFalse(tokens.startswith('if', 0))
+        self.assertEqual(3, tokens.match(reg(r'[a-z]+').pattern, 0))
+        self.assertTrue(root.apply(tokens, 0, 0).matched)
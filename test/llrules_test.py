@@ -1,7 +1,7 @@
 import unittest
 
 from src.llrules import Parser
-from src.rules import lit, eps, eof, plus, star, reg, seqn, alt, InvalidRegexDefinitionError, lazy, Rule
+from src.rules import lit, eps, eof, plus, star, reg, seqn, alt, InvalidRegexDefinitionError, lazy, Rule, Opt
 
 
 class TestParserMethods(unittest.TestCase):
@@ -24,14 +24,58 @@ class TestParserMethods(unittest.TestCase):
         parser = Parser('b')
         pn = parser.apply_rule(rec, 0)
         print(pn)
-        # self.check(pn, True, 0, 1)
-        # Rule.DEBUG = True
-        # pn = r.apply("bac", 0, 0)
-        # self.check(pn, True, 0, 2)
-        # pn = r.apply("baa", 0, 0)
-        # self.check(pn, True, 0, 3)
-        # pn = r.apply("baaac", 0, 0)
-        # self.check(pn, True, 0, 4)
+        self.check(pn, True, 0, 1)
+        pn = Parser("bac").apply(r, 0)
+        self.check(pn, True, 0, 2)
+        pn = Parser("baa").apply(r, 0)
+        self.check(pn, True, 0, 3)
+        pn = Parser("baaac").apply(r, 0)
+        self.check(pn, True, 0, 4)
+        self.assertEqual(3, pn.children[0].children[0].length)
+
+    # A --> Br | eps
+    # B --> Cd
+    # C --> At
+    def test_indirect_left_recursion(self):
+        rec = lazy()
+        C = seqn("At", rec, lit('t'))
+        B = seqn("Cd", C, lit('d'))
+        A = alt("Br|eps", seqn("Br", B, lit('r')), eps())
+        rec.set_rule(A)
+        pn = Parser("tdrtdr").apply(A, 0)
+        self.check(pn, True, 0, 6)
+        pn = Parser("tdx").apply(A, 0)
+        self.check(pn, True, 0, 0)
+
+    # E -> E + T | T, T -> T * n | n
+    def test_nested_left_recursion(self):
+        erec = lazy()
+        trec = lazy()
+        T = alt("T", seqn("T*n", trec, lit('*'), reg('[0-9]+')), reg('[0-9]+'))
+        trec.set_rule(T)
+        E = alt("E", seqn("E+T", erec, lit('+'), T), T)
+        erec.set_rule(E)
+        pn = Parser("1+2*3+4").apply(E, 0)
+        self.check(pn, True, 0, 7)
+        plus = pn.children[0]
+        self.assertEqual(5, plus.children[0].length)
+        self.assertEqual(plus, plus.children[0].parent)
+
+    def test_star_opt(self):
+        r = seqn("S", star("As", lit('a')), Opt(lit('b')), eof())
+        self.check(Parser("aaab").apply(r), True, 0, 4)
+        self.check(Parser("aaa").apply(r), True, 0, 3)
+        self.check(Parser("aac").apply(r), False, 0, 0)
+
+    # An empty Seq fails here as in Rule.apply
+    def test_empty_seq(self):
+        empty = seqn("Empty")
+        top = alt("Top", seqn("S", empty, lit('a')), seqn("T", Opt(empty), lit('b')), star("Es", empty))
+        for text in ["a", "b", ""]:
+            expected = top.apply(text, 0, 0)
+            pn = Parser(text).apply(top)
+            self.assertEqual((expected.matched, expected.length), (pn.matched, pn.length), text)
+        self.check(Parser("a").apply(empty), False, 0, 0)
 
     def check(self, pn, matched, start: int, length: int):
         self.assertEqual(start, pn.start)
@@ -0,0 +1,45 @@
+import unittest
+
+from src.memo import MemoTable
+from src.rules import lit, seqn, star, Opt, ParseContext
+
+
+class TestMemoMethods(unittest.TestCase):
+
+    def test_get_put(self):
+        memo = MemoTable()
+        r = lit('a')
+        self.assertIsNone(memo.get(r, 0))
+        node = r.apply('a', 0, 0)
+        memo.put(r, 0, node)
+        self.assertIs(node, memo.get(r, 0))
+        self.assertEqual(1, len(memo))
+        self.assertEqual(1, memo.hits)
+        self.assertEqual(1, memo.misses)
+
+    def test_eviction(self):
+        memo = MemoTable(max_size=3)
+        r = lit('a')
+        s = lit('b')
+        for pos in range(5):
+            memo.put(r, pos, r.apply('aaaaa', 0, pos))
+            memo.put(s, pos, s.apply('aaaaa', 0, pos))
+        self.assertTrue(len(memo) <= 3)
+        self.assertIsNone(memo.get(r, 0))
+        self.assertIsNotNone(memo.get(r, 4))
+
+    # S -> (X '!')? X, the optional branch fails after parsing X
+    def test_packrat_reuse(self):
+        x = star("X", lit('a'))
+        r = seqn("S", Opt(seqn("X!", x, lit('!'))), x)
+        ctx = ParseContext(memo=MemoTable())
+        pn = r.apply("aaaa", 0, 0, ctx=ctx)
+        self.check(pn, True, 0, 4)
+        self.assertEqual(1, ctx.memo.hits)
+        pn_plain = r.apply("aaaa", 0, 0)
+        self.check(pn_plain, True, 0, 4)
+
+    def check(self, pn, matched, start: int, length: int):
+        self.assertEqual(start, pn.start)
+        self.assertEqual(matched, pn.matched)
+        self.assertEqual(length, pn.length)
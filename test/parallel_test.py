@@ -0,0 +1,61 @@
+import unittest
+
+from src.flattree import FlatTree
+from src.grammar import Grammar
+from src.parallel import parse_parallel, split_points
+from src.rules import lit, reg, seqn
+
+from helpers import shape, rows_grammar
+
+
+class TestParallelMethods(unittest.TestCase):
+
+    def text(self, rows):
+        return ''.join(f'{i},abc,{i * 7}\n' if i % 3 else 'xyz\n' for i in range(rows))
+
+    def test_split_points(self):
+        text = self.text(100)
+        for sync in [lit('\n'), reg(r'\n+'), r'(?m)^[0-9x]', seqn("NL", lit('\n'))]:
+            points = split_points(text, sync, 8)
+            self.assertEqual(0, points[0])
+            self.assertEqual(len(text), points[-1])
+            self.assertTrue(len(points) > 4)
+            for p in points[1:-1]:
+                self.assertEqual('\n', text[p - 1])
+
+    # With one worker the chunks are parsed in turn, through the same stitching
+    def test_stitch(self):
+        rows = rows_grammar()
+        for text in [self.text(200), '', '1,2\n', self.text(50) + '1,,\n' + self.text(50)]:
+            expected = shape(rows.apply(text, 0, 0))
+            for chunks in [1, 3, 16]:
+                tree = parse_parallel(rows, text, lit('\n'), workers=1, chunks=chunks)
+                self.assertEqual(expected, shape(tree), (text[:20], chunks))
+
+    def test_flat(self):
+        rows = rows_grammar()
+        for text in [self.text(200), '', self.text(50) + '1,,\n' + self.text(50)]:
+            expected = FlatTree.from_node(rows.apply(text, 0, 0))
+            for chunks in [1, 3, 16]:
+                tree = parse_parallel(rows, text, lit('\n'), workers=1, chunks=chunks, flat=True)
+                self.assertEqual(len(expected), len(tree))
+                for name in ('start', 'length', 'parent', 'first_child', 'next_sibling', 'last_child'):
+                    self.assertEqual(getattr(expected, name), getattr(tree, name), name)
+                self.assertEqual([expected.rules[r] for r in expected.rule], [tree.rules[r] for r in tree.rule])
+
+    def test_processes(self):
+        rows = rows_grammar()
+        g = Grammar()
+        g.add(rows)
+        text = self.text(20000)
+        tree = g.parse_parallel(rows, text, r'(?m)^', workers=2)
+        self.assertEqual(shape(rows.apply(text, 0, 0)), shape(tree))
+        self.assertEqual(len(text), tree.length)
+        for child in tree.children:
+            self.assertIs(tree, child.parent)
+        tree = parse_parallel(rows, text, lit('\n'), workers=2, flat=True)
+        self.assertEqual(FlatTree.from_node(rows.apply(text, 0, 0)).start, tree.start)
+
+    def test_not_star(self):
+        with self.assertRaises(TypeError):
+            parse_parallel(seqn("S", lit('a')), 'a', lit('\n'))
@@ -0,0 +1,88 @@
+import io
+import itertools
+import unittest
+
+from src.grammar import Grammar
+from src.memo import MemoTable
+from src.profiler import Profiler
+from src.rules import lit, seqn, alt, star, ParseContext
+
+from helpers import list_grammar
+
+
+class TestProfilerMethods(unittest.TestCase):
+
+    # Each clock reading is 1000ns after the previous one
+    def profiler(self):
+        ticks = itertools.count(0, 1000)
+        return Profiler(lambda: next(ticks))
+
+    def test_counts(self):
+        top = list_grammar()
+        profiler = self.profiler()
+        self.assertTrue(top.apply('1-2,3', 0, 0, ctx=ParseContext(tracer=profiler)).matched)
+        stats = {str(s.rule): s for s in profiler.stats.values()}
+        value = stats['Value']
+        self.assertEqual((2, 2, 0, 4), (value.calls, value.successes, value.failures, value.consumed))
+        # '3' is not a Range, so the number is read again by the second alternative
+        self.assertEqual((1, 1), (stats['Range'].failures, value.backtracks))
+        self.assertEqual(1, stats['Reg'].reevaluations)
+        self.assertTrue(0 < value.wasted < value.inclusive)
+        total = sum(s.exclusive for s in profiler.stats.values())
+        self.assertEqual(stats['List'].inclusive, total)
+
+    def test_memo_hits(self):
+        top = list_grammar()
+        profiler = self.profiler()
+        top.apply('1-2,3', 0, 0, ctx=ParseContext(memo=MemoTable(), tracer=profiler))
+        stats = {str(s.rule): s for s in profiler.stats.values()}
+        self.assertEqual(1, stats['Reg'].memo_hits)
+        self.assertEqual(0, stats['Reg'].reevaluations)
+
+    def test_recursion(self):
+        item = alt("Item", lit('x'), seqn("Group", lit('('), star("Items", lit('x')), lit(')')))
+        nested = star("Nested", alt("Outer", seqn("Paren", lit('['), item, lit(']')), item))
+        profiler = self.profiler()
+        nested.apply('[x](xx)x', 0, 0, ctx=ParseContext(tracer=profiler))
+        stats = {str(s.rule): s for s in profiler.stats.values()}
+        self.assertEqual(stats['Nested'].inclusive, sum(s.exclusive for s in profiler.stats.values()))
+        self.assertTrue(all(s.active == 0 for s in profiler.stats.values()))
+
+    def test_grammar(self):
+        top = list_grammar()
+        g = Grammar()
+        g.add(top)
+        g.tracer = self.profiler()
+        g.parse(top, '1,2')
+        list(g.parse_many(top, ['3', '4-5']))
+        stats = {str(s.rule): s for s in g.tracer.stats.values()}
+        self.assertEqual((3, 3), (stats['List'].calls, stats['List'].successes))
+
+    # Reevaluations are counted per parse
+    def test_reevaluations(self):
+        top = list_grammar()
+        g = Grammar()
+        g.add(top)
+        g.tracer = self.profiler()
+        for text in ['1', '2', '3']:
+            g.parse(top, text)
+        stats = {str(s.rule): s for s in g.tracer.stats.values()}
+        self.assertEqual((3, 0), (stats['List'].calls, stats['List'].reevaluations))
+
+    def test_exports(self):
+        top = list_grammar()
+        profiler = self.profiler()
+        top.apply('1-2,3', 0, 0, ctx=ParseContext(tracer=profiler))
+        out = io.StringIO()
+        profiler.table(out, limit=3)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[0].startswith('rule'))
+        self.assertTrue(lines[0].endswith('wasted ms'))
+        out = io.StringIO()
+        profiler.collapsed(out)
+        stacks = dict(line.rsplit(' ', 1) for line in out.getvalue().splitlines())
+        self.assertIn('List;Value;Range;/[0-9]+/', stacks)
+        self.assertIn("List;More;Next;','", stacks)
+        total = sum(s.exclusive for s in profiler.stats.values())
+        self.assertEqual(total // 1000, sum(int(v) for v in stacks.values()))
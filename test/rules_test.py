@@ -1,38 +1,53 @@
+import io
 import unittest
 
 from src.grammar import Grammar
-from src.rules import lit, eps, eof, plus, star, reg, seqn, alt, InvalidRegexDefinitionError, lazy, Rule
+from src.memo import MemoTable
+from src.sbuffer import SBuffer
+from src.rules import lit, eps, eof, plus, star, reg, seqn, alt, cut, recover, InvalidRegexDefinitionError, lazy, Rule, Opt, ParseContext, Recover, CharSet, CharRun, ParseNode
 
 
 class TestRulesMethods(unittest.TestCase):
 
     def test_lit(self):
-        pn = lit("Hello").apply("Say Hello to me", 0)
+        pn = lit("Hello").apply("Say Hello to me", 0, 0)
         self.check(pn, False, 0, 0)
-        pn = lit("Hello").apply("Say Hello to me", 4)
+        pn = lit("Hello").apply("Say Hello to me", 0, 4)
         self.check(pn, True, 4, 5)
-        pn = lit("Hello").apply("Hel", 0)
+        pn = lit("Hello").apply("Hel", 0, 0)
         self.check(pn, False, 0, 0)
 
     def test_reg(self):
-        pn = reg("S[a-z][a-z]").apply("Say Hello to me", 0)
+        pn = reg("S[a-z][a-z]").apply("Say Hello to me", 0, 0)
         self.check(pn, True, 0, 3)
-        pn = reg(" [a-z][a-z] ").apply("Say Hello to me", 0)
+        pn = reg(" [a-z][a-z] ").apply("Say Hello to me", 0, 0)
         self.check(pn, False, 0, 0)
         with self.assertRaises(InvalidRegexDefinitionError):
-            pn = reg("a*").apply("bc", 0)
+            pn = reg("a*").apply("bc", 0, 0)
 
+    # A pattern that matches the empty string is rejected when the rule is
+    # built; one that does so only in context fails where it does. Matches are
+    # anchored at pos.
+    def test_reg_empty_match(self):
+        self.assertRaises(InvalidRegexDefinitionError, reg, "a*")
+        self.assertRaises(InvalidRegexDefinitionError, reg, "(")
+        ahead = reg("(?=b)")
+        self.check(ahead.apply("ab", 0, 0), False, 0, 0)
+        with self.assertRaises(InvalidRegexDefinitionError):
+            ahead.apply("ab", 0, 1)
+        self.check(reg("b").apply("ab", 0, 0), False, 0, 0)
+        self.check(reg("b").apply("ab", 0, 1), True, 1, 1)
 
     def test_seqn(self):
-        pn = seqn("MySeq", lit('a'), lit('b')).apply("abcd", 0)
+        pn = seqn("MySeq", lit('a'), lit('b')).apply("abcd", 0, 0)
         self.check(pn, True, 0, 2)
-        pn = seqn("MySeq", lit('a'), lit('b')).apply("abcd", 2)
+        pn = seqn("MySeq", lit('a'), lit('b')).apply("abcd", 0, 2)
         self.check(pn, False, 2, 0)
 
     def test_alt(self):
-        pn = alt("MyAlt", lit('a'), lit('b')).apply("abcd", 0)
+        pn = alt("MyAlt", lit('a'), lit('b')).apply("abcd", 0, 0)
         self.check(pn, True, 0, 1)
-        pn = alt("MyAlt", lit('a'), lit('b')).apply("abcd", 2)
+        pn = alt("MyAlt", lit('a'), lit('b')).apply("abcd", 0, 2)
         self.check(pn, False, 2, 0)
 
     def test_star(self):
@@ -44,21 +59,29 @@ class TestRulesMethods(unittest.TestCase):
         pn = altr.apply("aabcd", 0, 0)
         self.check(pn, True, 0, 2)
 
+    # Choice rules also work without a ParseContext, like terminals
+    def test_apply_internal_no_ctx(self):
+        for r, text, length in [(alt("A", lit('a'), lit('b')), "b", 1), (Opt(lit('a')), "b", 0),
+                                (star("As", lit('a')), "aab", 2)]:
+            node = ParseNode(r, 0)
+            r.apply_internal(text, 0, 0, node)
+            self.check(node, True, 0, length)
+
     # R -> Ra | b
     def test_left_recursion(self):
         rec = lazy()
         r = alt("R", seqn("Ra", rec, lit('a')), lit('b'))
         rec.set_rule(r)
-        r.remove_lazy_rules()
+        g = Grammar()
+        g.add(r)
+        g.set_nullables()
+        g.set_left_recursives()
         pn = r.apply("b", 0, 0)
         self.check(pn, True, 0, 1)
-        r.init_memo()
         pn = r.apply("bac", 0, 0)
         self.check(pn, True, 0, 2)
-        r.init_memo()
         pn = r.apply("baa", 0, 0)
         self.check(pn, True, 0, 3)
-        r.init_memo()
         pn = r.apply("baaac", 0, 0)
         self.check(pn, True, 0, 4)
 
@@ -70,10 +93,8 @@ class TestRulesMethods(unittest.TestCase):
         r.remove_lazy_rules()
         pn = r.apply("ab", 0, 0)
         self.check(pn, True, 0, 2)
-        r.init_memos()
         pn = r.apply("aabb", 0, 0)
         self.check(pn, True, 0, 4)
-        r.init_memos()
         pn = r.apply("aacbb", 0, 0)
         self.check(pn, True, 0, 0)
 
@@ -96,6 +117,151 @@ class TestRulesMethods(unittest.TestCase):
         self.check(pn, True, 0, 3)
 
 
+    def test_traverse_deep(self):
+        r = lit('x')
+        for i in range(5000):
+            r = seqn(f"S{i}", r)
+        names = []
+        r.traverse(set(), lambda rule, out: out.append(str(rule)), names)
+        self.assertEqual(5001, len(names))
+        self.assertEqual('S4999', names[0])
+        self.assertEqual('x', names[-1])
+
+    # 'let' x = ... commits: a bad right hand side fails the Alt instead of
+    # falling back to an expression statement
+    def test_cut(self):
+        ident = reg('[a-z]+')
+        stmt = alt("Stmt", seqn("Let", lit('let '), cut(), ident, lit('='), ident), ident)
+        g = Grammar()
+        g.add(stmt)
+        for text, matched, length in [('let a=b', True, 7), ('let a=', False, 0), ('let 1', False, 0), ('letter', True, 6)]:
+            for pn in [stmt.apply(text, 0, 0), g.parse(stmt, text)]:
+                self.check(pn, matched, 0, length)
+        # Without the cut, 'let' falls back to an identifier
+        self.check(alt("S", seqn("Let", lit('let '), ident, lit('=')), ident).apply('let a', 0, 0), True, 0, 3)
+
+    def test_cut_opt_star(self):
+        item = seqn("Item", lit('('), cut(), reg('[0-9]+'), lit(')'))
+        items = star("Items", item)
+        g = Grammar()
+        g.add(items)
+        for pn in [items.apply('(1)(2)', 0, 0), g.parse(items, '(1)(2)')]:
+            self.check(pn, True, 0, 6)
+        for pn in [items.apply('(1)(x)', 0, 0), g.parse(items, '(1)(x)')]:
+            self.check(pn, False, 0, 0)
+        opt = Opt(item)
+        self.check(opt.apply('', 0, 0), True, 0, 0)
+        self.check(opt.apply('(x', 0, 0), False, 0, 0)
+        # A cut commits only its innermost choice point
+        outer = alt("Outer", seqn("Inner", Opt(item), lit('!')), lit('(x'))
+        self.check(outer.apply('(x', 0, 0), True, 0, 2)
+
+    # A memo hit on a rule whose cut committed the enclosing choice commits it again
+    def test_cut_memo(self):
+        x = seqn("X", lit('a'), cut())
+        inner = alt("Inner", seqn("XB", x, lit('b')), lit('a'))
+        outer = alt("Outer", seqn("InnerBang", inner, lit('!')), alt("Rest", seqn("XC", x, lit('c')), lit('ax')))
+        g = Grammar()
+        g.add(outer)
+        for memo in [None, MemoTable()]:
+            for text, matched, length in [('ax', False, 0), ('ac', True, 2), ('ab!', True, 3)]:
+                for parse in [lambda ctx: outer.apply(text, 0, 0, ctx=ctx), lambda ctx: g.parse(outer, text, 0, ctx)]:
+                    if memo is not None:
+                        memo.clear()
+                    self.check(parse(ParseContext(memo=memo)), matched, 0, length)
+
+    # Past a cut, memo rows and streamed input before it are dropped
+    def test_cut_memory(self):
+        record = seqn("Record", reg('[a-z]+'), lit(':'), cut(), reg('[0-9]+'), lit(';'))
+        doc = seqn("Doc", lit('#'), star("Records", record), eof())
+        text = '#' + 'abc:123;' * 2000
+        memo = MemoTable()
+        buf = SBuffer(io.StringIO(text), chunk_size=32)
+        pn = doc.apply(buf, 0, 0, ctx=ParseContext(memo=memo))
+        self.check(pn, True, 0, len(text))
+        self.assertTrue(buf.offset > len(text) - 100)
+        self.assertTrue(len(memo) < 100)
+
+    def test_furthest_failure(self):
+        num = reg('[0-9]+')
+        pair = seqn("Pair", num, alt("Sep", lit(':'), lit('=')), num)
+        doc = seqn("Doc", pair, star("More", seqn("Next", lit(','), pair)), eof())
+        g = Grammar()
+        g.add(doc)
+        for setup in [None, g.set_dispatch_tables]:
+            if setup is not None:
+                g.set_firsts()
+                setup()
+            for parse in [lambda ctx: doc.apply('1:2,3;4', 0, 0, ctx=ctx), lambda ctx: g.parse(doc, '1:2,3;4', 0, ctx)]:
+                ctx = ParseContext()
+                self.assertFalse(parse(ctx).matched)
+                failure = ctx.failure()
+                self.assertEqual(5, failure.pos)
+                expected = "expected ':' or '=' at 5" if setup is None else 'expected Sep at 5'
+                self.assertEqual(expected, str(failure))
+        ctx = ParseContext()
+        self.assertTrue(doc.apply('1=2', 0, 0, ctx=ctx).matched)
+        # The Star's guard stopped it furthest
+        self.assertEqual("expected Next at 3", str(ctx.failure()))
+
+    def test_recover(self):
+        num = reg('[0-9]+')
+        line = recover("Line", seqn("Pair", num, lit(':'), num, lit('\n')), lit('\n'))
+        doc = seqn("Doc", star("Lines", line), eof())
+        text = '1:2\n3:x\n4:5\n6::7\n8'
+        g = Grammar()
+        g.add(doc)
+        buf = SBuffer(io.StringIO(text), chunk_size=4)
+        for parse in [lambda ctx: doc.apply(text, 0, 0, ctx=ctx), lambda ctx: g.parse(doc, text, 0, ctx),
+                      lambda ctx: doc.apply(buf, 0, 0, ctx=ctx)]:
+            ctx = ParseContext()
+            pn = parse(ctx)
+            self.check(pn, True, 0, len(text))
+            lines = [c for c in pn.children[0].children if c.matched]
+            self.assertEqual(['Pair', 'ERROR', 'Pair', 'ERROR', 'ERROR'], [str(c.children[-1].rule) for c in lines])
+            self.assertEqual([(6, 4, 8), (14, 12, 17), (18, 17, 18)], [(e.pos, e.start, e.end) for e in ctx.errors])
+            self.assertEqual("expected /[0-9]+/ at 6, skipped 4:8", str(ctx.errors[0]))
+        sync = Recover('ERROR', seqn("Semi", lit(';'), lit(';')))
+        self.check(sync.apply('ab;c;;d', 0, 0), True, 0, 6)
+        self.check(sync.apply('ab', 0, 2), False, 2, 0)
+
+    # Errors come back with a memoized record, and go with a failed attempt
+    def test_recover_memo(self):
+        num = reg('[0-9]+')
+        line = recover("Line", seqn("Pair", num, lit(':'), num, lit('\n')), lit('\n'))
+        doc = alt("Doc", seqn("D1", star("Lines", line), lit('!')), seqn("D2", star("Lines2", line), eof()))
+        g = Grammar()
+        g.add(doc)
+        text = '1:x\n2:3\n'
+        for memo in [None, MemoTable()]:
+            for parse in [lambda ctx: doc.apply(text, 0, 0, ctx=ctx), lambda ctx: g.parse(doc, text, 0, ctx)]:
+                if memo is not None:
+                    memo.clear()
+                ctx = ParseContext(memo=memo)
+                self.check(parse(ctx), True, 0, len(text))
+                self.assertEqual([(2, 0, 4)], [(e.pos, e.start, e.end) for e in ctx.errors])
+                self.assertEqual("expected /[0-9]+/ at 2, skipped 0:4", str(ctx.errors[0]))
+        self.assertGreater(memo.hits, 0)
+
+    def test_char_terminals(self):
+        sign = CharSet('[+-]')
+        ident = CharRun('[a-z_][a-z0-9_]*')
+        ws = CharRun(r'\s+')
+        self.assertEqual(frozenset('+-'), sign.first_chars())
+        self.check(sign.apply('a-', 0, 1), True, 1, 1)
+        self.check(sign.apply('-', 0, 1), False, 1, 0)
+        self.check(ident.apply('x1_y z', 0, 0), True, 0, 4)
+        self.check(ident.apply('x z', 0, 0), True, 0, 1)
+        self.check(ident.apply('1x', 0, 0), False, 0, 0)
+        self.check(ws.apply('a \t\u3000b', 0, 1), True, 1, 3)
+        ctx = ParseContext()
+        ident.apply('x=9', 0, 2, ctx=ctx)
+        self.assertEqual('expected /[a-z_][a-z0-9_]*/ at 2', str(ctx.failure()))
+        buf = SBuffer(io.StringIO('  abc_12+'), chunk_size=2)
+        self.check(seqn("S", ws, ident, sign).apply(buf, 0, 0), True, 0, 9)
+        self.assertRaises(InvalidRegexDefinitionError, CharSet, '[0-9]+')
+        self.assertRaises(InvalidRegexDefinitionError, CharRun, 'ab')
+
     def check(self, pn, matched, start: int, length: int):
         self.assertEqual(start, pn.start)
         self.assertEqual(matched, pn.matched)
@@ -0,0 +1,86 @@
+import io
+import re
+import unittest
+
+from src.grammar import Grammar
+from src.sbuffer import SBuffer
+from src.rules import lit, reg, seqn, star, alt, eof
+from src.vm import Program
+
+
+class TestSBufferMethods(unittest.TestCase):
+
+    def test_indexing(self):
+        text = 'abcdefghijklmnopqrstuvwxyz'
+        buf = SBuffer(io.StringIO(text), chunk_size=4)
+        self.assertEqual('a', buf[0])
+        self.assertEqual('k', buf[10])
+        self.assertEqual('xyz', buf[23:30])
+        self.assertEqual('', buf[26:27])
+        self.assertTrue(buf.startswith('mnop', 12))
+        self.assertFalse(buf.startswith('xyz!', 23))
+        self.assertEqual(len(text), len(buf))
+        with self.assertRaises(IndexError):
+            buf[26]
+
+    def test_match_across_chunks(self):
+        text = 'ab' + '1' * 20 + 'cd'
+        buf = SBuffer(io.StringIO(text), chunk_size=3)
+        self.assertEqual(22, buf.match(re.compile(r'\d+'), 2))
+        self.assertIsNone(buf.match(re.compile(r'\d+'), 0))
+        self.assertEqual(24, buf.match(re.compile(r'[a-d]+'), 22))
+
+    def test_release(self):
+        buf = SBuffer(io.StringIO('x' * 100), chunk_size=8)
+        buf.release(4)
+        self.assertEqual('x', buf[0])
+        buf.release(50)
+        self.assertEqual(50, buf.offset)
+        self.assertEqual('xx', buf[50:52])
+        with self.assertRaises(IndexError):
+            buf[10]
+        with self.assertRaises(IndexError):
+            buf.startswith('x', 49)
+
+    def test_parse(self):
+        text = ''.join(f'key{i} = {i * 7};\n' for i in range(200))
+        entry = seqn("Entry", reg(r'[a-z]+\d+'), reg(r' *= *'), reg(r'\d+'), lit(';'), reg(r'\n'))
+        doc = seqn("Doc", star("Entries", entry), eof())
+        ptree = doc.apply(text, 0, 0)
+        sptree = doc.apply(SBuffer(io.StringIO(text), chunk_size=64), 0, 0)
+        self.assertTrue(sptree.matched)
+        self.assertEqual(ptree.length, sptree.length)
+        self.assertEqual(len(text), sptree.length)
+        self.assertEqual(200, len([c for c in sptree.children[0].children if c.matched]))
+
+    # A top level Star releases what it consumed
+    def test_star_release(self):
+        text = 'ab' * 1000
+        buf = SBuffer(io.StringIO(text), chunk_size=16)
+        root = star("S", alt("AB", lit('ab'), lit('ba')))
+        ptree = root.apply(buf, 0, 0)
+        self.assertEqual(len(text), ptree.length)
+        self.assertTrue(buf.offset > 0)
+        self.assertTrue(len(buf.window) < 64)
+
+    def test_dispatch(self):
+        g = Grammar()
+        value = alt("Value", lit('true'), lit('false'), reg(r'\d+'))
+        g.add(value)
+        g.set_firsts()
+        g.set_dispatch_tables()
+        self.assertIsNotNone(value.dispatch)
+        for text in ['true', 'false', '123']:
+            ptree = value.apply(SBuffer(io.StringIO(text), chunk_size=2), 0, 0)
+            self.assertTrue(ptree.matched)
+            self.assertEqual(len(text), ptree.length)
+        for text in ['tru', 'x', '']:
+            self.assertFalse(value.apply(SBuffer(io.StringIO(text), chunk_size=2), 0, 0).matched)
+
+    def test_vm(self):
+        text = 'aaabbb'
+        root = seqn("Root", reg('a+'), lit('bbb'), eof())
+        ptree = Program(root).run(SBuffer(io.StringIO(text), chunk_size=2))
+        self.assertTrue(ptree.matched)
+        self.assertEqual(6, ptree.length)
+        self.assertFalse(Program(root).run(SBuffer(io.StringIO(text + 'b'), chunk_size=2)).matched)
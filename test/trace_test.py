@@ -0,0 +1,81 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+
+from src.memo import MemoTable
+from src.rules import lit, seqn, alt, Rule, ParseContext
+from src.trace import EventTracer, PrintTracer, Tracer, ENTER, EXIT, HIT
+
+
+class TestTraceMethods(unittest.TestCase):
+
+    def test_events(self):
+        a = lit('a')
+        r = alt("AB", lit('b'), a)
+        tracer = EventTracer()
+        pn = r.apply("a", 0, 0, ctx=ParseContext(tracer=tracer))
+        self.assertTrue(pn.matched)
+        kinds = [(e.kind, str(e.rule), e.pos, e.depth) for e in tracer.events]
+        self.assertEqual([(ENTER, 'AB', 0, 0), (ENTER, 'b', 0, 1), (EXIT, 'b', 0, 1),
+                          (ENTER, 'a', 0, 1), (EXIT, 'a', 0, 1), (EXIT, 'AB', 0, 0)], kinds)
+        last = tracer.events[-1]
+        self.assertEqual((True, 1), (last.matched, last.length))
+        self.assertEqual((False, 0), (tracer.events[2].matched, tracer.events[2].length))
+
+    def test_sink(self):
+        seen = []
+        r = seqn("S", lit('a'), lit('b'))
+        r.apply("ab", 0, 0, ctx=ParseContext(tracer=EventTracer(seen.append)))
+        self.assertEqual(6, len(seen))
+
+    def test_memo_hit(self):
+        a = lit('a')
+        r = alt("A", seqn("AB", a, lit('b')), a)
+        tracer = EventTracer()
+        r.apply("a", 0, 0, ctx=ParseContext(memo=MemoTable(), tracer=tracer))
+        hits = [e for e in tracer.events if e.kind == HIT]
+        self.assertEqual(1, len(hits))
+        self.assertIs(a, hits[0].rule)
+
+    def test_custom_tracer(self):
+        class Failing(Tracer):
+            def enter(self, rule, buffer, pos, depth):
+                raise AssertionError('tracer called')
+        ctx = ParseContext(tracer=Tracer())
+        lit('a').apply("a", 0, 0, ctx=ctx)
+        with self.assertRaises(AssertionError):
+            lit('a').apply("a", 0, 0, ctx=ParseContext(tracer=Failing()))
+
+    def test_print(self):
+        out = io.StringIO()
+        r = seqn("S", lit('a'), lit('b'))
+        r.apply("ab", 0, 0, ctx=ParseContext(tracer=PrintTracer(out)))
+        lines = out.getvalue().splitlines()
+        self.assertEqual(6, len(lines))
+        self.assertEqual('0: Start: apply S at 0 : ...[ab]...', lines[0])
+        saved = Rule.DEBUG
+        try:
+            Rule.DEBUG = True
+            self.assertIsInstance(ParseContext().tracer, PrintTracer)
+        finally:
+            Rule.DEBUG = saved
+
+    # Flagging a rule prints its calls without installing a tracer
+    def test_debug_flag(self):
+        b = lit('b')
+        r = seqn("S", lit('a'), b)
+        out = io.StringIO()
+        saved = Rule.DEBUG
+        try:
+            Rule.DEBUG = False
+            b.debug = True
+            with redirect_stdout(out):
+                r.apply("ab", 0, 0)
+            b.debug = False
+            self.assertIsNone(ParseContext().tracer)
+        finally:
+            b.debug = False
+            Rule.DEBUG = saved
+        lines = out.getvalue().splitlines()
+        self.assertEqual(['1: Start: apply b at 1 : ...[b]...', '1: End match:True length:1: apply b to 1 : ...[b]...'],
+                         [line.strip() for line in lines])
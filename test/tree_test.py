@@ -1,6 +1,7 @@
+import io
 import unittest
 
-from src.tree import Tree
+from src.tree import Tree, IndexedTree
 
 
 class TestTreeMethods(unittest.TestCase):
@@ -61,5 +62,83 @@ class TestTreeMethods(unittest.TestCase):
         node.replace_child(child2, child3)
         self.assertEqual(child3, node.children[-1])
 
+    def test_pprint_deep(self):
+        root = Tree('n0')
+        node = root
+        for i in range(1, 20000):
+            child = Tree(f'n{i}')
+            node.add(child)
+            node = child
+        out = io.StringIO()
+        root.pprint_tree(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(20000, len(lines))
+        self.assertTrue(lines[-1].endswith('`- n19999'))
+
+
+class TestIndexedTreeMethods(unittest.TestCase):
+
+    def check(self, node):
+        for i, c in enumerate(node.children):
+            self.assertEqual(i, c.idx)
+            self.assertIs(node, c.parent)
+
+    def test_edit(self):
+        node = IndexedTree('a')
+        kids = [IndexedTree(c) for c in 'bcdef']
+        node.add(*kids)
+        self.check(node)
+        node.remove(kids[1])
+        self.assertIsNone(kids[1].parent)
+        self.assertEqual('bdef', ''.join(c.value for c in node.children))
+        self.check(node)
+        node.insert(kids[1], 0)
+        self.check(node)
+        other = IndexedTree('x')
+        node.replace_child(kids[3], other)
+        self.assertEqual('cbdxf', ''.join(c.value for c in node.children))
+        self.assertIsNone(kids[3].parent)
+        self.check(node)
+        self.assertIs(kids[4], node.remove_last())
+        node.remove(kids[0])
+        node.remove(kids[2])
+        self.assertEqual('cx', ''.join(c.value for c in node.children))
+        self.check(node)
+
+    # A node added to two parents is still found in the first
+    def test_shared(self):
+        a = IndexedTree('a')
+        b = IndexedTree('b')
+        a.add(IndexedTree('x'), IndexedTree('y'))
+        shared = IndexedTree('s')
+        a.add(shared)
+        b.add(shared)
+        self.assertEqual(0, shared.idx)
+        a.remove(shared)
+        self.assertEqual('xy', ''.join(c.value for c in a.children))
+
+    def test_wide(self):
+        node = IndexedTree('star')
+        n = 200000
+        node.add(*[IndexedTree(i) for i in range(n)])
+        self.assertEqual(n - 1, node.children[-1].idx)
+        for i in range(n // 2):
+            node.remove(node.children[-1])
+        child = node.children[n // 4]
+        node.replace_child(child, IndexedTree('r'))
+        self.assertEqual(n // 4, node.children[n // 4].idx)
+
+    def test_from_arrays(self):
+        nodes = IndexedTree.from_arrays([-1, 0, 1, 1, 0], 'abcde')
+        root = nodes[0]
+        self.assertEqual(['b', 'e'], [c.value for c in root.children])
+        self.assertEqual(['c', 'd'], [c.value for c in nodes[1].children])
+        self.assertEqual(1, nodes[3].idx)
+        self.assertTrue(nodes[4].children == ())
+        out = io.StringIO()
+        root.pprint_tree(out)
+        self.assertEqual(5, len(out.getvalue().splitlines()))
+
+
 if __name__ == '__main__':
     unittest.main()
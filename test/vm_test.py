@@ -0,0 +1,101 @@
+import unittest
+
+from src.grammar import Grammar
+from src.rules import lit, eps, eof, star, reg, seqn, alt, lazy, Opt, Rule, ParseNode
+from src.vm import Program, GrammarCompileError, compile_rule, SEQ, LIT, TERM
+
+
+class Upper(Rule):
+    def __init__(self):
+        Rule.__init__(self, "Upper")
+
+    def apply_internal(self, buffer, depth: int, pos: int, node: ParseNode, ctx=None):
+        if pos < len(buffer) and buffer[pos].isupper():
+            node.length = 1
+            node.matched = True
+
+
+class TestVmMethods(unittest.TestCase):
+
+    def test_compile(self):
+        r = seqn("S", lit('a'), star("Bs", lit('b')))
+        program = compile_rule(r)
+        self.assertEqual(4, len(program))
+        self.assertEqual(SEQ, program.op[0])
+        self.assertEqual(LIT, program.op[1])
+        self.assertEqual([1, 2], list(program.subs[program.lo[0]:program.hi[0]]))
+
+    def test_same_as_apply(self):
+        rec = lazy()
+        num = reg('[0-9]+')
+        term = alt("Term", seqn("Paren", lit('('), rec, lit(')')), num)
+        expr = seqn("Expr", term, star("Ops", seqn("Op", alt("+-", lit('+'), lit('-')), term)))
+        rec.set_rule(expr)
+        top = seqn("Top", expr, Opt(lit(';')), eof())
+        top.remove_lazy_rules()
+        program = Program(top)
+        for text in ["1", "1+2", "(1+2)-3;", "((4))", "1+", "(1", "", "12-(3+4)-5"]:
+            expected = top.apply(text, 0, 0)
+            pn = program.run(text)
+            self.assertEqual((expected.matched, expected.length), (pn.matched, pn.length), text)
+            recognized = program.run(text, build_tree=False)
+            self.assertEqual((expected.matched, expected.length), (recognized.matched, recognized.length), text)
+            self.assertEqual(0, recognized.child_count())
+
+    # Rules without subrules, and an Alt whose literal table finds no match
+    def test_empty_rules(self):
+        empty = seqn("Empty")
+        words = alt("Words", *[lit(w) for w in ['ab', 'cd', 'ef', 'gh', 'ij', 'kl', 'mn', 'op']])
+        top = alt("Top", seqn("S", lit('a'), empty), seqn("T", Opt(empty), alt("None"), lit('b')), words, lit('x'))
+        g = Grammar()
+        g.add(top)
+        for literals in [False, True]:
+            if literals:
+                g.set_literal_tables()
+            program = Program(top)
+            for text in ["a", "b", "ab", "x", "op", ""]:
+                expected = top.apply(text, 0, 0)
+                for pn in [program.run(text), g.parse(top, text)]:
+                    self.assertEqual((expected.matched, expected.length), (pn.matched, pn.length), text)
+            self.check(program.run("a"), False, 0, 0)
+
+    def test_tree(self):
+        r = seqn("S", alt("AB", lit('a'), lit('b')), star("Cs", lit('c')), eps())
+        pn = Program(r).run("bcc")
+        self.check(pn, True, 0, 3)
+        ab, cs, e = pn.children
+        self.assertEqual(['b'], [str(c) for c in ab.children])
+        self.assertEqual(2, cs.child_count())
+        self.check(cs.children[1], True, 2, 1)
+        self.assertEqual(pn, cs.parent)
+
+    def test_generic_terminal(self):
+        r = star("Uppers", Upper())
+        program = Program(r)
+        self.assertEqual(TERM, program.op[1])
+        self.check(program.run("ABc"), True, 0, 2)
+
+    def test_left_recursion_rejected(self):
+        rec = lazy()
+        r = alt("R", seqn("Ra", rec, lit('a')), lit('b'))
+        rec.set_rule(r)
+        g = Grammar()
+        g.add(r)
+        # Not flagged yet, so it compiles; the program is dropped once it is
+        g.compile(r)
+        g.set_left_recursives()
+        with self.assertRaises(GrammarCompileError):
+            g.compile(r)
+
+    def test_grammar_cache(self):
+        r = seqn("S", lit('a'), lit('b'))
+        g = Grammar()
+        g.add(r)
+        self.assertIs(g.compile(r), g.compile(r))
+        self.check(g.compile(r).run("ab"), True, 0, 2)
+        self.check(g.compile(r).run("xab", 1), True, 1, 2)
+
+    def check(self, pn, matched, start: int, length: int):
+        self.assertEqual(start, pn.start)
+        self.assertEqual(matched, pn.matched)
+        self.assertEqual(length, pn.length)